@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows - blokady tylko między wątkami jednego procesu
+    fcntl = None
+
+from config import (
+    ENCODINGS_DIR,
+    ANN_NLIST,
+    ANN_NPROBE,
+    ANN_MIN_GALLERY_SIZE,
+    ANN_TRAIN_SAMPLE,
+    ANN_KMEANS_ITERATIONS,
+    ANN_LOG_COMPACT_RATIO
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🧭 ANN - INDEKS IVF (INVERTED FILE) DLA DUŻYCH GALERII
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Zamiast liczyć dystans do KAŻDEGO wiersza galerii:
+#   1. k-means dzieli przestrzeń encodingów na `nlist` komórek (centroidy)
+#   2. każdy wiersz galerii trafia do listy najbliższego centroidu
+#   3. zapytanie sprawdza tylko `nprobe` najbliższych list (dokładne dystanse)
+#
+# Na dysku (ENCODINGS_DIR, obok faces.db):
+#   ivf_<klucz>.npz  - centroidy + przypisania pesel -> lista (snapshot)
+#   ivf_<klucz>.log  - dopisywane przyrostowo przypisania z register_person
+#   ivf_<klucz>.lock - blokada (flock) zapisu snapshotu i logu między procesami
+#
+# Trenowanie k-means nie blokuje żądań: `build-ann` / serve.py przed fork()
+# albo wątek w tle - do tego czasu wyszukiwanie dokładne
+# ═══════════════════════════════════════════════════════════════════════════
+
+POINTS_PER_CENTROID = 39    # Minimum punktów na centroid przy trenowaniu
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _file_lock(path):
+    """Wyłączna blokada pliku `path` - między procesami (flock) i wątkami"""
+    if fcntl is None:
+        with _thread_locks_guard:
+            lock = _thread_locks.setdefault(path, threading.Lock())
+        with lock:
+            yield
+        return
+
+    with open(path, 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _sidecar_path(path, extension):
+    """Plik obok snapshotu: ivf_<klucz>.npz -> ivf_<klucz><extension>"""
+    return os.path.splitext(path)[0] + extension
+
+
+def _read_log(path):
+    """Przypisania dopisane do logu: [(pesel, nr listy)] w kolejności zapisu"""
+    entries = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 2:
+                    entries.append((parts[0], int(parts[1])))
+    return entries
+
+
+def _nearest_centroids(vectors, centroids, centroid_sq_norms):
+    """Indeks najbliższego centroidu dla każdego wektora (N x nlist w jednym matmul)"""
+    scores = centroid_sq_norms[None, :] - 2.0 * (vectors @ centroids.T)
+    return np.argmin(scores, axis=1).astype(np.int32)
+
+
+def train_centroids(matrix, nlist: int, iterations: int = ANN_KMEANS_ITERATIONS,
+                    sample_size: int = ANN_TRAIN_SAMPLE, seed: int = 0) -> np.ndarray:
+    """
+    ⭐ k-means (Lloyd) w NumPy na próbce galerii
+    Deterministyczny (stały seed) - ten sam zbiór daje te same centroidy
+    """
+    rng = np.random.default_rng(seed)
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if matrix.shape[0] > sample_size:
+        sample = matrix[rng.choice(matrix.shape[0], sample_size, replace=False)]
+    else:
+        sample = matrix
+
+    nlist = max(1, min(nlist, sample.shape[0]))
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _nearest_centroids(sample, centroids, np.einsum('ij,ij->i', centroids, centroids))
+
+        counts = np.bincount(labels, minlength=nlist).astype(np.float32)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+
+        # Pusta komórka -> losowy punkt z próbki (nie tracimy centroidów)
+        if empty.any():
+            centroids[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    ⭐ Indeks IVF-Flat nad galerią (FaceGallery)
+    Indeks nie kopiuje wektorów - trzyma tylko centroidy i przypisania
+    pesel -> lista, a dystanse liczy na gallery.matrix
+    """
+
+    def __init__(self, centroids, assignments: dict = None, path: str = None):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.assignments = dict(assignments or {})    # pesel -> nr listy
+        self.path = path
+        self.log_entries = 0
+        self.mtime = None               # st_mtime_ns wczytanego / zapisanego snapshotu
+
+        # Powiązanie z konkretną galerią: (gallery, order, offsets)
+        # odbudowywane po przeładowaniu galerii
+        self._binding = None
+        self._lock = threading.RLock()
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    # ───────────────────────────────────────────────────────────────────────
+    # Budowa / aktualizacja
+    # ───────────────────────────────────────────────────────────────────────
+
+    @classmethod
+    def build(cls, gallery, nlist: int = ANN_NLIST, path: str = None):
+        """Wytrenuj centroidy na galerii i przypisz wszystkie wiersze"""
+        nlist = min(nlist, max(1, len(gallery) // POINTS_PER_CENTROID))
+        print(f"   🧭 Training IVF index: {len(gallery)} vectors, nlist={nlist}")
+
+        centroids = train_centroids(gallery.matrix, nlist)
+        index = cls(centroids, path=path)
+        labels = index.assign(gallery.matrix)
+        index.assignments = dict(zip(gallery.pesels.tolist(), labels.tolist()))
+        return index
+
+    def assign(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        return _nearest_centroids(vectors, self.centroids, self.centroid_sq_norms)
+
+    def add(self, pesel: str, encoding):
+        """⭐ Przyrostowe dodanie / aktualizacja jednej osoby (register_person)"""
+        label = int(self.assign(encoding)[0])
+
+        with self._lock:
+            self.assignments[pesel] = label
+            self._binding = None
+
+        if self.path:
+            with _file_lock(self._lock_path()):
+                with open(self._log_path(), 'a', encoding='utf-8') as log:
+                    log.write(f"{pesel}\t{label}\n")
+
+            with self._lock:
+                self.log_entries += 1
+                compact = self.log_entries > max(1000, len(self.assignments) * ANN_LOG_COMPACT_RATIO)
+
+            # Log urósł -> przepisz snapshot
+            if compact:
+                self.save()
+
+        return label
+
+    def bind(self, gallery):
+        """
+        Zbuduj listy wierszy dla danej galerii
+        Wiersze bez zapisanego przypisania (np. dodane przez Node.js) są
+        przypisywane do centroidów teraz - bez ponownego trenowania;
+        tylko w pamięci (ścieżka zapytania), na dysk trafią przy następnym save()
+        """
+        binding = self._binding
+        if binding is not None and binding[0] is gallery:
+            return binding[1], binding[2]
+
+        with self._lock:
+            labels = np.empty(len(gallery), dtype=np.int32)
+            missing = []
+
+            for row, pesel in enumerate(gallery.pesels.tolist()):
+                label = self.assignments.get(pesel)
+                if label is None:
+                    missing.append(row)
+                else:
+                    labels[row] = label
+
+            if missing:
+                rows = np.asarray(missing)
+                labels[rows] = self.assign(gallery.matrix[rows])
+                for row, label in zip(missing, labels[rows].tolist()):
+                    self.assignments[gallery.pesels[row]] = label
+                print(f"   🧭 IVF: assigned {len(missing)} new vectors to existing centroids")
+
+            # CSR: wiersze posortowane wg listy + offsety
+            order = np.argsort(labels, kind='stable').astype(np.int64)
+            offsets = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+            self._binding = (gallery, order, offsets)
+            return order, offsets
+
+    # ───────────────────────────────────────────────────────────────────────
+    # Wyszukiwanie
+    # ───────────────────────────────────────────────────────────────────────
+
+    def candidates(self, gallery, query, nprobe: int = ANN_NPROBE) -> np.ndarray:
+        """Wiersze galerii z `nprobe` najbliższych list"""
+        order, offsets = self.bind(gallery)
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        scores = self.centroid_sq_norms - 2.0 * (self.centroids @ query)
+
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = np.argpartition(scores, nprobe - 1)[:nprobe]
+
+        return np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes])
+
+    def search(self, gallery, query, nprobe: int = ANN_NPROBE):
+        """
+        Przybliżony najbliższy sąsiad
+        Zwraca: (pesel, distance) lub (None, inf) jeśli sprawdzone listy są puste
+        """
+        results = self.search_top_k(gallery, query, 1, nprobe)
+        return results[0] if results else (None, float('inf'))
+
+    def search_top_k(self, gallery, query, k: int, nprobe: int = ANN_NPROBE):
+        """
+        Przybliżone k najbliższych sąsiadów (argpartition po kandydatach z list)
+        Zwraca: [(pesel, distance), ...] rosnąco - pusta lista gdy brak kandydatów
+        """
+        rows = self.candidates(gallery, query, nprobe)
+        k = min(int(k), rows.size)
+
+        if k <= 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        diff = gallery.matrix[rows] - query
+        distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+        best = np.argpartition(distances, k - 1)[:k] if k < rows.size else np.arange(rows.size)
+        best = best[np.argsort(distances[best], kind='stable')]
+        return [(gallery.pesels[rows[i]], float(distances[i])) for i in best]
+
+    # ───────────────────────────────────────────────────────────────────────
+    # Zapis / odczyt
+    # ───────────────────────────────────────────────────────────────────────
+
+    def _log_path(self) -> str:
+        return _sidecar_path(self.path, '.log')
+
+    def _lock_path(self) -> str:
+        return _sidecar_path(self.path, '.lock')
+
+    def save(self):
+        """
+        Zapisz snapshot (centroidy + przypisania) atomowo i wyczyść log
+        Pod blokadą pliku - wpisy dopisane do logu przez inne procesy trafiają do snapshotu
+        """
+        with _file_lock(self._lock_path()):
+            with self._lock:
+                self.assignments.update(_read_log(self._log_path()))
+                self._binding = None
+                pesels = np.array(list(self.assignments.keys()), dtype=str)
+                labels = np.array(list(self.assignments.values()), dtype=np.int32)
+
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp.npz"
+            try:
+                np.savez(tmp_path, centroids=self.centroids, pesels=pesels, labels=labels)
+                os.replace(tmp_path, self.path)
+                self.mtime = os.stat(self.path).st_mtime_ns
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            if os.path.exists(self._log_path()):
+                os.remove(self._log_path())
+
+            with self._lock:
+                self.log_entries = 0
+        print(f"   💾 IVF index saved: {self.path} ({len(pesels)} vectors)")
+
+    @classmethod
+    def load(cls, path: str):
+        """Wczytaj snapshot + dopisz przypisania z logu"""
+        with _file_lock(_sidecar_path(path, '.lock')):
+            with np.load(path) as data:
+                centroids = data['centroids']
+                assignments = dict(zip(data['pesels'].tolist(), data['labels'].tolist()))
+            entries = _read_log(_sidecar_path(path, '.log'))
+            mtime = os.stat(path).st_mtime_ns
+
+        index = cls(centroids, assignments, path=path)
+        index.mtime = mtime
+        index.assignments.update(entries)
+        index.log_entries = len(entries)
+
+        print(f"   📂 IVF index loaded: {path} ({len(index.assignments)} vectors, nlist={index.nlist})")
+        return index
+
+
+class AnnIndexManager:
+    """
+    ⭐ Indeksy IVF per galeria (model/wymiar), leniwie wczytywane z ENCODINGS_DIR
+    Brak indeksu przy galerii >= ANN_MIN_GALLERY_SIZE -> trenowanie w tle
+    (jeden proces trenuje, pozostałe czekają na blokadę i wczytują plik)
+    """
+
+    def __init__(self, directory: str = ENCODINGS_DIR):
+        self.directory = directory
+        self._indexes = {}
+        self._building = set()          # Klucze trenowane teraz w tle
+        self._lock = threading.RLock()
+
+    def path_for(self, key) -> str:
+        model_name, dimensions = key
+        return os.path.join(self.directory, f"ivf_{model_name}_{dimensions}.npz")
+
+    def get(self, key, gallery):
+        """
+        Indeks dla galerii albo None - wtedy wyszukiwanie dokładne
+        (galeria za mała albo indeks dopiero trenuje się w tle)
+        """
+        index = self._load(key)
+
+        if index is None:
+            if len(gallery) >= ANN_MIN_GALLERY_SIZE:
+                self._build_in_background(key, gallery)
+            return None
+
+        index.bind(gallery)
+        return index
+
+    def ensure(self, key, gallery):
+        """
+        Wczytaj albo wytrenuj indeks od razu (serve.py przed fork(), `build-ann`)
+        Zwraca indeks albo None (galeria za mała)
+        """
+        index = self._load(key)
+        if index is None and len(gallery) >= ANN_MIN_GALLERY_SIZE:
+            index = self._build(key, gallery)
+
+        if index is not None:
+            index.bind(gallery)
+        return index
+
+    def add(self, key, pesel: str, encoding):
+        """Przyrostowa aktualizacja istniejącego indeksu (brak indeksu -> nic do roboty)"""
+        index = self._load(key)
+        if index is not None:
+            label = index.add(pesel, encoding)
+            print(f"   🧭 IVF index updated: {pesel} -> list {label}")
+
+    def rebuild(self, key, gallery):
+        """Wytrenuj indeks od nowa (np. po dużej zmianie rozkładu galerii)"""
+        return self._build(key, gallery, replace=True)
+
+    def _load(self, key):
+        """
+        Indeks z pamięci albo z pliku (None gdy pliku nie ma)
+        Snapshot zmieniony na dysku (reindex, `build-ann`, kompaktacja logu w innym
+        procesie) -> wczytaj ponownie, jak GalleryCache po zmianie wersji galerii
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            path = self.path_for(key)
+
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                return index
+
+            if index is not None and index.mtime == mtime:
+                return index
+
+            try:
+                loaded = IVFIndex.load(path)
+            except Exception as e:
+                print(f"   ⚠️ Cannot load IVF index {path}: {e}")
+                return index
+
+            if index is not None:
+                print(f"   🔄 IVF index {key} changed on disk - reloaded")
+            self._indexes[key] = loaded
+            return loaded
+
+    def _build_in_background(self, key, gallery):
+        with self._lock:
+            if key in self._building:
+                return
+            self._building.add(key)
+
+        print(f"   🧭 IVF index {key} missing - training in background, exact search until ready")
+        threading.Thread(
+            target=self._build, args=(key, gallery), name=f'ivf-build-{key[0]}', daemon=True
+        ).start()
+
+    def _build(self, key, gallery, replace=False):
+        """
+        Trenowanie poza self._lock; blokada pliku - naraz trenuje jeden proces,
+        pozostałe po jej zwolnieniu wczytują gotowy snapshot
+        """
+        path = self.path_for(key)
+        index = None
+        try:
+            with _file_lock(_sidecar_path(path, '.build.lock')):
+                if not replace and os.path.exists(path):
+                    index = IVFIndex.load(path)
+                else:
+                    index = IVFIndex.build(gallery, path=path)
+                    index.save()
+        except Exception as e:
+            print(f"   ❌ IVF index {key} build failed: {e}")
+
+        with self._lock:
+            self._building.discard(key)
+            if index is not None:
+                self._indexes[key] = index
+        return index
+
+
+ann_indexes = AnnIndexManager()
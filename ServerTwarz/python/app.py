@@ -7,8 +7,13 @@ import os
 import json
 from werkzeug.utils import secure_filename
 
-from config import UPLOADS_DIR, FEATURE_EXTRACTION_ENABLED
+from config import UPLOADS_DIR, FEATURE_EXTRACTION_ENABLED, BATCH_MAX_IMAGES, TOP_K_MAX
 from face_recognition import FaceRecognizer
+from image_context import ImageContext
+from gallery import gallery_cache
+from result_cache import recognition_cache
+from embedding_cache import embedding_cache
+from jobs import registration_jobs, QueueFullError, fail_interrupted_jobs
 from utils import (
     init_db,
     get_person_by_pesel,
@@ -18,6 +23,7 @@ from utils import (
     get_face_features,
     get_all_face_features,
     get_statistics,
+    db_pool,
 )
 
 # Inicjalizacja Flask
@@ -31,6 +37,9 @@ app.config['UPLOAD_FOLDER'] = UPLOADS_DIR
 # Inicjalizuj bazę danych
 init_db()
 
+# Zadania rejestracji przerwane przez poprzednie zatrzymanie serwera (serve.py: rodzic, przed fork())
+fail_interrupted_jobs()
+
 # Inicjalizuj rozpoznawacz
 recognizer = FaceRecognizer()
 
@@ -40,17 +49,73 @@ recognizer = FaceRecognizer()
 def health():
     """
     Status serwisu rozpoznawania twarzy
+    503 dopóki modele nie są załadowane i rozgrzane (load balancer nie wyśle ruchu)
     """
     stats = get_statistics()
+    ready = recognizer.is_ready
     return jsonify({
-        "status": "ok",
+        "status": "ok" if ready else recognizer.warmup_status['state'],
+        "ready": ready,
         "service": "Advanced Face Recognition API v2.0",
         "primary_model": recognizer.models[0]['name'],
         "secondary_model": recognizer.models[1]['name'],
         "tertiary_model": recognizer.models[2]['name'],
         "feature_analysis": FEATURE_EXTRACTION_ENABLED,
-        "database": stats
-    }), 200
+        "warmup": recognizer.warmup_status,
+        "database": stats,
+        "gallery_cache": gallery_cache.stats(),
+        "db_pool": db_pool.stats(),
+        "registration_jobs": registration_jobs.stats(),
+        "micro_batch": recognizer.micro_batcher.stats(),
+        "result_cache": recognition_cache.stats(),
+        "embedding_cache": embedding_cache.stats()
+    }), 200 if ready else 503
+
+
+def get_request_data():
+    """Parametry żądania: JSON albo pola formularza / query string (multipart, surowe bajty)"""
+    if request.is_json:
+        return request.get_json() or {}
+    return request.values.to_dict()
+
+
+def get_uploaded_image():
+    """
+    ⭐ Zdjęcie przesłane w samym żądaniu - dekodowane z bufora w pamięci
+    (bez zapisu do uploads/, fsync, ponownego odczytu i usuwania pliku)
+    - multipart/form-data: część 'photo' (albo pierwszy plik)
+    - surowe body: Content-Type image/* lub application/octet-stream
+
+    Zwraca: (ImageContext, None), (None, None) gdy żądanie nie zawiera zdjęcia,
+    (None, komunikat) gdy bajtów nie da się zdekodować
+    """
+    data = None
+
+    if request.files:
+        upload = request.files.get('photo') or next(iter(request.files.values()))
+        data = upload.read()
+    elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        data = request.get_data(cache=False)
+
+    if data is None:
+        return None, None
+
+    if not data:
+        return None, "Puste zdjęcie w żądaniu"
+
+    context = ImageContext.from_bytes(data)
+    if context is None:
+        return None, "Nie można zdekodować przesłanego zdjęcia"
+
+    print(f"📦 Image decoded from request body ({len(data) / 1024:.1f} KB, {context.shape[1]}x{context.shape[0]})")
+    return context, None
+
+
+def parse_bool(value) -> bool:
+    """Flaga z JSON (bool) albo z formularza / query string ('true', '1', ...)"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'tak')
+    return bool(value)
 
 
 # ✅ ENDPOINT 2: Rejestracja twarzy
@@ -64,26 +129,40 @@ def register_face_encoding():
         "pesel": "12345678901",
         "photo_path": "/uploads/photo.jpg"
     }
+
+    Albo zdjęcie bezpośrednio w żądaniu (bez pliku w uploads/):
+    - multipart/form-data: pole 'pesel' + plik 'photo'
+    - surowe body (image/jpeg, ...) + ?pesel=12345678901
+
+    "async": true -> 202 + ZadanieId od razu, rejestracja w tle (status: GET /api/jobs/<id>)
     
     ⚠️ WAŻNE: Ta osoba MUSI już być w bazie danych w tabeli 'faces'
     (Node.js API musi ją najpierw zarejestrować)
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         pesel = data.get('pesel')
         photo_path = data.get('photo_path')
+        run_async = parse_bool(data.get('async'))
+
+        image, image_error = get_uploaded_image()
+        if image_error:
+            return jsonify({
+                "Sukces": False,
+                "Wiadomosc": image_error
+            }), 400
 
         print(f"\n{'=' * 70}")
         print(f"📝 REGISTER FACE ENCODING ENDPOINT")
         print(f"{'=' * 70}")
         print(f"PESEL: {pesel}")
-        print(f"Photo Path: {photo_path}")
+        print(f"Photo: {image or photo_path}")
 
-        if not pesel or not photo_path:
+        if not pesel or not (image or photo_path):
             print(f"❌ Missing parameters!")
             return jsonify({
                 "Sukces": False,
-                "Wiadomosc": "Brakuje pesel lub photo_path"
+                "Wiadomosc": "Brakuje pesel lub zdjęcia (photo_path albo plik)"
             }), 400
 
         print(f"🔍 Looking for person in database (faces table)...")
@@ -99,32 +178,32 @@ def register_face_encoding():
 
         print(f"✅ Person found: {person['first_name']} {person['last_name']}")
 
-        print(f"🧠 Registering face with advanced analysis...")
-        success = recognizer.register_person(pesel, photo_path)
-
-        if success:
-            print(f"✅ SUCCESS! Encoding + Features registered for {pesel}")
-            
-            # Pobierz cechy
-            features = get_face_features(pesel)
-            features_summary = {}
-            if features:
-                features_summary = {
-                    'eye_color': features.get('eye_color', {}).get('name', 'unknown') if isinstance(features.get('eye_color'), dict) else features.get('eye_color', 'unknown'),
-                    'hair_color': features.get('hair_color', {}).get('name', 'unknown') if isinstance(features.get('hair_color'), dict) else features.get('hair_color', 'unknown'),
-                    'eye_distance': round(features.get('eye_distance', {}).get('normalized_distance', 0), 3) if isinstance(features.get('eye_distance'), dict) else 0,
-                    'skin_tone': features.get('skin_tone', {}).get('skin_tone', 'unknown') if isinstance(features.get('skin_tone'), dict) else features.get('skin_tone', 'unknown')
-                }
-            
+        # ⭐ Tryb asynchroniczny - zadanie do kolejki, wątek żądania wolny od razu
+        if run_async:
+            try:
+                job = registration_jobs.submit(registration_job, pesel, image or photo_path, person, pesel=pesel)
+            except QueueFullError as e:
+                print(f"⚠️ Registration queue full: {e}")
+                return jsonify({
+                    "Sukces": False,
+                    "Wiadomosc": "Kolejka rejestracji pełna - spróbuj ponownie za chwilę"
+                }), 503, {'Retry-After': '5'}
+
+            status_url = f"/api/jobs/{job['id']}"
+            print(f"📥 Registration queued as job {job['id']}")
             return jsonify({
                 "Sukces": True,
                 "Pesel": pesel,
-                "Imie": person['first_name'],
-                "Nazwisko": person['last_name'],
-                "Model": recognizer.models[0]['name'],
-                "CechySzczegoly": features_summary,
-                "Wiadomosc": f"Encoding + cechy zarejestrowane dla: {person['first_name']} {person['last_name']}"
-            }), 200
+                "ZadanieId": job['id'],
+                "Status": job['state'],
+                "StatusUrl": status_url,
+                "Wiadomosc": "Rejestracja przyjęta do kolejki"
+            }), 202, {'Location': status_url}
+
+        result = run_registration(pesel, image or photo_path, person)
+
+        if result:
+            return jsonify(result), 200
         else:
             print(f"❌ FAILED! Could not extract encoding")
             return jsonify({
@@ -142,6 +221,126 @@ def register_face_encoding():
         }), 500
 
 
+def features_summary(features):
+    """Skrót cech szczególnych do odpowiedzi rejestracji"""
+    if not features:
+        return {}
+    return {
+        'eye_color': features.get('eye_color', {}).get('name', 'unknown') if isinstance(features.get('eye_color'), dict) else features.get('eye_color', 'unknown'),
+        'hair_color': features.get('hair_color', {}).get('name', 'unknown') if isinstance(features.get('hair_color'), dict) else features.get('hair_color', 'unknown'),
+        'eye_distance': round(features.get('eye_distance', {}).get('normalized_distance', 0), 3) if isinstance(features.get('eye_distance'), dict) else 0,
+        'skin_tone': features.get('skin_tone', {}).get('skin_tone', 'unknown') if isinstance(features.get('skin_tone'), dict) else features.get('skin_tone', 'unknown')
+    }
+
+
+def run_registration(pesel, image, person):
+    """
+    Rejestracja osoby (encodingi + cechy) i odpowiedź z podsumowaniem cech
+    Zwraca: dict odpowiedzi albo None gdy nie udało się wyciągnąć encodingu
+    """
+    print(f"🧠 Registering face with advanced analysis...")
+    if not recognizer.register_person(pesel, image):
+        return None
+
+    print(f"✅ SUCCESS! Encoding + Features registered for {pesel}")
+
+    return {
+        "Sukces": True,
+        "Pesel": pesel,
+        "Imie": person['first_name'],
+        "Nazwisko": person['last_name'],
+        "Model": recognizer.models[0]['name'],
+        "Modele": [m['name'] for m in recognizer.registration_models],
+        "CechySzczegoly": features_summary(get_face_features(pesel)),
+        "Wiadomosc": f"Encoding + cechy zarejestrowane dla: {person['first_name']} {person['last_name']}"
+    }
+
+
+def registration_job(pesel, image, person):
+    """Rejestracja w tle - niepowodzenie kończy zadanie stanem 'failed'"""
+    result = run_registration(pesel, image, person)
+    if result is None:
+        raise RuntimeError("Nie można wyciągnąć encodingu z zdjęcia")
+    return result
+
+
+# ✅ ENDPOINT 2b: Status zadania w tle (rejestracja async)
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Stan zadania: queued / running / done / failed
+    + czasy (oczekiwanie w kolejce, przetwarzanie) i wynik z podsumowaniem cech
+    """
+    job = registration_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            "Sukces": False,
+            "Wiadomosc": "Nieznane zadanie (albo wygasło)"
+        }), 404
+
+    return jsonify({
+        "ZadanieId": job['id'],
+        "Status": job['state'],
+        "Pesel": job.get('pesel'),
+        "Utworzono": job['created_at'],
+        "Rozpoczeto": job['started_at'],
+        "Zakonczono": job['finished_at'],
+        "Czasy": job['timings'],
+        "CechySzczegoly": (job['result'] or {}).get('CechySzczegoly'),
+        "Wynik": job['result'],
+        "Blad": job['error']
+    }), 200
+
+
+def format_recognition_result(result):
+    """Formatuj wynik FaceRecognizer do odpowiedzi JSON (zaokrąglone wyniki)"""
+    response = {
+        "Rozpoznano": result.get("Rozpoznano", False),
+        "Wiadomosc": result.get("Wiadomosc", "")
+    }
+
+    if result.get("Rozpoznano"):
+        response.update({
+            "Pesel": result.get("Pesel"),
+            "Imie": result.get("Imie"),
+            "Nazwisko": result.get("Nazwisko"),
+            "DataUrodzenia": result.get("DataUrodzenia"),
+            "Plec": result.get("Plec"),
+            "Pewnosc": round(result.get("Pewnosc", 0), 4),
+            "CechyWynik": round(result.get("CechyWynik", 0), 4),
+            "WynikPolaczony": round(result.get("WynikPolaczony", 0), 4),
+            "Model": result.get("Model"),
+            "Dystans": round(result.get("Dystans", 0), 4),
+            "SzczegolyCech": result.get("SzczegolyCech", {})
+        })
+
+    # ⚡ Wynik z cache'u (to samo zdjęcie przy tej samej wersji galerii)
+    if "ZCache" in result:
+        response["ZCache"] = result["ZCache"]
+
+    # ⭐ top_k - ranking kandydatów dla każdego progu
+    if "Kandydaci" in result:
+        response["Kandydaci"] = [
+            {
+                "Model": tier["Model"],
+                "Prog": tier["Prog"],
+                "Kandydaci": [
+                    {
+                        **candidate,
+                        "Dystans": round(candidate["Dystans"], 4),
+                        "Pewnosc": round(candidate["Pewnosc"], 4),
+                        **({"CechyWynik": round(candidate["CechyWynik"], 4)} if "CechyWynik" in candidate else {}),
+                        **({"WynikPolaczony": round(candidate["WynikPolaczony"], 4)} if "WynikPolaczony" in candidate else {})
+                    }
+                    for candidate in tier["Kandydaci"]
+                ]
+            }
+            for tier in result["Kandydaci"]
+        ]
+
+    return response
+
+
 # ✅ ENDPOINT 3: Rozpoznaj twarz ze zdjęcia
 @app.route('/api/recognize-face', methods=['POST'])
 def recognize_face():
@@ -150,44 +349,74 @@ def recognize_face():
     
     ⚠️ WAŻNE: To szuka tylko w encodingach z face_encodings
     (osób które zostały przetworzane przez Python)
+
+    multi_face: true -> rozpoznaj każdą twarz na zdjęciu (Twarze: [... + Obszar x/y/w/h])
+    top_k: N -> dodatkowo N najbliższych osób dla każdego progu (Kandydaci)
+
+    Zdjęcie: photo_path w JSON albo bezpośrednio w żądaniu (plik 'photo' w multipart
+    lub surowe body image/*) - parametry wtedy w polach formularza / query string
     """
     try:
-        data = request.get_json()
+        data = get_request_data()
         photo_path = data.get('photo_path')
+        search_mode = data.get('search_mode')
+        multi_face = parse_bool(data.get('multi_face', False))
+        top_k = data.get('top_k')
 
-        if not photo_path:
+        image, image_error = get_uploaded_image()
+        if image_error:
             return jsonify({
                 "Rozpoznano": False,
-                "Wiadomosc": "Brakuje photo_path"
+                "Wiadomosc": image_error
+            }), 400
+
+        if not image and not photo_path:
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": "Brakuje photo_path lub zdjęcia w żądaniu"
+            }), 400
+
+        if isinstance(top_k, str) and top_k.strip().isdigit():
+            top_k = int(top_k)
+
+        if search_mode not in (None, 'exact', 'ann'):
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": "search_mode musi być 'exact' lub 'ann'"
             }), 400
 
         print(f"\n{'=' * 70}")
         print(f"🔍 RECOGNIZE FACE ENDPOINT")
         print(f"{'=' * 70}")
-        print(f"Photo Path: {photo_path}")
+        print(f"Photo: {image or photo_path}")
+
+        if top_k is not None:
+            if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= TOP_K_MAX:
+                return jsonify({
+                    "Rozpoznano": False,
+                    "Wiadomosc": f"top_k musi być liczbą całkowitą 1-{TOP_K_MAX}"
+                }), 400
+
+        # ⭐ Zdjęcie grupowe - wynik dla KAŻDEJ twarzy (jedna detekcja, jeden batch)
+        if multi_face:
+            result = recognizer.recognize_all_faces(image or photo_path, search_mode=search_mode)
+            faces = []
+            for face in result.get("Twarze", []):
+                formatted = format_recognition_result(face)
+                formatted["Obszar"] = face.get("Obszar", {})
+                formatted["PewnoscDetekcji"] = round(face.get("PewnoscDetekcji", 0), 4)
+                faces.append(formatted)
 
-        result = recognizer.recognize_face(photo_path)
+            return jsonify({
+                "Rozpoznano": result.get("Rozpoznano", False),
+                "LiczbaTwarzy": result.get("LiczbaTwarzy", 0),
+                "Twarze": faces,
+                "Wiadomosc": result.get("Wiadomosc", "")
+            }), 200
 
-        # Formatuj wynik
-        response = {
-            "Rozpoznano": result.get("Rozpoznano", False),
-            "Wiadomosc": result.get("Wiadomosc", "")
-        }
+        result = recognizer.recognize_face(image or photo_path, search_mode=search_mode, top_k=top_k)
 
-        if result.get("Rozpoznano"):
-            response.update({
-                "Pesel": result.get("Pesel"),
-                "Imie": result.get("Imie"),
-                "Nazwisko": result.get("Nazwisko"),
-                "DataUrodzenia": result.get("DataUrodzenia"),
-                "Plec": result.get("Plec"),
-                "Pewnosc": round(result.get("Pewnosc", 0), 4),
-                "CechyWynik": round(result.get("CechyWynik", 0), 4),
-                "WynikPolaczony": round(result.get("WynikPolaczony", 0), 4),
-                "Model": result.get("Model"),
-                "Dystans": round(result.get("Dystans", 0), 4),
-                "SzczegolyCech": result.get("SzczegolyCech", {})
-            })
+        response = format_recognition_result(result)
 
         return jsonify(response), 200
 
@@ -201,6 +430,68 @@ def recognize_face():
         }), 500
 
 
+# ✅ ENDPOINT 3b: Rozpoznaj wiele zdjęć naraz
+@app.route('/api/recognize-faces-batch', methods=['POST'])
+def recognize_faces_batch():
+    """
+    Rozpoznaje twarze na wielu zdjęciach w jednym żądaniu
+    (jeden batchowany forward pass modelu + jedno dopasowanie do galerii)
+
+    Request: {"photo_paths": ["...", ...], "search_mode": "exact" | "ann" (opcjonalnie)}
+    Response: {"Wyniki": [...], "Liczba": N} - wyniki w kolejności photo_paths
+    (element, który nie jest ścieżką - błąd tylko w jego wyniku)
+    """
+    try:
+        # Body nie-JSON albo nie obiekt = błąd klienta (400), nie wyjątek serwera
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": "Body musi być obiektem JSON z photo_paths"
+            }), 400
+
+        photo_paths = data.get('photo_paths')
+        search_mode = data.get('search_mode')
+
+        if not photo_paths or not isinstance(photo_paths, list):
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": "Brakuje photo_paths (lista ścieżek)"
+            }), 400
+
+        if len(photo_paths) > BATCH_MAX_IMAGES:
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": f"Za dużo zdjęć w jednym żądaniu (max {BATCH_MAX_IMAGES})"
+            }), 400
+
+        if search_mode not in (None, 'exact', 'ann'):
+            return jsonify({
+                "Rozpoznano": False,
+                "Wiadomosc": "search_mode musi być 'exact' lub 'ann'"
+            }), 400
+
+        print(f"\n{'=' * 70}")
+        print(f"🔍 RECOGNIZE FACES BATCH ENDPOINT ({len(photo_paths)} photos)")
+        print(f"{'=' * 70}")
+
+        results = recognizer.recognize_faces_batch(photo_paths, search_mode=search_mode)
+
+        return jsonify({
+            "Wyniki": [format_recognition_result(result) for result in results],
+            "Liczba": len(results)
+        }), 200
+
+    except Exception as e:
+        print(f"❌ Error in recognize_faces_batch: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            "Rozpoznano": False,
+            "Wiadomosc": f"Błąd: {str(e)}"
+        }), 500
+
+
 # ✅ ENDPOINT 4: Info o API
 @app.route('/api/info', methods=['GET'])
 def info():
@@ -226,8 +517,10 @@ def info():
         "endpoints": {
             "health": "GET /health",
             "info": "GET /api/info",
-            "register_encoding": "POST /api/register-face-encoding (after Node.js registration!)",
-            "recognize": "POST /api/recognize-face"
+            "register_encoding": "POST /api/register-face-encoding (after Node.js registration!, photo_path albo plik 'photo', async: true = 202 + zadanie w tle)",
+            "recognize": "POST /api/recognize-face (multi_face: true = każda twarz na zdjęciu, top_k: N = ranking kandydatów)",
+            "recognize_batch": "POST /api/recognize-faces-batch",
+            "job_status": "GET /api/jobs/<id> (register-face-encoding z async: true)"
         }
     }), 200
 
@@ -254,6 +547,7 @@ if __name__ == '__main__':
     print(f"   1. Node.js: Rejestruj osobę (POST /api/register)")
     print(f"   2. Python: Wyciągnij encoding (POST /api/register-face-encoding)")
     print(f"   3. Python: Rozpoznaj twarz (POST /api/recognize-face)")
+    print(f"\n🚀 Produkcja: python serve.py (wiele procesów, wspólne modele)")
     print("=" * 70 + "\n")
 
     app.run(
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🧭 Benchmark: recall vs latencja - indeks IVF vs pełny skan galerii
+
+Użycie:
+  python benchmark_ann.py                           # syntetyczna galeria 200k x 128
+  python benchmark_ann.py --size 1000000 --nlist 4096
+  python benchmark_ann.py --from-db                 # galeria z face_encodings
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from gallery import FaceGallery
+from ann_index import IVFIndex
+
+
+def synthetic_gallery(size, dimensions, seed):
+    """Galeria ~ rozkład embeddingów: skupiska (np. podobne twarze) + szum"""
+    rng = np.random.default_rng(seed)
+    clusters = rng.normal(0, 1.0, size=(max(1, size // 500), dimensions)).astype(np.float32)
+    members = rng.integers(0, clusters.shape[0], size)
+    matrix = clusters[members] + rng.normal(0, 0.35, size=(size, dimensions)).astype(np.float32)
+    pesels = [f"{i:011d}" for i in range(size)]
+    return FaceGallery(pesels, matrix)
+
+
+def make_queries(gallery, count, noise, seed):
+    """Zapytania = zarejestrowana osoba + szum (nowe zdjęcie tej samej osoby)"""
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.choice(len(gallery), count, replace=False)
+    queries = gallery.matrix[rows] + rng.normal(0, noise, size=(count, gallery.dimensions)).astype(np.float32)
+    return queries
+
+
+def time_per_query(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF recall-vs-latency benchmark")
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--dimensions', type=int, default=128)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.1)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--from-db', action='store_true', help='użyj galerii z faces.db')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🧭 IVF BENCHMARK - recall@1 vs latency")
+    print("=" * 70)
+
+    if args.from_db:
+        from gallery import get_gallery
+        gallery = get_gallery(dimensions=args.dimensions)
+    else:
+        gallery = synthetic_gallery(args.size, args.dimensions, args.seed)
+
+    if len(gallery) == 0:
+        print("❌ Empty gallery")
+        return
+
+    queries = make_queries(gallery, min(args.queries, len(gallery)), args.noise, args.seed)
+    print(f"📊 Gallery: {len(gallery)} x {gallery.dimensions}, queries: {len(queries)}")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery, nlist=args.nlist)
+    index.bind(gallery)
+    print(f"⏱️  Build: {time.perf_counter() - start:.2f} s (nlist={index.nlist})")
+
+    exact, exact_ms = time_per_query(gallery.search, queries)
+    exact_pesels = [pesel for pesel, _ in exact]
+
+    print(f"\n{'mode':<14}{'nprobe':>8}{'recall@1':>12}{'ms/query':>12}{'speedup':>10}")
+    print(f"{'exact':<14}{'-':>8}{1.0:>12.4f}{exact_ms:>12.3f}{1.0:>10.1f}")
+
+    for nprobe in args.nprobe:
+        results, ann_ms = time_per_query(
+            lambda query: index.search(gallery, query, nprobe=nprobe), queries
+        )
+        recall = np.mean([pesel == expected for (pesel, _), expected in zip(results, exact_pesels)])
+        print(f"{'ivf':<14}{nprobe:>8}{recall:>12.4f}{ann_ms:>12.3f}{exact_ms / ann_ms:>10.1f}")
+
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🗄️  Benchmark: opóźnienie wywołań utils przy równoległych zapisach (jak Node.js)
+
+Dwa tryby, każdy na świeżej kopii faces.db:
+  - per-call: nowe połączenie na każde wywołanie, dziennik rollback (stare zachowanie)
+  - pool:     pula długo żyjących połączeń, WAL + pragmy z config.DB_*
+
+W tle osobny proces zapisuje do 'faces' w krótkich transakcjach (jak server.js),
+wątki czytające wołają get_person_by_pesel + get_face_features na zmianę.
+
+Użycie:
+  python benchmark_db.py
+  python benchmark_db.py --seconds 10 --readers 8 --write-interval 0.005
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import utils
+from config import DATABASE_PATH
+
+# ═══════════════════════════════════════════════════════════════════════════
+# ✍️  ZAPISY W TLE (STYL NODE.JS)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def node_style_writer(database_path, stop, interval, counter):
+    """Jedno długie połączenie, krótkie transakcje INSERT/UPDATE na 'faces'"""
+    db = sqlite3.connect(database_path, timeout=5)
+    i = 0
+    while not stop.is_set():
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO faces (pesel, first_name, last_name, date_of_birth, gender, embedding, photo_path) "
+                    "VALUES (?, 'Bench', 'Writer', '1990-01-01', 'M', '[]', '/uploads/bench.jpg')",
+                    (f"bench{i % 1000:06d}",)
+                )
+                db.execute("UPDATE faces SET last_name = ? WHERE pesel = ?", (f"Writer{i}", f"bench{i % 1000:06d}"))
+            with counter.get_lock():
+                counter.value += 1
+        except sqlite3.OperationalError:
+            pass
+        i += 1
+        time.sleep(interval)
+    db.close()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📖 CZYTELNICY (FUNKCJE Z utils)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def reader(pesels, deadline, latencies, errors, seed):
+    """
+    Na zmianę get_person_by_pesel / get_face_features dla istniejących PESELi
+    utils łapie wyjątki (np. 'database is locked') i zwraca None - osoba, która
+    istnieje, a nie została zwrócona, liczy się jako błąd
+    """
+    rng = random.Random(seed)
+    local = []
+    while time.perf_counter() < deadline:
+        pesel = rng.choice(pesels)
+        start = time.perf_counter()
+        if len(local) % 2:
+            utils.get_face_features(pesel)
+        elif utils.get_person_by_pesel(pesel) is None:
+            errors.append(pesel)
+        local.append((time.perf_counter() - start) * 1000)
+    latencies.extend(local)
+
+
+def run_mode(name, pooled, args, pesels):
+    workdir = tempfile.mkdtemp(prefix='bench_db_')
+    database_path = os.path.join(workdir, 'faces.db')
+    shutil.copy(DATABASE_PATH, database_path)
+
+    # Kopia startuje zawsze w trybie rollback journal (jak baza utworzona przez Node.js)
+    db = sqlite3.connect(database_path)
+    db.execute('PRAGMA journal_mode = DELETE')
+    db.close()
+
+    utils.DATABASE_PATH = database_path
+    utils.db_pool = utils.ConnectionPool(database_path=database_path, enabled=pooled)
+    if pooled:
+        # Pierwsze połączenie przełącza bazę na WAL przed startem zapisów
+        utils.get_db().close()
+
+    stop = multiprocessing.Event()
+    writes = multiprocessing.Value('i', 0)
+    writer = multiprocessing.Process(
+        target=node_style_writer, args=(database_path, stop, args.write_interval, writes)
+    )
+    writer.start()
+    time.sleep(0.2)
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=reader, args=(pesels, deadline, latencies, errors, seed))
+        for seed in range(args.readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stop.set()
+    writer.join()
+    utils.db_pool.close_all()
+
+    journal = sqlite3.connect(database_path).execute('PRAGMA journal_mode').fetchone()[0]
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    values = np.array(latencies)
+    print(f"{name:<10}{journal:>9}{len(values) / args.seconds:>11.0f}"
+          f"{np.percentile(values, 50):>9.3f}{np.percentile(values, 95):>9.3f}"
+          f"{np.percentile(values, 99):>9.3f}{values.max():>10.1f}{len(errors):>8}{writes.value:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="utils DB latency: per-call connections vs pool + WAL")
+    parser.add_argument('--seconds', type=float, default=5.0, help='czas pomiaru na tryb')
+    parser.add_argument('--readers', type=int, default=4, help='wątki czytające')
+    parser.add_argument('--write-interval', type=float, default=0.01, help='przerwa między zapisami (s)')
+    args = parser.parse_args()
+
+    db = sqlite3.connect(DATABASE_PATH)
+    pesels = [row[0] for row in db.execute('SELECT pesel FROM faces')] or ['00000000000']
+    db.close()
+
+    print("=" * 80)
+    print(f"🗄️  DB LATENCY - {args.readers} readers, Node-style write every {args.write_interval * 1000:.0f} ms")
+    print("=" * 80)
+    print(f"{'mode':<10}{'journal':>9}{'calls/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>10}{'errors':>8}{'writes':>9}")
+
+    # Logi utils (❌ Error ...) przy blokadach są oczekiwane - liczy się kolumna errors
+    run_mode('per-call', False, args, pesels)
+    run_mode('pool', True, args, pesels)
+    print("=" * 80)
+
+
+if __name__ == '__main__':
+    main()
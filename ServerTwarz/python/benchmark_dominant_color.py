@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🎨 Parity + benchmark: kolor dominujący - histogram vs dawny cv2.kmeans
+
+Dla ROI oczu / włosów / policzka (jak w FaceFeatureAnalyzer) z każdego zdjęcia uploads/:
+  - parity: _color_name z histogramu vs k-means (centers[0] - stare zachowanie)
+            oraz vs k-means z NAJLICZNIEJSZYM klastrem (to, co stary kod miał zwracać)
+  - benchmark: czas jednego wywołania na ROI w pełnej rozdzielczości i po pomniejszeniu
+
+Użycie:
+  python benchmark_dominant_color.py
+  python benchmark_dominant_color.py --limit 20 --repeat 3 --max-side 640
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from config import UPLOADS_DIR, FEATURE_MAX_SIDE
+from image_context import ImageContext
+from face_feature_analyzer import FaceFeatureAnalyzer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def kmeans_dominant_color(image, most_populated=False):
+    """Dawna implementacja (k=3, 10 prób) - opcjonalnie z poprawnym wyborem klastra"""
+    pixels = np.float32(image.reshape((-1, 3)))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    _, labels, centers = cv2.kmeans(pixels, 3, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+
+    best = int(np.argmax(np.bincount(labels.ravel(), minlength=3))) if most_populated else 0
+    return np.uint8(centers)[best].tolist()
+
+
+def feature_rois(rgb):
+    """ROI oczu, włosów i policzka - te same wycinki co w analizatorze"""
+    height, width = rgb.shape[:2]
+    return {
+        'eye': rgb[int(height * 0.15):int(height * 0.35), int(width * 0.25):int(width * 0.75)],
+        'hair': rgb[0:int(height * 0.25), :],
+        'cheek': rgb[int(height * 0.35):int(height * 0.65), int(width * 0.1):int(width * 0.4)],
+    }
+
+
+def best_time_ms(func, roi, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(roi)
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dominant colour: histogram vs k-means parity + benchmark")
+    parser.add_argument('--dir', default=UPLOADS_DIR, help='katalog ze zdjęciami')
+    parser.add_argument('--limit', type=int, default=0, help='maks liczba zdjęć (0 = wszystkie)')
+    parser.add_argument('--repeat', type=int, default=1, help='przebiegi na ROI (najlepszy wynik)')
+    parser.add_argument('--max-side', type=int, default=FEATURE_MAX_SIDE, help='bok obrazu dla parity')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.dir, '*')) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if args.limit:
+        paths = paths[:args.limit]
+
+    print("=" * 70)
+    print("🎨 DOMINANT COLOUR - histogram vs cv2.kmeans")
+    print("=" * 70)
+
+    # Stałe ziarno - k-means powtarzalny między uruchomieniami
+    cv2.setRNGSeed(0)
+    histogram = FaceFeatureAnalyzer._get_dominant_color
+    color_name = FaceFeatureAnalyzer._color_name
+
+    agree_legacy = 0
+    agree_populated = 0
+    rgb_errors = []
+    rois_checked = 0
+    timings = {'kmeans full': [], 'histogram full': [], 'kmeans small': [], 'histogram small': []}
+
+    for path in paths:
+        context = ImageContext.from_path(path)
+        if context is None:
+            continue
+
+        small = ImageContext(context.downscaled(args.max_side)[0])
+
+        # Parity na obrazie w rozmiarze analizy
+        for roi in feature_rois(small.rgb).values():
+            if roi.size == 0:
+                continue
+            rois_checked += 1
+            new_color = histogram(roi)
+            populated = kmeans_dominant_color(roi, most_populated=True)
+
+            agree_legacy += color_name(new_color) == color_name(kmeans_dominant_color(roi))
+            agree_populated += color_name(new_color) == color_name(populated)
+            rgb_errors.append(float(np.linalg.norm(np.subtract(new_color, populated))))
+
+        # Czas: pełna rozdzielczość i obraz pomniejszony
+        for label, image in (('full', context.rgb), ('small', small.rgb)):
+            for roi in feature_rois(image).values():
+                if roi.size == 0:
+                    continue
+                timings[f'kmeans {label}'].append(best_time_ms(kmeans_dominant_color, roi, args.repeat))
+                timings[f'histogram {label}'].append(best_time_ms(histogram, roi, args.repeat))
+
+        print(f"   📸 {os.path.basename(path)}: {context.shape[1]}x{context.shape[0]}")
+
+    if not rois_checked:
+        print(f"❌ No images in {args.dir}")
+        return
+
+    print(f"\n📊 Parity on {rois_checked} ROIs (_color_name):")
+    print(f"   vs k-means centers[0] (old output):       {100.0 * agree_legacy / rois_checked:.1f}% same name")
+    print(f"   vs k-means most populated cluster:        {100.0 * agree_populated / rois_checked:.1f}% same name")
+    print(f"   RGB distance to most populated cluster:   "
+          f"median {np.median(rgb_errors):.1f}, p90 {np.percentile(rgb_errors, 90):.1f}")
+
+    print(f"\n{'per ROI':<18}{'kmeans ms':>12}{'histogram ms':>15}{'speedup':>10}")
+    for label in ('full', 'small'):
+        kmeans_ms = float(np.mean(timings[f'kmeans {label}']))
+        histogram_ms = float(np.mean(timings[f'histogram {label}']))
+        print(f"{label:<18}{kmeans_ms:>12.2f}{histogram_ms:>15.3f}{kmeans_ms / max(histogram_ms, 1e-6):>10.1f}")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+👁️  Parity + benchmark: podobieństwo cech - compare_features (pętla) vs FeatureGallery
+
+Porównuje wynik i czas:
+  - pętla: get_face_features-style słowniki + compare_features osoba po osobie
+  - galeria: FeatureGallery.scores - cała galeria / top-k jednym przebiegiem NumPy
+
+Użycie:
+  python benchmark_feature_gallery.py                     # syntetyczna galeria 10 000 osób
+  python benchmark_feature_gallery.py --size 100000 --top-k 50
+  python benchmark_feature_gallery.py --from-db           # cechy z face_features
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from utils import get_all_face_features
+from feature_gallery import FeatureGallery, compare_features
+
+COLOR_NAMES = ['light', 'medium', 'brown/dark', 'reddish', 'greenish', 'bluish', 'gray', 'light_gray', 'mixed']
+
+
+def random_features(rng):
+    """Słownik cech o kształcie jak z FaceFeatureAnalyzer (z brakami jak w prawdziwych danych)"""
+    def maybe(value, p_missing=0.1):
+        return None if rng.random() < p_missing else value
+
+    def color():
+        rgb = [rng.randrange(256) for _ in range(3)]
+        return {'dominant_color': rgb, 'rgb': rgb, 'name': rng.choice(COLOR_NAMES)}
+
+    return {
+        'eye_color': maybe(color()),
+        'hair_color': maybe(color()),
+        'eye_distance': maybe({
+            'pixel_distance': None,
+            'normalized_distance': maybe(rng.uniform(0.1, 0.5), 0.4),
+            'eyes_detected': 2
+        }),
+        'nose_width': maybe({'width_pixels': maybe(rng.randrange(1, 80), 0.2), 'height_pixels': 20}),
+        'mouth_width': maybe({'width_pixels': maybe(rng.randrange(1, 120), 0.2), 'aspect_ratio': 1.0}),
+        'eyebrow_shape': maybe({'average_angle': maybe(rng.uniform(-30, 30), 0.2), 'contours_count': 5}),
+        'facial_asymmetry': maybe({'asymmetry_score': rng.random()}),
+        'skin_tone': maybe({'skin_tone': rng.choice(COLOR_NAMES), 'rgb': (0, 0, 0), 'hue': 0.0}),
+    }
+
+
+def best_time_ms(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature similarity: compare_features loop vs FeatureGallery")
+    parser.add_argument('--size', type=int, default=10_000, help='osób w syntetycznej galerii')
+    parser.add_argument('--top-k', type=int, default=50, help='kandydatów w pomiarze top-k')
+    parser.add_argument('--queries', type=int, default=20, help='zapytań do sprawdzenia parity')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--from-db', action='store_true', help='cechy z tabeli face_features')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+
+    if args.from_db:
+        stored = get_all_face_features()
+    else:
+        stored = {f"{i:011d}": random_features(rng) for i in range(args.size)}
+
+    stored = {pesel: features for pesel, features in stored.items() if features}
+    if not stored:
+        print("❌ No features to compare")
+        return
+
+    print("=" * 70)
+    print(f"👁️  FEATURE SIMILARITY - {len(stored)} people")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    gallery = FeatureGallery.from_features(stored)
+    print(f"🏗️  FeatureGallery built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    pesels = list(stored)
+    queries = [random_features(rng) for _ in range(args.queries)]
+
+    # Parity: każda osoba x każde zapytanie
+    max_error = 0.0
+    for query in queries:
+        expected = np.array([compare_features(query, stored[pesel]) for pesel in pesels])
+        actual = gallery.scores(query)
+        max_error = max(max_error, float(np.max(np.abs(expected - actual))))
+
+    print(f"✅ Parity: max |loop - gallery| = {max_error:.2e} ({args.queries} queries x {len(pesels)} people)")
+
+    query = queries[0]
+    top_k = pesels[:args.top_k]
+
+    loop_all = best_time_ms(lambda: [compare_features(query, stored[pesel]) for pesel in pesels], args.repeat)
+    gallery_all = best_time_ms(lambda: gallery.scores(query), args.repeat)
+    loop_top = best_time_ms(lambda: [compare_features(query, stored[pesel]) for pesel in top_k], args.repeat)
+    gallery_top = best_time_ms(lambda: gallery.scores(query, top_k), args.repeat)
+
+    print(f"\n{'scope':<22}{'loop ms':>12}{'gallery ms':>13}{'speedup':>10}")
+    print(f"{'whole gallery':<22}{loop_all:>12.2f}{gallery_all:>13.3f}{loop_all / max(gallery_all, 1e-6):>10.1f}")
+    print(f"{f'top-{len(top_k)}':<22}{loop_top:>12.3f}{gallery_top:>13.3f}{loop_top / max(gallery_top, 1e-6):>10.1f}")
+    print("(loop times exclude the per-candidate get_face_features query the old path also paid)")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
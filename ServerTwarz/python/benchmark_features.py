@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+👁️  Benchmark: FaceFeatureAnalyzer - całe zdjęcie vs crop twarzy FEATURE_FACE_SIZE
+
+Dla każdego zdjęcia z uploads/ mierzy czas każdej analizy cech:
+  - before: całe zdjęcie w pełnej rozdzielczości (stare zachowanie)
+  - after:  crop twarzy z detekcji w stałym rozmiarze (canonical_face)
+
+Na końcu: czas całego analyze_face_features na cropie - po kolei vs pula wątków
+
+Użycie:
+  python benchmark_features.py                  # wszystkie zdjęcia z uploads/
+  python benchmark_features.py --limit 10 --repeat 3
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import os
+import time
+
+import numpy as np
+
+from config import UPLOADS_DIR, FEATURE_FACE_SIZE, FEATURE_WORKERS
+from image_context import ImageContext
+from face_feature_analyzer import FaceFeatureAnalyzer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def time_tasks(analyzer, context, repeat):
+    """Czas (ms) każdej analizy - najlepszy z `repeat` przebiegów"""
+    timings = {}
+    for _ in range(repeat):
+        # Świeży kontekst - konwersje kolorów liczone w każdym przebiegu
+        fresh = ImageContext(context.bgr)
+        start = time.perf_counter()
+        tasks = analyzer.feature_tasks(fresh)
+        convert_ms = (time.perf_counter() - start) * 1000
+        timings['(color conversion)'] = min(timings.get('(color conversion)', float('inf')), convert_ms)
+
+        for name, analyze in tasks:
+            start = time.perf_counter()
+            analyze()
+            elapsed = (time.perf_counter() - start) * 1000
+            timings[name] = min(timings.get(name, float('inf')), elapsed)
+
+    return timings
+
+
+def time_analyze(analyzer, contexts, parallel, repeat):
+    """Średni czas (ms) całego analyze_face_features - najlepszy z `repeat` przebiegów"""
+    results = []
+    for context in contexts:
+        best = float('inf')
+        for _ in range(repeat):
+            fresh = ImageContext(context.bgr)
+            start = time.perf_counter()
+            # Logi analizatora wyciszone - liczy się tylko czas
+            with contextlib.redirect_stdout(io.StringIO()):
+                analyzer.analyze_face_features(fresh, canonical=False, parallel=parallel)
+            best = min(best, (time.perf_counter() - start) * 1000)
+        results.append(best)
+    return float(np.mean(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature analyzer benchmark: full image vs face crop")
+    parser.add_argument('--dir', default=UPLOADS_DIR, help='katalog ze zdjęciami')
+    parser.add_argument('--limit', type=int, default=0, help='maks liczba zdjęć (0 = wszystkie)')
+    parser.add_argument('--repeat', type=int, default=1, help='przebiegi na zdjęcie (najlepszy wynik)')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.dir, '*')) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if args.limit:
+        paths = paths[:args.limit]
+
+    print("=" * 70)
+    print(f"👁️  FEATURE ANALYZER BENCHMARK - full image vs {FEATURE_FACE_SIZE}px face crop")
+    print("=" * 70)
+
+    if not paths:
+        print(f"❌ No images in {args.dir}")
+        return
+
+    # Detekcja twarzy tak jak w produkcji (retinaface przez DeepFace)
+    from face_recognition import FaceRecognizer
+    recognizer = FaceRecognizer(preload=False)
+    analyzer = FaceFeatureAnalyzer()
+
+    before = {}
+    after = {}
+    megapixels = []
+    cropped = 0
+    canonical_contexts = []
+
+    for path in paths:
+        context = ImageContext.from_path(path)
+        if context is None:
+            continue
+
+        megapixels.append(context.shape[0] * context.shape[1] / 1e6)
+        recognizer.detect_faces(context)
+
+        canonical = analyzer.canonical_face(context)
+        cropped += canonical.shape[:2] == (FEATURE_FACE_SIZE, FEATURE_FACE_SIZE)
+        canonical_contexts.append(canonical)
+
+        for name, ms in time_tasks(analyzer, context, args.repeat).items():
+            before.setdefault(name, []).append(ms)
+        for name, ms in time_tasks(analyzer, canonical, args.repeat).items():
+            after.setdefault(name, []).append(ms)
+
+        print(f"   📸 {os.path.basename(path)}: {context.shape[1]}x{context.shape[0]}")
+
+    print(f"\n📊 {len(megapixels)} images, {np.mean(megapixels):.1f} MP average, "
+          f"{cropped} with detected face crop")
+
+    print(f"\n{'analyzer':<22}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    total_before = 0.0
+    total_after = 0.0
+    for name in before:
+        mean_before = float(np.mean(before[name]))
+        mean_after = float(np.mean(after[name]))
+        total_before += mean_before
+        total_after += mean_after
+        print(f"{name:<22}{mean_before:>12.2f}{mean_after:>12.2f}{mean_before / max(mean_after, 1e-6):>10.1f}")
+
+    print(f"{'TOTAL':<22}{total_before:>12.2f}{total_after:>12.2f}{total_before / max(total_after, 1e-6):>10.1f}")
+
+    # Cała analiza na cropie: po kolei vs wspólna pula wątków
+    analyzer.analyze_face_features(canonical_contexts[0], canonical=False, parallel=True)   # start puli
+    sequential_ms = time_analyze(analyzer, canonical_contexts, False, args.repeat)
+    parallel_ms = time_analyze(analyzer, canonical_contexts, True, args.repeat)
+    print(f"\n⚡ analyze_face_features on crop: sequential {sequential_ms:.2f} ms, "
+          f"parallel ({FEATURE_WORKERS} threads) {parallel_ms:.2f} ms "
+          f"({sequential_ms / max(parallel_ms, 1e-6):.1f}x)")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🧺 Benchmark: równoległe embeddingi - batch 1 na żądanie vs micro-batching
+
+N wątków (jak równoległe /api/recognize-face) liczy embeddingi cropów z uploads/:
+  - single: każdy wątek woła DeepFace.represent osobno (stare zachowanie)
+  - micro:  MicroBatcher zbiera cropy przez --window-ms, maks --max-batch
+
+Wypisuje przepustowość, opóźnienia p50/p99, histogram rozmiarów paczek
+i zgodność embeddingów (max |single - micro|).
+
+Użycie:
+  python benchmark_micro_batch.py
+  python benchmark_micro_batch.py --threads 16 --requests 20 --window-ms 2 5 10 --max-batch 16
+"""
+
+import argparse
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config import UPLOADS_DIR, DEEPFACE_PRIMARY_MODEL
+from face_recognition import FaceRecognizer
+from image_context import ImageContext
+from micro_batch import MicroBatcher
+
+
+def load_crops(recognizer, limit):
+    """Wyrównane cropy pierwszych twarzy ze zdjęć w uploads/"""
+    crops = []
+    for path in sorted(Path(UPLOADS_DIR).glob('*')):
+        if len(crops) >= limit:
+            break
+        context = ImageContext.from_path(str(path))
+        if context is None:
+            continue
+        faces = recognizer.detect_faces(context)
+        if faces:
+            crops.append(faces[0]['face'])
+    return crops
+
+
+def run(embed, crops, threads, requests):
+    """Każdy wątek liczy `requests` embeddingów - zwraca (czas s, opóźnienia ms)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        for i in range(requests):
+            start = time.perf_counter()
+            embed(crops[(offset + i) % len(crops)])
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def report(name, elapsed, latencies):
+    print(f"{name:<16}{len(latencies) / elapsed:>10.1f}{np.percentile(latencies, 50):>10.1f}"
+          f"{np.percentile(latencies, 99):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent embeddings: batch of 1 vs micro-batching")
+    parser.add_argument('--model', default=DEEPFACE_PRIMARY_MODEL)
+    parser.add_argument('--threads', type=int, default=8, help='równoległe "żądania"')
+    parser.add_argument('--requests', type=int, default=10, help='embeddingów na wątek')
+    parser.add_argument('--images', type=int, default=16, help='maks zdjęć z uploads/')
+    parser.add_argument('--window-ms', type=float, nargs='+', default=[2, 5, 10])
+    parser.add_argument('--max-batch', type=int, default=16)
+    args = parser.parse_args()
+
+    recognizer = FaceRecognizer(preload=True)
+    crops = load_crops(recognizer, args.images)
+    if not crops:
+        print("❌ No faces found in uploads/")
+        return
+
+    print("=" * 70)
+    print(f"🧺 MICRO-BATCHING - {args.model}, {args.threads} threads x {args.requests} requests, {len(crops)} crops")
+    print("=" * 70)
+
+    # Zgodność: ten sam crop pojedynczo i w paczce
+    expected = np.array([recognizer._embed_face(crop, args.model) for crop in crops])
+    batched = recognizer._embed_faces_batch(crops, args.model)
+    print(f"✅ Parity: max |single - batch| = {np.max(np.abs(expected - batched)):.2e}\n")
+
+    print(f"{'mode':<16}{'emb/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    elapsed, latencies = run(
+        lambda crop: recognizer._embed_face(crop, args.model), crops, args.threads, args.requests
+    )
+    report('single', elapsed, latencies)
+
+    histograms = {}
+    for window_ms in args.window_ms:
+        batcher = MicroBatcher(recognizer._embed_faces_batch, window_ms=window_ms, max_batch=args.max_batch)
+        elapsed, latencies = run(
+            lambda crop: batcher.embed(crop, args.model), crops, args.threads, args.requests
+        )
+        report(f'micro {window_ms:g} ms', elapsed, latencies)
+        histograms[window_ms] = batcher.stats()['models'][args.model]['batch_sizes']
+
+    print("\n📊 Batch sizes (size: count)")
+    for window_ms, sizes in histograms.items():
+        print(f"   {window_ms:g} ms: {sizes}")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,15 @@ TERTIARY_DIMENSIONS = 128
 FEATURE_EXTRACTION_ENABLED = True
 FEATURE_THRESHOLD_MATCH = 0.75          # Próg dla cech szczególnych (0-1)
 
+# Analiza cech na cropie twarzy w stałym rozmiarze (koszt niezależny od rozdzielczości aparatu)
+FEATURE_FACE_SIZE = 256                 # Crop twarzy: 256 x 256 px
+FEATURE_FACE_MARGIN = 0.25              # Poszerzenie ramki detekcji (włosy, brwi)
+FEATURE_MAX_SIDE = 640                  # Brak wykrytej twarzy -> całe zdjęcie pomniejszone do tego boku
+FEATURE_PARALLEL = True                 # Analizy cech równolegle (OpenCV/NumPy zwalniają GIL)
+FEATURE_WORKERS = 4                     # Wątki wspólnej puli analizatora cech
+FEATURE_COLOR_BITS = 4                  # Kolor dominujący: bity na kanał w histogramie (16 poziomów)
+FEATURE_COLOR_MAX_PIXELS = 20000        # Maks pikseli ROI w histogramie (reszta pomijana równym krokiem)
+
 # Wagi dla różnych cech (suma musi być = 1.0 lub ≤ 1.0)
 FEATURE_WEIGHTS = {
     'eye_color': 0.20,                  # 20% - Kolor oczu
@@ -65,6 +74,12 @@ DETECTOR_BACKEND = 'retinaface'         # Najlepszy: 'retinaface', 'yolov8', 'mt
 DETECTOR_ENFORCE = False                # Pozwól na słabsze detektory jeśli potrzeba
 GPU_ENABLED = True                      # Użyj GPU jeśli dostępne
 
+# Wersja pipeline'u encodingów - podbij przy zmianie preprocessingu,
+# wtedy `face_recognition.py reindex` przeliczy wszystkie encodingi (i cechy)
+# v2: cechy szczególne liczone na cropie twarzy (FEATURE_FACE_SIZE)
+# v3: kolor dominujący z histogramu (najczęstszy kolor zamiast k-means)
+ENCODING_VERSION = 3
+
 # ═══════════════════════════════════════════════════════════════════════════
 # ⭐ API Configuration
 # ═══════════════════════════════════════════════════════════════════════════
@@ -78,8 +93,74 @@ API_PORT = 5001
 # ═══════════════════════════════════════════════════════════════════════════
 
 ALLOW_FACE_DETECTION_BLUR = False       # Nie rozpoznawaj rozmytych twarzy
-CACHE_ENCODINGS = True                  # Cache encodingi w pamięci
-MAX_CACHE_SIZE = 1000                   # Maks encodingi w cache'u
+CACHE_ENCODINGS = True                  # Cache galerii encodingów w pamięci procesu
+MAX_CACHE_SIZE = 500000                 # Maks encodingi w cache'u (~256 MB dla 128 wymiarów)
+
+# 🧭 Tryb wyszukiwania w galerii: 'exact' (pełny skan) lub 'ann' (indeks IVF)
+SEARCH_MODE = 'exact'
+ANN_NLIST = 1024                        # Liczba komórek (centroidów) indeksu IVF
+ANN_NPROBE = 16                         # Ile najbliższych komórek sprawdzić na zapytanie
+ANN_MIN_GALLERY_SIZE = 10000            # Poniżej tej liczby osób zawsze pełny skan
+ANN_TRAIN_SAMPLE = 100000               # Próbka galerii do trenowania k-means
+ANN_KMEANS_ITERATIONS = 20              # Iteracje k-means
+ANN_LOG_COMPACT_RATIO = 0.1             # Przepisz snapshot gdy log > 10% indeksu
+
+# 🔥 Ładowanie i rozgrzewanie modeli przy starcie serwera
+PRELOAD_MODELS = True                   # Załaduj detektor + modele przy starcie
+PRELOAD_PARALLEL = False                # Ładuj modele równolegle (wątki)
+PRELOAD_IN_BACKGROUND = True            # Serwer startuje od razu, /health = 503 do końca warm-up
+
+# 📦 Rozpoznawanie wsadowe (/api/recognize-faces-batch)
+BATCH_MAX_IMAGES = 64                   # Maks zdjęć w jednym żądaniu
+BATCH_DETECT_WORKERS = 4                # Wątki do dekodowania + detekcji
+EMBEDDING_BATCH_SIZE = 32               # Maks cropów w jednym forward passie modelu
+TOP_K_MAX = 50                          # Maks kandydatów na próg (top_k w /api/recognize-face)
+
+# 🧺 Micro-batching embeddingów równoległych /api/recognize-face (jeden forward pass na paczkę)
+MICRO_BATCH_ENABLED = True              # False = każde żądanie osobno (batch 1)
+MICRO_BATCH_WINDOW_MS = 5               # Ile czekać na kolejne cropy od najstarszego w paczce
+MICRO_BATCH_MAX_SIZE = 16               # Pełna paczka startuje od razu (<= EMBEDDING_BATCH_SIZE)
+
+# ⚡ Cache wyników /api/recognize-face - ponowienia tego samego zdjęcia (skrót bajtów)
+RESULT_CACHE_ENABLED = True             # Unieważniany zmianą galerii (gallery_version)
+RESULT_CACHE_SIZE = 1024                # Maks wyników w pamięci procesu (LRU)
+RESULT_CACHE_TTL_SECONDS = 300          # Limit wieku - np. zmiana imienia w Node.js nie podbija wersji
+
+# 💾 Cache embeddingów na dysku (extract_face_encoding) - to samo zdjęcie bez TensorFlow
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_DIR = os.path.join(ENCODINGS_DIR, 'embedding_cache')
+EMBEDDING_CACHE_MAX_MB = 512            # Limit rozmiaru katalogu (eviction LRU po czasie użycia)
+EMBEDDING_CACHE_RESCAN_SECONDS = 300     # Rozmiar katalogu liczony od nowa (zapisy innych procesów)
+
+# 🔁 Masowa ponowna rejestracja (`face_recognition.py reindex`)
+REINDEX_WORKERS = 2                     # Procesy robocze (każdy ładuje modele raz)
+REINDEX_BATCH_SIZE = 50                 # Osób na transakcję zapisu
+REINDEX_CHECKPOINT_PATH = os.path.join(ENCODINGS_DIR, 'reindex_checkpoint.json')
+
+# 🗄️  Połączenia SQLite (pula w utils.get_db - długo żyjące połączenia)
+DB_POOL_ENABLED = True                  # False = nowe połączenie na każde wywołanie (stare zachowanie)
+DB_POOL_SIZE = 8                        # Maks bezczynnych połączeń w puli
+DB_JOURNAL_MODE = 'WAL'                 # WAL: czytelnicy nie blokują się z zapisami Node.js
+DB_BUSY_TIMEOUT_MS = 5000               # Czekaj na blokadę zamiast 'database is locked'
+DB_MMAP_SIZE = 256 * 1024 * 1024        # Odczyt bazy przez mmap (256 MB)
+DB_CACHE_SIZE_KB = 16384                # Cache stron na połączenie (16 MB)
+DB_STATEMENT_CACHE = 256                # Przygotowane zapytania trzymane na połączenie
+
+# 📝 Asynchroniczna rejestracja (/api/register-face-encoding z async=true)
+REGISTRATION_WORKERS = 2                # Wątki przetwarzające kolejkę rejestracji
+REGISTRATION_QUEUE_MAX = 100            # Maks zadań czekających + w toku (więcej = 503)
+JOB_RETENTION_SECONDS = 3600            # Jak długo trzymać status zakończonego zadania
+JOB_PRUNE_INTERVAL_SECONDS = 60         # Usuwanie starych zadań z bazy najwyżej raz na tyle sekund
+
+# 🚀 Tryb produkcyjny (serve.py): rodzic ładuje galerie, procesy robocze (fork()) - modele TF
+SERVE_HOST = '0.0.0.0'
+SERVE_WORKERS = 4                       # Procesy robocze (każdy: serwer WSGI z wątkami)
+SERVE_TF_INTRA_OP_THREADS = 2           # Wątki TF na jedną operację, na proces roboczy
+SERVE_TF_INTER_OP_THREADS = 1           # Równoległe operacje TF, na proces roboczy
+SERVE_PRELOAD = True                    # False = każdy proces ładuje galerie sam (bez copy-on-write)
+SERVE_RESTART_DELAY = 1.0               # Pierwsze opóźnienie restartu po awarii procesu (s)
+SERVE_MAX_RESTART_DELAY = 30.0          # Maks opóźnienie przy kolejnych szybkich awariach (s)
+SERVE_SHUTDOWN_TIMEOUT = 30             # Czas na dokończenie żądań przy zamykaniu (s)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # ⭐ STRATEGIA ROZPOZNAWANIA - W KTÓREJ KOLEJNOŚCI PRÓBOWAĆ
@@ -139,4 +220,5 @@ if __name__ != '__main__':
     print(f"🎯 DETECTOR:        {DETECTOR_BACKEND}")
     print(f"🚀 GPU:             {'ENABLED' if GPU_ENABLED else 'DISABLED'}")
     print(f"💾 CACHE:           {'ENABLED' if CACHE_ENCODINGS else 'DISABLED'}")
+    print(f"🧭 SEARCH MODE:     {SEARCH_MODE}")
     print("=" * 80 + "\n")
\ No newline at end of file
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from config import (
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_MB,
+    EMBEDDING_CACHE_RESCAN_SECONDS,
+    DETECTOR_BACKEND,
+    ENCODING_VERSION
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 💾 CACHE EMBEDDINGÓW NA DYSKU - TO SAMO ZDJĘCIE = BEZ TENSORFLOW
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# EMBEDDING_CACHE_DIR/<2 znaki>/<klucz>.npy, klucz = skrót z:
+#   skrót bajtów zdjęcia + model + detektor + wersja deepface + ENCODING_VERSION
+# (zmiana któregokolwiek = nowy klucz, stare pliki wypadają przy eviction)
+# Cechy szczególne tego samego zdjęcia: <klucz>.json (model = 'features') -
+# trafienie embeddingów i cech = żądanie bez detektora i TensorFlow
+#
+# - zapis atomowy (plik tymczasowy + os.replace) - bezpieczny dla wielu procesów
+#   (serve.py, reindex)
+# - odczyt odświeża mtime pliku - eviction usuwa najdawniej używane (LRU)
+# - limit EMBEDDING_CACHE_MAX_MB, po przekroczeniu sprzątanie do 90% limitu
+# - rozmiar katalogu przybliżony: zapisy tego procesu + ponowne liczenie co
+#   EMBEDDING_CACHE_RESCAN_SECONDS (pliki innych procesów serve.py)
+# - skanowanie i usuwanie plików poza lockiem - odczyty nie czekają na os.walk
+
+
+def _library_version():
+    try:
+        from importlib.metadata import version
+        return version('deepface')
+    except Exception:
+        return 'unknown'
+
+
+class EmbeddingCache:
+    """
+    ⭐ Embeddingi (float32 .npy) i cechy szczególne (.json) po skrócie zdjęcia i konfiguracji
+    get/put przyjmują content_hash=None (brak skrótu) - wtedy nic nie robią
+    """
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR, max_mb: float = EMBEDDING_CACHE_MAX_MB,
+                 enabled: bool = EMBEDDING_CACHE_ENABLED,
+                 rescan_seconds: float = EMBEDDING_CACHE_RESCAN_SECONDS):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = enabled
+        self.fingerprint = f"{DETECTOR_BACKEND}|{_library_version()}|v{ENCODING_VERSION}"
+        self.rescan_seconds = rescan_seconds
+        self._size = None               # Szacowany rozmiar katalogu (None = jeszcze nie liczony)
+        self._scanned_at = 0.0          # time.monotonic() ostatniego liczenia katalogu
+        self._evicting = False          # Sprzątanie w toku (jeden wątek na proces)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _path(self, content_hash, model_name, extension='.npy'):
+        key = hashlib.blake2b(
+            f"{content_hash}|{model_name}|{self.fingerprint}".encode(), digest_size=16
+        ).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}{extension}")
+
+    def get(self, content_hash, model_name):
+        """Embedding (lista liczb) albo None"""
+        embedding = self._read(content_hash, model_name, '.npy',
+                               lambda f: np.load(f, allow_pickle=False))
+        return embedding.tolist() if embedding is not None else None
+
+    def put(self, content_hash, model_name, embedding):
+        self._write(content_hash, model_name, '.npy',
+                    lambda f: np.save(f, np.asarray(embedding, dtype=np.float32), allow_pickle=False))
+
+    def get_features(self, content_hash):
+        """Cechy szczególne (dict z analyze_face_features) albo None"""
+        return self._read(content_hash, 'features', '.json',
+                          lambda f: json.loads(f.read().decode('utf-8')))
+
+    def put_features(self, content_hash, features):
+        if not features:
+            return
+        self._write(content_hash, 'features', '.json',
+                    lambda f: f.write(json.dumps(features).encode('utf-8')))
+
+    def _read(self, content_hash, model_name, extension, load):
+        if not self.enabled or content_hash is None:
+            return None
+
+        path = self._path(content_hash, model_name, extension)
+        try:
+            with open(path, 'rb') as f:
+                value = load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def _write(self, content_hash, model_name, extension, dump):
+        if not self.enabled or content_hash is None:
+            return
+
+        path = self._path(content_hash, model_name, extension)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                dump(f)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ Cannot write embedding cache: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._size is not None:
+                self._size += size
+            rescan = self._size is None or time.monotonic() - self._scanned_at >= self.rescan_seconds
+            if rescan:
+                self._scanned_at = time.monotonic()     # Inne wątki nie liczą równolegle
+
+        if rescan:
+            total = self._scan_size()
+            with self._lock:
+                self._size, self._scanned_at = total, time.monotonic()
+
+        with self._lock:
+            if self._evicting or self._size <= self.max_bytes:
+                return
+            self._evicting = True
+
+        try:
+            self._evict()
+        finally:
+            with self._lock:
+                self._evicting = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'directory': self.directory,
+                'size_mb': round(self._size / 1024 / 1024, 2) if self._size is not None else None,
+                'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions
+            }
+
+    def _files(self):
+        """[(mtime, rozmiar, ścieżka)] wszystkich plików cache'u"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(('.npy', '.json')):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self):
+        """
+        Usuń najdawniej używane pliki aż rozmiar spadnie do 90% limitu
+        Bez self._lock - pliki usunięte już przez inny proces są pomijane
+        """
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        evicted = 0
+
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._size, self._scanned_at = total, time.monotonic()
+            self.evictions += evicted
+        print(f"🗑️  Embedding cache trimmed to {total / 1024 / 1024:.1f} MB")
+
+
+embedding_cache = EmbeddingCache()
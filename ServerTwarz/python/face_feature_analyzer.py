@@ -5,6 +5,20 @@ import cv2
 import numpy as np
 from typing import Dict, List, Tuple
 import colorsys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    FEATURE_FACE_SIZE,
+    FEATURE_FACE_MARGIN,
+    FEATURE_MAX_SIDE,
+    FEATURE_PARALLEL,
+    FEATURE_WORKERS,
+    FEATURE_COLOR_BITS,
+    FEATURE_COLOR_MAX_PIXELS
+)
+from image_context import ImageContext
 
 
 class FaceFeatureAnalyzer:
@@ -25,41 +39,51 @@ class FaceFeatureAnalyzer:
             'facial_landmarks': 0.10,
             'skin_texture': 0.08
         }
+        # Haar cascade ładowany raz na wątek (CascadeClassifier nie jest thread-safe)
+        self._thread_local = threading.local()
+        self._pool = None
+        self._pool_lock = threading.Lock()
 
-    def analyze_face_features(self, image_path: str) -> Dict:
+    def analyze_face_features(self, image, canonical: bool = True,
+                              parallel: bool = FEATURE_PARALLEL, timings: Dict = None) -> Dict:
         """
         Analizuj cechy szczególne twarzy
+        image: ImageContext (widoki RGB / gray współdzielone z resztą żądania),
+        obraz BGR albo ścieżka do pliku
+        canonical: analiza na cropie twarzy FEATURE_FACE_SIZE (False = całe zdjęcie)
+        parallel: analizy na wspólnej puli wątków (False = po kolei)
+        timings: opcjonalny dict - wypełniany czasem każdej analizy w ms
         Zwraca: {eye_color, hair_color, eye_distance, nose_features, mouth_features, ...}
         """
         try:
             print(f"\n👁️  Analyzing facial features...")
+            start = time.perf_counter()
 
-            image = cv2.imread(image_path)
-            if image is None:
-                print(f"❌ Cannot read image: {image_path}")
+            context = ImageContext.of(image)
+            if context is None:
                 return None
 
-            # Konwertuj BGR do RGB
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-            features = {
-                'eye_color': self._analyze_eye_color(rgb_image),
-                'hair_color': self._analyze_hair_color(rgb_image),
-                'eye_distance': self._estimate_eye_distance(image),
-                'nose_width': self._estimate_nose_width(image),
-                'mouth_width': self._estimate_mouth_width(image),
-                'eyebrow_shape': self._analyze_eyebrow_shape(image),
-                'skin_features': self._analyze_skin_texture(rgb_image),
-                'facial_asymmetry': self._analyze_facial_asymmetry(image),
-                'age_estimate': self._estimate_age(rgb_image),
-                'skin_tone': self._analyze_skin_tone(rgb_image)
-            }
+            if canonical:
+                context = self.canonical_face(context)
+
+            tasks = self.feature_tasks(context)
+            if parallel:
+                pool = self._get_pool()
+                futures = [(name, pool.submit(self._timed, analyze)) for name, analyze in tasks]
+                results = [(name, future.result()) for name, future in futures]
+            else:
+                results = [(name, self._timed(analyze)) for name, analyze in tasks]
 
-            print(f"✅ Features analyzed:")
+            features = {name: value for name, (value, _) in results}
+            elapsed = {name: ms for name, (_, ms) in results}
+            if timings is not None:
+                timings.update(elapsed)
+
+            total_ms = (time.perf_counter() - start) * 1000
+            print(f"✅ Features analyzed in {total_ms:.1f} ms ({'parallel' if parallel else 'sequential'}):")
             for key, value in features.items():
                 if value:
-                    print(f"   📊 {key}: {value}")
+                    print(f"   📊 {key}: {value} ({elapsed[key]:.1f} ms)")
 
             return features
 
@@ -67,6 +91,62 @@ class FaceFeatureAnalyzer:
             print(f"❌ Error analyzing features: {str(e)}")
             return None
 
+    @staticmethod
+    def canonical_face(context):
+        """
+        ⭐ Obraz do analizy cech: twarz z detekcji (z marginesem) w stałym rozmiarze
+        Koszt analizy nie zależy od rozdzielczości aparatu
+        Bez wykrytej twarzy - całe zdjęcie pomniejszone do FEATURE_MAX_SIDE
+        """
+        crop = context.face_crop(FEATURE_FACE_SIZE, FEATURE_FACE_MARGIN)
+        if crop is not None:
+            return crop
+
+        image, _ = context.downscaled(FEATURE_MAX_SIDE)
+        return ImageContext(image) if image is not context.bgr else context
+
+    def _get_pool(self):
+        """Wspólna pula wątków analizatora (tworzona przy pierwszym użyciu)"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=FEATURE_WORKERS, thread_name_prefix='features')
+            return self._pool
+
+    @staticmethod
+    def _timed(analyze):
+        """
+        Uruchom jedną analizę i zmierz czas
+        Zwraca: (wynik, ms) - wyjątek kończy się wynikiem None jak w analizach
+        """
+        start = time.perf_counter()
+        try:
+            value = analyze()
+        except Exception as e:
+            print(f"   ⚠️  Feature analyzer failed: {e}")
+            value = None
+        return value, (time.perf_counter() - start) * 1000
+
+    def feature_tasks(self, context):
+        """
+        [(nazwa cechy, analiza)] dla obrazu - konwersje kolorów RAZ
+        (leniwie, zapamiętane w kontekście) i współdzielone przez analizy
+        """
+        rgb_image = context.rgb
+        gray = context.gray
+
+        return [
+            ('eye_color', lambda: self._analyze_eye_color(rgb_image)),
+            ('hair_color', lambda: self._analyze_hair_color(rgb_image)),
+            ('eye_distance', lambda: self._estimate_eye_distance(gray)),
+            ('nose_width', lambda: self._estimate_nose_width(gray)),
+            ('mouth_width', lambda: self._estimate_mouth_width(gray)),
+            ('eyebrow_shape', lambda: self._analyze_eyebrow_shape(gray)),
+            ('skin_features', lambda: self._analyze_skin_texture(gray)),
+            ('facial_asymmetry', lambda: self._analyze_facial_asymmetry(gray)),
+            ('age_estimate', lambda: self._estimate_age(gray)),
+            ('skin_tone', lambda: self._analyze_skin_tone(rgb_image)),
+        ]
+
     def _analyze_eye_color(self, image) -> Dict:
         """Analizuj kolor oczu z górnej części twarzy"""
         try:
@@ -116,16 +196,17 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error analyzing hair color: {e}")
             return None
 
-    def _estimate_eye_distance(self, image) -> Dict:
-        """Estymuj rozstaw między oczami"""
+    def _estimate_eye_distance(self, gray) -> Dict:
+        """Estymuj rozstaw między oczami (obraz w skali szarości)"""
         try:
-            # Szukaj źrenic w górnej części twarzy
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-            # Detektor twarzy Haara dla oczu
-            eye_cascade = cv2.CascadeClassifier(
-                cv2.data.haarcascades + 'haarcascade_eye.xml'
-            )
+            # Detektor twarzy Haara dla oczu (XML wczytywany raz na wątek)
+            eye_cascade = getattr(self._thread_local, 'eye_cascade', None)
+            if eye_cascade is None:
+                eye_cascade = cv2.CascadeClassifier(
+                    cv2.data.haarcascades + 'haarcascade_eye.xml'
+                )
+                self._thread_local.eye_cascade = eye_cascade
 
             eyes = eye_cascade.detectMultiScale(gray, 1.3, 5)
 
@@ -141,7 +222,7 @@ class FaceFeatureAnalyzer:
                 center2 = (x2 + w2 // 2, y2 + h2 // 2)
 
                 distance = np.sqrt((center2[0] - center1[0]) ** 2 + (center2[1] - center1[1]) ** 2)
-                distance_norm = distance / image.shape[1]  # Normalizuj do szerokości
+                distance_norm = distance / gray.shape[1]  # Normalizuj do szerokości
 
                 return {
                     'pixel_distance': float(distance),
@@ -159,10 +240,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error estimating eye distance: {e}")
             return None
 
-    def _estimate_nose_width(self, image) -> Dict:
+    def _estimate_nose_width(self, gray) -> Dict:
         """Estymuj szerokość nosa"""
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             height = gray.shape[0]
             width = gray.shape[1]
 
@@ -189,10 +269,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error estimating nose width: {e}")
             return None
 
-    def _estimate_mouth_width(self, image) -> Dict:
+    def _estimate_mouth_width(self, gray) -> Dict:
         """Estymuj szerokość ust"""
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             height = gray.shape[0]
             width = gray.shape[1]
 
@@ -228,10 +307,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error estimating mouth width: {e}")
             return None
 
-    def _analyze_eyebrow_shape(self, image) -> Dict:
+    def _analyze_eyebrow_shape(self, gray) -> Dict:
         """Analizuj kształt brwi"""
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             height = gray.shape[0]
             width = gray.shape[1]
 
@@ -276,16 +354,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error analyzing eyebrow shape: {e}")
             return None
 
-    def _analyze_skin_texture(self, image) -> Dict:
-        """Analizuj teksturę skóry - pieprzyki, znamiona, znaki"""
+    def _analyze_skin_texture(self, gray) -> Dict:
+        """Analizuj teksturę skóry - pieprzyki, znamiona, znaki (obraz w skali szarości)"""
         try:
-            # Konwertuj na RGB jeśli potrzeba
-            if len(image.shape) == 2:
-                image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-
-            # Analiza tonu skóry w różnych obszarach
-            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-
             # Detektor pieprzków/piegów - ciemne znaki na skórze
             # Używaj adaptacyjnego progu
             blurred = cv2.GaussianBlur(gray, (5, 5), 0)
@@ -307,10 +378,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error analyzing skin texture: {e}")
             return None
 
-    def _analyze_facial_asymmetry(self, image) -> Dict:
+    def _analyze_facial_asymmetry(self, gray) -> Dict:
         """Analizuj asymetrię twarzy"""
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             height = gray.shape[0]
             width = gray.shape[1]
 
@@ -343,11 +413,9 @@ class FaceFeatureAnalyzer:
             print(f"   ⚠️  Error analyzing asymmetry: {e}")
             return None
 
-    def _estimate_age(self, image) -> Dict:
-        """Estymuj przybliżony wiek"""
+    def _estimate_age(self, gray) -> Dict:
+        """Estymuj przybliżony wiek (obraz w skali szarości)"""
         try:
-            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-
             # Zmarszczki = wyższe częstości w transformacie Fouriera
             f_transform = np.fft.fft2(gray)
             f_shift = np.fft.fftshift(f_transform)
@@ -396,20 +464,29 @@ class FaceFeatureAnalyzer:
             return None
 
     @staticmethod
-    def _get_dominant_color(image) -> list:
-        """Znajdź dominujący kolor w obrazie - ZWRACA LISTĘ (JSON serializable)"""
-        # Reshape do listy pikseli
-        pixels = image.reshape((-1, 3))
-        pixels = np.float32(pixels)
-
-        # K-means clustering
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-        _, _, centers = cv2.kmeans(pixels, 3, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-
-        # Zwróć najczęstszy kolor
-        centers = np.uint8(centers)
+    def _get_dominant_color(image, bits: int = FEATURE_COLOR_BITS,
+                            max_pixels: int = FEATURE_COLOR_MAX_PIXELS) -> list:
+        """
+        Znajdź dominujący (NAJCZĘSTSZY) kolor w obrazie - ZWRACA LISTĘ (JSON serializable)
+        Histogram kolorów skwantowanych do `bits` bitów na kanał, wynik = średnia
+        pikseli z najliczniejszego koszyka. Deterministyczny (bez losowania jak k-means)
+        """
+        # Duże ROI: co n-ty piksel w obu osiach (stały krok, bez kopii obrazu)
+        height, width = image.shape[:2]
+        step = max(1, int(np.ceil(np.sqrt(height * width / max_pixels))))
+        pixels = np.asarray(image[::step, ::step], dtype=np.uint8).reshape(-1, 3)
+
+        # Indeks koszyka: (r, g, b) >> (8 - bits) sklejone w jedną liczbę
+        quantized = (pixels >> (8 - bits)).astype(np.int32)
+        bins = (quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) | quantized[:, 2]
+        counts = np.bincount(bins, minlength=1 << (3 * bits))
+
+        # Remis -> najniższy indeks koszyka (argmax), więc wynik zawsze ten sam
+        best = int(np.argmax(counts))
+        color = pixels[bins == best].mean(axis=0)
+
         # ⭐ KONWERTUJ NA LISTĘ (aby był JSON serializable)
-        return centers[0].tolist()
+        return [int(round(channel)) for channel in color]
 
     @staticmethod
     def _color_name(rgb) -> str:
@@ -8,8 +8,9 @@ from pathlib import Path
 import os
 import sys
 import json
-from PIL import Image
-from PIL.ExifTags import TAGS
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from config import (
     DEEPFACE_PRIMARY_MODEL,
@@ -22,16 +23,28 @@ from config import (
     SECONDARY_DIMENSIONS,
     TERTIARY_DIMENSIONS,
     FEATURE_EXTRACTION_ENABLED,
-    FEATURE_WEIGHTS,
     FEATURE_THRESHOLD_MATCH,
+    FEATURE_WEIGHTS,
     UPLOADS_DIR,
     DETECTOR_BACKEND,
     DETECTOR_ENFORCE,
-    RECOGNITION_STRATEGY
+    ENCODING_VERSION,
+    RECOGNITION_STRATEGY,
+    SEARCH_MODE,
+    ANN_NPROBE,
+    PRELOAD_MODELS,
+    PRELOAD_PARALLEL,
+    PRELOAD_IN_BACKGROUND,
+    BATCH_DETECT_WORKERS,
+    EMBEDDING_BATCH_SIZE,
+    MICRO_BATCH_ENABLED,
+    REINDEX_WORKERS,
+    REINDEX_BATCH_SIZE
 )
 from utils import (
     init_db,
     get_person_by_pesel,
+    get_people_by_pesels,
     get_all_people,
     save_face_encoding,
     get_face_encoding,
@@ -40,14 +53,26 @@ from utils import (
     get_face_features,
     get_all_face_features,
     file_exists,
-    get_full_path
+    get_full_path,
+    get_encodings_version
 )
 from face_feature_analyzer import FaceFeatureAnalyzer
+from image_context import ImageContext, content_hash, read_file_bytes
+from gallery import get_gallery
+from feature_gallery import compare_features, get_feature_gallery
+from ann_index import ann_indexes
+from micro_batch import MicroBatcher
+from result_cache import recognition_cache
+from embedding_cache import embedding_cache
 
 
 class FaceRecognizer:
-    def __init__(self):
-        """Inicjalizuj rozpoznawacz twarzy z wielomodelową analizą"""
+    def __init__(self, preload=None):
+        """
+        Inicjalizuj rozpoznawacz twarzy z wielomodelową analizą
+
+        preload: załaduj i rozgrzej modele od razu (domyślnie config.PRELOAD_MODELS)
+        """
         print("\n" + "=" * 70)
         print("🧠 Initializing Advanced Face Recognition System")
         print("=" * 70)
@@ -77,67 +102,245 @@ class FaceRecognizer:
         print(f"✅ Primary Model: {self.models[0]['name']} (threshold: {self.models[0]['threshold']}, dims: {self.models[0]['dimensions']})")
         print(f"✅ Secondary Model: {self.models[1]['name']} (threshold: {self.models[1]['threshold']}, dims: {self.models[1]['dimensions']})")
         print(f"✅ Tertiary Model: {self.models[2]['name']} (threshold: {self.models[2]['threshold']}, dims: {self.models[2]['dimensions']})")
+
+        # ⭐ MODELE DO REJESTRACJI - każdy model ze strategii ma własną galerię
+        self.registration_models = []
+        for tier in RECOGNITION_STRATEGY:
+            if any(m['name'] == tier['model'] for m in self.registration_models):
+                continue
+            dimensions = next(
+                (m['dimensions'] for m in self.models if m['name'] == tier['model']),
+                PRIMARY_DIMENSIONS
+            )
+            self.registration_models.append({'name': tier['model'], 'dimensions': dimensions})
+
+        print(f"📚 Galleries: {', '.join(m['name'] for m in self.registration_models)}")
+
+        # ⭐ MICRO-BATCHING - cropy z równoległych rozpoznań liczone jednym forward passem
+        self.micro_batcher = MicroBatcher(self._embed_faces_batch)
+
+        # ⚡ Wszystko, co zmienia wynik rozpoznania - część klucza cache'u wyników
+        self.result_config = json.dumps([
+            [(m['name'], m['threshold'], m['dimensions']) for m in self.models],
+            DETECTOR_BACKEND, ENCODING_VERSION, ANN_NPROBE,
+            FEATURE_EXTRACTION_ENABLED, FEATURE_THRESHOLD_MATCH, FEATURE_WEIGHTS
+        ], sort_keys=True)
         print(f"👁️  Feature Analysis: ENABLED")
         print(f"🎯 Detector: {DETECTOR_BACKEND}")
         print(f"📊 Feature Weights Configured")
         print("=" * 70 + "\n")
 
-    @staticmethod
-    def fix_image_rotation(image_path):
+        # ⭐ WARM-UP - dopóki się nie skończy, /health zgłasza "not ready"
+        self.warmup_status = {
+            'state': 'pending',
+            'detector': {},
+            'models': {},
+            'total_seconds': None
+        }
+
+        if preload is None:
+            preload = PRELOAD_MODELS
+
+        if not preload:
+            self.warmup_status['state'] = 'skipped'
+        elif PRELOAD_IN_BACKGROUND:
+            threading.Thread(target=self.warm_up, name='model-warmup', daemon=True).start()
+        else:
+            self.warm_up()
+
+    @property
+    def is_ready(self) -> bool:
+        """Czy worker może przyjmować ruch (modele załadowane albo preload wyłączony)"""
+        return self.warmup_status['state'] in ('ready', 'skipped')
+
+    def warm_up(self, parallel=PRELOAD_PARALLEL):
         """
-        ⭐ Napraw rotację zdjęcia ze aparatu
-        Czyta metadane EXIF i obraca obraz jeśli trzeba
+        ⭐ Załaduj wagi detektora i każdego modelu + próbna inferencja
+        Pierwsze /api/recognize-face po restarcie nie płaci za ładowanie TF
         """
+        print(f"\n🔥 Warming up detector + models ({'parallel' if parallel else 'sequential'})...")
+        self.warmup_status['state'] = 'warming_up'
+        start = time.perf_counter()
+
+        model_names = list(dict.fromkeys(m['name'] for m in self.models))
+        tasks = [(self._warm_up_detector, DETECTOR_BACKEND)]
+        tasks += [(self._warm_up_model, name) for name in model_names]
+
+        if parallel:
+            with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix='warmup') as pool:
+                results = list(pool.map(lambda task: task[0](task[1]), tasks))
+        else:
+            results = [task(name) for task, name in tasks]
+
+        self.warmup_status['detector'] = results[0]
+        self.warmup_status['models'] = dict(zip(model_names, results[1:]))
+        self.warmup_status['total_seconds'] = round(time.perf_counter() - start, 3)
+
+        # Bez detektora albo głównego modelu worker jest bezużyteczny
+        primary = self.warmup_status['models'].get(self.models[0]['name'], {})
+        failed = 'error' in self.warmup_status['detector'] or 'error' in primary
+        self.warmup_status['state'] = 'failed' if failed else 'ready'
+
+        print(f"{'❌' if failed else '✅'} Warm-up {self.warmup_status['state']} in {self.warmup_status['total_seconds']} s")
+
+    def _warm_up_model(self, model_name):
+        """Załaduj wagi modelu + jedna inferencja na pustym cropie"""
+        timings = {}
         try:
-            print(f"🔧 Checking image rotation...")
+            start = time.perf_counter()
+            model = DeepFace.build_model(model_name)
+            timings['load_seconds'] = round(time.perf_counter() - start, 3)
 
-            image = Image.open(image_path)
+            width, height = model.input_shape
+            start = time.perf_counter()
+            self._embed_face(np.zeros((height, width, 3), dtype=np.float32), model_name)
+            timings['warmup_seconds'] = round(time.perf_counter() - start, 3)
 
-            # Odczytaj metadane EXIF
-            exif = {}
-            try:
-                exif_data = image._getexif()
-                if exif_data:
-                    for tag_id, value in exif_data.items():
-                        tag = TAGS.get(tag_id, tag_id)
-                        exif[tag] = value
-
-                    # Szukaj orientacji (tag 274)
-                    orientation = exif.get('Orientation', 1)
-                    print(f"   📐 EXIF Orientation: {orientation}")
-
-                    # Obrót w zależności od orientacji
-                    if orientation == 3:
-                        print(f"   🔄 Rotating 180°")
-                        image = image.rotate(180, expand=True)
-                    elif orientation == 6:
-                        print(f"   🔄 Rotating 270°")
-                        image = image.rotate(270, expand=True)
-                    elif orientation == 8:
-                        print(f"   🔄 Rotating 90°")
-                        image = image.rotate(90, expand=True)
-
-                    # Zapisz poprawiony obraz
-                    image.save(image_path)
-                    print(f"   ✅ Image rotation fixed")
+            print(f"   🔥 {model_name}: load {timings['load_seconds']} s, warm-up {timings['warmup_seconds']} s")
 
-            except Exception as e:
-                print(f"   ⚠️ Could not read EXIF: {e}")
+        except Exception as e:
+            print(f"   ❌ Warm-up failed for {model_name}: {str(e)}")
+            timings['error'] = str(e)
+
+        return timings
+
+    def _warm_up_detector(self, detector_backend):
+        """Załaduj detektor + jedna detekcja na pustym obrazie"""
+        timings = {'backend': detector_backend}
+        try:
+            from deepface.detectors import DetectorWrapper
+
+            start = time.perf_counter()
+            DetectorWrapper.build_model(detector_backend)
+            timings['load_seconds'] = round(time.perf_counter() - start, 3)
+
+            start = time.perf_counter()
+            DeepFace.extract_faces(
+                img_path=np.zeros((224, 224, 3), dtype=np.uint8),
+                target_size=None,
+                detector_backend=detector_backend,
+                enforce_detection=False,
+                align=True
+            )
+            timings['warmup_seconds'] = round(time.perf_counter() - start, 3)
+
+            print(f"   🔥 Detector {detector_backend}: load {timings['load_seconds']} s, warm-up {timings['warmup_seconds']} s")
 
-            image.close()
+        except Exception as e:
+            print(f"   ❌ Warm-up failed for detector {detector_backend}: {str(e)}")
+            timings['error'] = str(e)
+
+        return timings
+
+    def detect_faces(self, context):
+        """
+        ⭐ Detekcja + alignment twarzy RAZ na zdjęcie
+        context: ImageContext (wynik zapamiętany w context.faces)
+        Zwraca listę: [{'face': wyrównany crop BGR float32 [0,1], 'facial_area': {x, y, w, h, left_eye, right_eye}, 'confidence'}]
 
+        Wynik podaje się do extract_face_encoding(faces=...) dla KAŻDEGO modelu,
+        więc detektor (retinaface) nie jest uruchamiany ponownie per model.
+        """
+        if context.faces is not None:
+            return context.faces
+
+        image = context.bgr
+        print(f"🎯 Detecting faces with {DETECTOR_BACKEND}...")
+
+        try:
+            detected = DeepFace.extract_faces(
+                img_path=image,
+                target_size=None,
+                detector_backend=DETECTOR_BACKEND,
+                enforce_detection=DETECTOR_ENFORCE,
+                align=True
+            )
         except Exception as e:
-            print(f"   ⚠️ Error fixing rotation: {e}")
+            print(f"⚠️ Face detection failed: {str(e)}")
+            # ⭐ FALLBACK: Spróbuj z enforce_detection=False
+            print(f"🔄 Retrying with enforce_detection=False...")
+            try:
+                detected = DeepFace.extract_faces(
+                    img_path=image,
+                    target_size=None,
+                    detector_backend=DETECTOR_BACKEND,
+                    enforce_detection=False,
+                    align=True
+                )
+            except Exception as fallback_e:
+                print(f"❌ Fallback also failed: {str(fallback_e)}")
+                return []
+
+        faces = []
+        for detected_face in detected:
+            # DeepFace.extract_faces zwraca RGB [0,1] - modele oczekują BGR (jak w DeepFace.represent)
+            crop = np.asarray(detected_face['face'], dtype=np.float32)
+            if crop.ndim == 4:
+                crop = crop[0]
+            faces.append({
+                'face': np.ascontiguousarray(crop[:, :, ::-1]),
+                'facial_area': detected_face.get('facial_area', {}),
+                'confidence': detected_face.get('confidence', 0)
+            })
+
+        print(f"✅ {len(faces)} face(s) detected and aligned")
+        context.faces = faces
+        return faces
 
-    def extract_face_encoding(self, image_path, model_name=None, expected_dimensions=None):
+    @staticmethod
+    def letterbox_face(face, target_size):
+        """
+        Przeskaluj twarz z zachowaniem proporcji i dopełnij czarnym tłem
+        (tak samo jak DeepFace.extract_faces) - target_size: (height, width)
+        """
+        factor = min(target_size[0] / face.shape[0], target_size[1] / face.shape[1])
+        dsize = (max(1, int(face.shape[1] * factor)), max(1, int(face.shape[0] * factor)))
+        resized = cv2.resize(face, dsize)
+
+        diff_0 = target_size[0] - resized.shape[0]
+        diff_1 = target_size[1] - resized.shape[1]
+        padded = np.pad(
+            resized,
+            ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)),
+            'constant'
+        )
+
+        if padded.shape[0:2] != tuple(target_size):
+            padded = cv2.resize(padded, (target_size[1], target_size[0]))
+        return padded
+
+    def _embed_face(self, face, model_name, batched=False):
+        """
+        Embedding wyrównanego cropa - bez ponownej detekcji (detector_backend='skip')
+        batched=True: crop dołącza do paczki z równoległych żądań (MicroBatcher)
+        """
+        if batched and MICRO_BATCH_ENABLED:
+            return self.micro_batcher.embed(face, model_name)
+
+        width, height = DeepFace.build_model(model_name).input_shape
+        face_input = self.letterbox_face(face, (height, width))
+
+        embedding = DeepFace.represent(
+            img_path=face_input,
+            model_name=model_name,
+            enforce_detection=False,
+            detector_backend='skip'
+        )
+        return embedding[0]['embedding']
+
+    def extract_face_encoding(self, image_path, model_name=None, expected_dimensions=None, faces=None,
+                              batched=False):
         """
         Wyciągnij encoding twarzy ze zdjęcia
         Zwraca: encoding (lista liczb) lub None
         
         Args:
-            image_path: ścieżka do zdjęcia
+            image_path: ścieżka do zdjęcia albo ImageContext
             model_name: nazwa modelu (np. 'Facenet')
             expected_dimensions: oczekiwana liczba wymiarów
+            faces: wynik detect_faces() - jeśli podany, detekcja jest pomijana
+                   (bez niego detekcja tylko gdy encodingu nie ma w cache'u na dysku)
+            batched: embedding przez micro-batching (ścieżka rozpoznawania)
         """
         if model_name is None:
             model_name = DEEPFACE_PRIMARY_MODEL
@@ -147,90 +350,100 @@ class FaceRecognizer:
         try:
             print(f"📸 Extracting encoding from: {image_path}")
 
-            # Normalizuj ścieżkę
-            full_path = self._normalize_path(image_path)
+            # 💾 TO SAMO ZDJĘCIE JUŻ LICZONE TYM MODELEM - bez detekcji i TensorFlow
+            context, data, image_hash = self._image_source(image_path)
+            encoding = embedding_cache.get(image_hash, model_name)
+            if encoding is not None:
+                print(f"💾 {model_name} encoding from disk cache ({len(encoding)} dimensions)")
+                return encoding
 
-            print(f"📁 Using path: {full_path}")
-            print(f"✅ File exists: {os.path.isfile(full_path)}")
+            if faces is None:
+                # ⭐ Odczytaj obraz (rotacja EXIF w pamięci) - albo gotowy ImageContext
+                # (bajty pliku już odczytane do skrótu)
+                context, _ = self._open_image(context or image_path, data)
+                if context is None:
+                    return None
 
-            if not os.path.isfile(full_path):
-                print(f"❌ File not found: {full_path}")
-                return None
+                print(f"✅ Image loaded successfully")
 
-            # ⭐ NAPRAW ROTACJĘ
-            self.fix_image_rotation(full_path)
+                faces = self.detect_faces(context)
 
-            # Odczytaj obraz
-            image = cv2.imread(full_path)
-            if image is None:
-                print(f"❌ Cannot read image: {full_path}")
+            if not faces:
+                print(f"❌ No face detected in image")
                 return None
 
-            print(f"✅ Image loaded successfully")
+            # Wyciągnij embedding za pomocą DeepFace (crop już wyrównany)
+            print(f"🧠 Running DeepFace with model: {model_name} (aligned face, detection skipped)...")
 
-            # Wyciągnij embedding za pomocą DeepFace
-            print(f"🧠 Running DeepFace with model: {model_name}...")
+            encoding = self._embed_face(faces[0]['face'], model_name, batched=batched)
+            print(f"✅ Encoding extracted successfully ({len(encoding)} dimensions)")
+            embedding_cache.put(image_hash, model_name, encoding)
 
-            embedding = DeepFace.represent(
-                img_path=full_path,
-                model_name=model_name,
-                enforce_detection=DETECTOR_ENFORCE,
-                detector_backend=DETECTOR_BACKEND
-            )
+            # ⭐ WALIDACJA WYMIARÓW
+            if len(encoding) != expected_dimensions:
+                print(f"⚠️ WARNING: Expected {expected_dimensions} dims, got {len(encoding)}")
+                print(f"   Model {model_name} produces {len(encoding)}-dim encodings!")
 
-            if embedding and len(embedding) > 0:
-                encoding = embedding[0]['embedding']
-                print(f"✅ Encoding extracted successfully ({len(encoding)} dimensions)")
-                
-                # ⭐ WALIDACJA WYMIARÓW
-                if len(encoding) != expected_dimensions:
-                    print(f"⚠️ WARNING: Expected {expected_dimensions} dims, got {len(encoding)}")
-                    print(f"   Model {model_name} produces {len(encoding)}-dim encodings!")
-                
-                return encoding
-            else:
-                print(f"❌ No face detected in image")
-                # ⭐ FALLBACK: Spróbuj z enforce_detection=False
-                print(f"🔄 Retrying with enforce_detection=False...")
-                try:
-                    embedding = DeepFace.represent(
-                        img_path=full_path,
-                        model_name=model_name,
-                        enforce_detection=False,  # ← Klucz!
-                        detector_backend=DETECTOR_BACKEND
-                    )
-                    if embedding and len(embedding) > 0:
-                        encoding = embedding[0]['embedding']
-                        print(f"✅ Encoding extracted successfully with fallback ({len(encoding)} dimensions)")
-                        return encoding
-                except Exception as fallback_e:
-                    print(f"❌ Fallback also failed: {str(fallback_e)}")
-                
-                return None
+            return encoding
 
         except Exception as e:
             print(f"❌ Error extracting encoding with {model_name}: {str(e)}")
-            # ⭐ FALLBACK NA EXCEPTION
-            print(f"🔄 Retrying with enforce_detection=False...")
-            try:
-                embedding = DeepFace.represent(
-                    img_path=full_path,
-                    model_name=model_name,
-                    enforce_detection=False,
-                    detector_backend=DETECTOR_BACKEND
-                )
-                if embedding and len(embedding) > 0:
-                    encoding = embedding[0]['embedding']
-                    print(f"✅ Encoding extracted successfully with fallback ({len(encoding)} dimensions)")
-                    return encoding
-            except Exception as fallback_e:
-                print(f"❌ Fallback also failed: {str(fallback_e)}")
-            
             return None
 
+    @staticmethod
+    def model_version(model_name):
+        """Wersja pipeline'u encodingu zapisywana w face_encodings.model_version"""
+        return f"{model_name}/{DETECTOR_BACKEND}/v{ENCODING_VERSION}"
+
+    @staticmethod
+    def feature_version():
+        """Wersja analizy cech zapisywana w face_features.feature_version (crop z detektora)"""
+        return f"features/{DETECTOR_BACKEND}/v{ENCODING_VERSION}"
+
+    def extract_registration_data(self, pesel, image, models=None, with_features=True):
+        """
+        ⭐ Encodingi wszystkich modeli rejestracji + cechy szczególne dla jednego zdjęcia
+        (wspólne dla register_person i `reindex`) - nic nie zapisuje w bazie
+
+        image: ImageContext albo pełna ścieżka do zdjęcia
+        models: lista {'name', 'dimensions'} (domyślnie self.registration_models);
+        pierwszy model z self.registration_models jest wymagany
+        Zwraca: ({model_name: encoding}, features) lub None
+        """
+        models = self.registration_models if models is None else models
+
+        # ⭐ DEKODOWANIE (z rotacją EXIF) RAZ dla wszystkich modeli - detekcja też raz
+        # (zapamiętana w kontekście), i tylko gdy encodingu albo cech nie ma w cache'u na dysku
+        context = ImageContext.of(image)
+        if context is None:
+            return None
+
+        # ⭐ WYCIĄGNIJ ENCODING Z KAŻDEGO MODELU STRATEGII (z walidacją wymiarów)
+        # Główny model jest wymagany, pozostałe - jeśli się uda
+        encodings = {}
+        for model in models:
+            encoding = self.extract_face_encoding(context, model['name'], model['dimensions'])
+
+            if encoding is None:
+                if model['name'] == self.registration_models[0]['name']:
+                    print(f"❌ Failed to extract encoding for {pesel}")
+                    return None
+                print(f"⚠️ No {model['name']} encoding for {pesel} - skipping this gallery")
+                continue
+
+            encodings[model['name']] = encoding
+
+        # ⭐ WYCIĄGNIJ CECHY SZCZEGÓLNE
+        features = None
+        if FEATURE_EXTRACTION_ENABLED and with_features:
+            features = self.analyze_features(context)
+
+        return encodings, features
+
     def register_person(self, pesel, photo_path):
         """
         Zarejestruj osobę - wyciągnij i zapisz encoding + cechy
+        photo_path: ścieżka do zdjęcia albo ImageContext (zdjęcie przesłane w żądaniu)
         """
         try:
             print(f"\n📝 Registering person: PESEL={pesel}")
@@ -240,29 +453,36 @@ class FaceRecognizer:
                 print(f"❌ Person not found in database: {pesel}")
                 return False
 
-            full_path = get_full_path(photo_path)
-            print(f"📁 Photo path: {full_path}")
+            # Zdjęcie z żądania (ImageContext) albo ścieżka z Node.js
+            if isinstance(photo_path, ImageContext):
+                image = photo_path
+            else:
+                image = get_full_path(photo_path)
+                print(f"📁 Photo path: {image}")
 
-            # ⭐ WYCIĄGNIJ ENCODING Z GŁÓWNEGO MODELU (z walidacją wymiarów)
-            encoding = self.extract_face_encoding(
-                full_path,
-                DEEPFACE_PRIMARY_MODEL,
-                PRIMARY_DIMENSIONS
-            )
-            if encoding is None:
-                print(f"❌ Failed to extract encoding for {pesel}")
+                if not os.path.isfile(image):
+                    print(f"❌ File not found: {image}")
+                    return False
+
+            registration = self.extract_registration_data(pesel, image)
+            if registration is None:
                 return False
+            encodings, features = registration
 
-            # ⭐ WYCIĄGNIJ CECHY SZCZEGÓLNE
-            features = None
-            if FEATURE_EXTRACTION_ENABLED:
-                features = self.feature_analyzer.analyze_face_features(full_path)
-                if features:
-                    save_face_features(pesel, features)
-                    print(f"✅ Features saved")
+            if features:
+                save_face_features(pesel, features, self.feature_version())
+                print(f"✅ Features saved")
+
+            # Zapisz encodingi w bazie - każdy do galerii swojego modelu
+            success = True
+            for model_name, encoding in encodings.items():
+                saved = save_face_encoding(pesel, encoding, model_name, self.model_version(model_name))
 
-            # Zapisz encoding w bazie
-            success = save_face_encoding(pesel, encoding, DEEPFACE_PRIMARY_MODEL)
+                # ⭐ Przyrostowa aktualizacja indeksu ANN (jeśli istnieje)
+                if saved:
+                    ann_indexes.add((model_name, len(encoding)), pesel, encoding)
+
+                success = success and saved
 
             if success:
                 print(f"✅ Person registered successfully: {person['first_name']} {person['last_name']}")
@@ -277,7 +497,7 @@ class FaceRecognizer:
             print(f"❌ Error registering person: {str(e)}")
             return False
 
-    def recognize_face(self, image_path):
+    def recognize_face(self, image_path, search_mode=None, top_k=None):
         """
         ⭐ NAPRAWIONA WERSJA - ZWRACA PIERWSZY MATCH ZARAZ
         
@@ -289,161 +509,261 @@ class FaceRecognizer:
         2. Jeśli Model 1 fail → Model 2 (Secondary)
         3. Jeśli Model 2 fail → Model 3 (Tertiary)
         4. Jeśli wszystkie fail → "Nie rozpoznano"
+
+        image_path: ścieżka do zdjęcia albo ImageContext (zdjęcie przesłane w żądaniu)
+
+        search_mode: 'exact' (pełny skan galerii) lub 'ann' (indeks IVF),
+        domyślnie config.SEARCH_MODE
+
+        top_k: zwróć też k najbliższych osób dla KAŻDEGO progu (wynik['Kandydaci']);
+        wtedy sprawdzane są wszystkie progi, a Rozpoznano = pierwszy próg z matchem
         """
-        try:
-            # Normalizuj ścieżkę
-            full_path = self._normalize_path(image_path)
+        search_mode = search_mode or SEARCH_MODE
 
+        try:
             print(f"\n{'=' * 70}")
             print(f"🔍 RECOGNIZE FACE ENDPOINT")
             print(f"{'=' * 70}")
-            print(f"Photo Path: {image_path}")
-            print(f"📁 Full path: {full_path}")
-            print(f"✅ File exists: {os.path.isfile(full_path)}")
-
-            if not os.path.isfile(full_path):
-                print(f"❌ File not found: {full_path}")
+            print(f"Photo: {image_path}")
+
+            # ⚡ TO SAMO ZDJĘCIE (np. ponowienie z aplikacji mobilnej) - wynik z cache'u,
+            # bez dekodowania i modeli; wersja galerii odczytana PRZED rozpoznawaniem
+            context, data, image_hash = self._image_source(image_path)
+            cache_key = self._result_cache_key(image_hash, search_mode, top_k)
+            version = get_encodings_version()
+            cached = recognition_cache.get(cache_key, version)
+            if cached is not None:
+                print(f"⚡ Result cache hit ({cache_key[0][:12]}) - pipeline skipped")
+                print(f"{'=' * 70}\n")
+                return {**cached, "ZCache": True}
+
+            # ⭐ DEKODUJ RAZ (rotacja EXIF w pamięci, plik bez zmian) - wspólne dla
+            # analizy cech, detekcji i wszystkich modeli; bajty już odczytane do skrótu
+            context, error = self._open_image(context or image_path, data)
+            if context is None:
                 return {
                     "Rozpoznano": False,
-                    "Wiadomosc": "Plik nie znaleziony"
+                    "Wiadomosc": error
                 }
 
-            # ⭐ NAPRAW ROTACJĘ
-            self.fix_image_rotation(full_path)
+            result, definitive = self._recognize_context(context, search_mode, top_k)
 
-            # ⭐ WYCIĄGNIJ CECHY Z NIEZNANEGO ZDJĘCIA
-            query_features = None
-            if FEATURE_EXTRACTION_ENABLED:
-                print(f"👁️  Analyzing facial features...")
-                query_features = self.feature_analyzer.analyze_face_features(full_path)
+            # ⚡ Tylko wynik pełnego przebiegu - błąd modelu / brak twarzy / nieudana analiza cech
+            # nie może wracać z cache'u przez RESULT_CACHE_TTL_SECONDS przy ponowieniu
+            if definitive:
+                recognition_cache.put(cache_key, version, result)
+            else:
+                print(f"   ⚠️ Incomplete recognition (model or feature step failed) - result not cached")
+            return {**result, "ZCache": False}
 
-            # ═══════════════════════════════════════════════════════════════════════
-            # ⭐ KLUCZOWA ZMIANA: Próbuj modele po kolei
-            # ZWRACA ZARAZ NA PIERWSZY MATCH!
-            # ═══════════════════════════════════════════════════════════════════════
+        except Exception as e:
+            print(f"❌ Error recognizing face: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return {
+                "Rozpoznano": False,
+                "Wiadomosc": f"Błąd: {str(e)}"
+            }
 
-            for model_config in self.models:
-                model_name = model_config['name']
-                threshold = model_config['threshold']
-                expected_dims = model_config['dimensions']
+    def _recognize_context(self, context, search_mode, top_k):
+        """
+        Trójstopniowe rozpoznawanie zdekodowanego zdjęcia (bez cache'u wyników)
+        Wyjątki obsługuje recognize_face
+        Zwraca: (wynik, definitive) - definitive=False gdy któryś model nie dał encodingu
+        (brak twarzy, błąd modelu) albo analiza cech się nie udała - wynik nie do cache'u
+        """
+        # ⭐ WYCIĄGNIJ CECHY Z NIEZNANEGO ZDJĘCIA
+        query_features = self._analyze_query_features(context)
+        definitive = not FEATURE_EXTRACTION_ENABLED or query_features is not None
+
+        # ═══════════════════════════════════════════════════════════════════════
+        # ⭐ KLUCZOWA ZMIANA: Próbuj modele po kolei
+        # ZWRACA ZARAZ NA PIERWSZY MATCH!
+        #
+        # Embedding + wyszukiwanie liczone RAZ na (model, wymiar) - kolejny próg
+        # tego samego modelu (np. Tertiary Facenet) używa zapamiętanego wyniku
+        # ═══════════════════════════════════════════════════════════════════════
+
+        model_results = {}
+        first_match = None
+        tier_candidates = []
+
+        for model_config in self.models:
+            model_name = model_config['name']
+            threshold = model_config['threshold']
+            expected_dims = model_config['dimensions']
+
+            print(f"\n🔄 Trying model: {model_name} (threshold: {threshold}, dims: {expected_dims})")
+
+            # ⭐ GALERIA TEGO MODELU Z CACHE'U - pusta galeria = nie uruchamiaj modelu
+            gallery_key = (model_name, expected_dims)
+            gallery = get_gallery(*gallery_key)
+
+            if len(gallery) == 0:
+                print(f"   ⚠️ No {model_name} encodings registered - skipping model")
+                continue
+
+            if gallery_key in model_results:
+                print(f"   ♻️  Reusing {model_name} embedding and distances from previous tier")
+            else:
+                # Detekcja leniwie (w extract_face_encoding) - dopiero gdy model ma galerię
+                # i encodingu zapytania nie ma w cache'u na dysku (cechy: analyze_features,
+                # też z cache'u) - zdjęcie w całości w cache'u = bez detektora i TensorFlow
+                model_results[gallery_key] = self._match_with_model(
+                    context, gallery_key, gallery, search_mode, top_k or 1
+                )
 
-                print(f"\n🔄 Trying model: {model_name} (threshold: {threshold}, dims: {expected_dims})")
+            candidates = model_results[gallery_key]
+            if candidates is None:
+                definitive = False
+                continue  # Spróbuj następny model
 
-                # Wyciągnij encoding
-                query_encoding = self.extract_face_encoding(full_path, model_name, expected_dims)
-                if query_encoding is None:
-                    print(f"   ⚠️ Could not extract encoding with {model_name}")
-                    continue  # Spróbuj następny model
+            best_match, best_distance = candidates[0] if candidates else (None, float('inf'))
 
-                # Pobierz wszystkie encodingi z bazy
-                stored_encodings = get_all_face_encodings()
+            if top_k:
+                tier_candidates.append(
+                    self._rank_candidates(candidates, model_name, threshold, query_features)
+                )
 
-                if not stored_encodings:
-                    print("   ⚠️ No faces registered in database")
-                    continue
+            # ⭐ KLUCZOWA ZMIANA: ZWRÓĆ NA PIERWSZY MATCH!
+            if best_match and best_distance < threshold:
+                if first_match is None:
+                    first_match = self._build_match_result(
+                        best_match, best_distance, threshold, model_name, query_features
+                    )
 
-                print(f"   📊 Loaded {len(stored_encodings)} encodings from face_encodings table")
-                print(f"   🔎 Comparing with {len(stored_encodings)} stored faces...")
+                # ⭐ NAJWAŻNIEJSZE: Zwróć ZARAZ! (top_k - najpierw ranking wszystkich progów)
+                if not top_k:
+                    print(f"\n✅ Returning result from model {model_name}")
+                    print(f"{'=' * 70}\n")
+                    return first_match, definitive
 
-                best_match = None
-                best_distance = float('inf')
+            else:
+                print(f"   ❌ NO MATCH with {model_name}")
+                if best_match:
+                    print(f"      Best distance: {best_distance:.4f} (threshold: {threshold})")
+                else:
+                    print(f"      No matches found in database")
 
-                # Porównaj z każdym encodingiem w bazie
-                for pesel, stored_encoding in stored_encodings.items():
-                    try:
-                        distance = self.calculate_distance(
-                            np.array(query_encoding),
-                            np.array(stored_encoding)
-                        )
+        if first_match is None:
+            # ⭐ Jeśli ŻADEN model nie znalazł matcha
+            print(f"\n{'=' * 70}")
+            print(f"❌ NO MATCH WITH ANY MODEL")
+            print(f"{'=' * 70}\n")
 
-                        print(f"      📊 {pesel}: distance = {distance:.4f}")
+        result = first_match or self._no_match_result()
+        if top_k:
+            result['Kandydaci'] = tier_candidates
+        return result, definitive
 
-                        if distance < best_distance:
-                            best_distance = distance
-                            best_match = pesel
+    def _result_cache_key(self, image_hash, search_mode, top_k):
+        """
+        Klucz cache'u wyników: (skrót bajtów zdjęcia, konfiguracja, search_mode, top_k)
+        None gdy skrótu nie da się ustalić (plik nieczytelny) - wtedy bez cache'u
+        """
+        if image_hash is None:
+            return None
+        return (image_hash, self.result_config, search_mode, top_k)
 
-                    except ValueError as e:
-                        print(f"      ⚠️ {pesel}: Dimension mismatch - skipping")
-                        continue
+    def _image_source(self, image):
+        """
+        Bajty zdjęcia odczytane RAZ: skrót z nich, dekodowanie (gdy trzeba) z tego samego bufora
+        Zwraca: (context, data, skrót) - ImageContext: (context, None, context.content_hash),
+        ścieżka: (None, bajty, skrót), plik nieczytelny: (None, None, None)
+        """
+        if isinstance(image, ImageContext):
+            return image, None, image.content_hash
 
-                # ⭐ KLUCZOWA ZMIANA: ZWRÓĆ NA PIERWSZY MATCH!
-                if best_match and best_distance < threshold:
-                    print(f"\n   ✅ MATCH FOUND with {model_name}!")
-                    print(f"      PESEL: {best_match}")
-                    print(f"      Distance: {best_distance:.4f}")
-
-                    person = get_person_by_pesel(best_match)
-
-                    # Konwertuj dystans na pewność
-                    confidence = 1 - (best_distance / threshold)
-                    confidence = max(0, min(1, confidence))
-
-                    # ⭐ ANALIZA CECH SZCZEGÓLNYCH
-                    feature_score = 1.0
-                    feature_details = {}
-
-                    if FEATURE_EXTRACTION_ENABLED and query_features:
-                        stored_features = get_face_features(best_match)
-                        if stored_features:
-                            feature_score = self._compare_features(
-                                query_features,
-                                stored_features
-                            )
-                            feature_details = {
-                                'eye_color_match': query_features.get('eye_color', {}).get('name') == stored_features.get('eye_color', {}).get('name'),
-                                'hair_color_match': query_features.get('hair_color', {}).get('name') == stored_features.get('hair_color', {}).get('name'),
-                                'feature_similarity': feature_score
-                            }
-                            print(f"      👁️  Feature similarity: {feature_score:.2%}")
-
-                    # Połączony wynik
-                    combined_score = (confidence * 0.7) + (feature_score * 0.3)
-
-                    result = {
-                        "Rozpoznano": True,
-                        "Pesel": person['pesel'],
-                        "Imie": person['first_name'],
-                        "Nazwisko": person['last_name'],
-                        "DataUrodzenia": person['date_of_birth'],
-                        "Plec": person['gender'],
-                        "Pewnosc": confidence,
-                        "CechyWynik": feature_score,
-                        "WynikPolaczony": combined_score,
-                        "Model": model_name,
-                        "Dystans": best_distance,
-                        "SzczegolyCech": feature_details,
-                        "Wiadomosc": f"Rozpoznano: {person['first_name']} {person['last_name']}"
-                    }
-
-                    # ⭐ NAJWAŻNIEJSZE: Zwróć ZARAZ!
-                    print(f"\n✅ Returning result from model {model_name}")
-                    print(f"{'=' * 70}\n")
-                    return result
+        data = read_file_bytes(self._normalize_path(image))
+        if data is None:
+            return None, None, None
+        return None, data, content_hash(data)
 
-                else:
-                    print(f"   ❌ NO MATCH with {model_name}")
-                    if best_match:
-                        print(f"      Best distance: {best_distance:.4f} (threshold: {threshold})")
-                    else:
-                        print(f"      No matches found in database")
+    def recognize_all_faces(self, image_path, search_mode=None):
+        """
+        ⭐ Rozpoznaj KAŻDĄ twarz na zdjęciu grupowym
+        - detekcja RAZ (wszystkie twarze)
+        - embedding wszystkich cropów jednym batchem na model
+        - dopasowanie macierzy zapytań (N x D) do galerii (M x D) jednym iloczynem
+        Progi modeli jak w recognize_face; analiza cech dotyczy całego kadru,
+        więc w tym trybie jest pomijana (CechyWynik = 1.0)
+
+        Zwraca: {Rozpoznano: bool (czy ktokolwiek), LiczbaTwarzy, Twarze: [wynik + Obszar]}
+        """
+        search_mode = search_mode or SEARCH_MODE
 
-            # ⭐ Jeśli ŻADEN model nie znalazł matcha
+        try:
             print(f"\n{'=' * 70}")
-            print(f"❌ NO MATCH WITH ANY MODEL")
+            print(f"🔍 RECOGNIZE ALL FACES")
+            print(f"{'=' * 70}")
+            print(f"Photo: {image_path}")
+
+            context, error = self._open_image(image_path)
+            if context is None:
+                return {
+                    "Rozpoznano": False,
+                    "Wiadomosc": error
+                }
+
+            faces = self.detect_faces(context)
+            results = [None] * len(faces)
+            pending = list(range(len(faces)))
+            model_results = {}
+
+            for model_config in self.models:
+                if not pending:
+                    break
+
+                model_name = model_config['name']
+                threshold = model_config['threshold']
+                gallery_key = (model_name, model_config['dimensions'])
+                gallery = get_gallery(*gallery_key)
+
+                if len(gallery) == 0:
+                    print(f"   ⚠️ No {model_name} encodings registered - skipping model")
+                    continue
+
+                if gallery_key not in model_results:
+                    model_results[gallery_key] = self._match_batch_with_model(
+                        [faces[index]['face'] for index in pending],
+                        pending, gallery_key, gallery, search_mode
+                    )
+
+                still_pending = []
+                for index in pending:
+                    best_match, best_distance = model_results[gallery_key].get(index, (None, float('inf')))
+
+                    if best_match and best_distance < threshold:
+                        results[index] = self._build_match_result(
+                            best_match, best_distance, threshold, model_name, None
+                        )
+                    else:
+                        still_pending.append(index)
+
+                print(f"   ✅ {model_name} (threshold {threshold}): {len(pending) - len(still_pending)}/{len(pending)} faces matched")
+                pending = still_pending
+
+            face_results = []
+            for face, result in zip(faces, results):
+                result = result if result is not None else self._no_match_result()
+                area = face['facial_area']
+                result['Obszar'] = {key: int(area[key]) for key in ('x', 'y', 'w', 'h') if key in area}
+                result['PewnoscDetekcji'] = float(face['confidence'] or 0)
+                face_results.append(result)
+
+            recognized = sum(1 for result in face_results if result.get('Rozpoznano'))
+            print(f"✅ {recognized}/{len(face_results)} faces recognized")
             print(f"{'=' * 70}\n")
-            
+
             return {
-                "Rozpoznano": False,
-                "Pesel": None,
-                "Imie": None,
-                "Nazwisko": None,
-                "Pewnosc": 0,
-                "CechyWynik": 0,
-                "Wiadomosc": "Twarz nie została rozpoznana - brak dopasowania z żadnym modelem"
+                "Rozpoznano": recognized > 0,
+                "LiczbaTwarzy": len(face_results),
+                "Twarze": face_results,
+                "Wiadomosc": f"Rozpoznano {recognized} z {len(face_results)} twarzy"
             }
 
         except Exception as e:
-            print(f"❌ Error recognizing face: {str(e)}")
+            print(f"❌ Error recognizing faces: {str(e)}")
             import traceback
             traceback.print_exc()
             return {
@@ -451,85 +771,339 @@ class FaceRecognizer:
                 "Wiadomosc": f"Błąd: {str(e)}"
             }
 
-    def _compare_features(self, features1: dict, features2: dict) -> float:
+    def recognize_faces_batch(self, image_paths, search_mode=None):
+        """
+        ⭐ Rozpoznaj WIELE zdjęć w jednym przebiegu
+        - dekodowanie + detekcja równolegle (wątki, BATCH_DETECT_WORKERS)
+        - JEDEN batchowany forward pass na model dla wszystkich wyrównanych cropów
+        - dopasowanie wszystkich zapytań do galerii jednym iloczynem macierzy
+        Zwraca listę wyników (kolejność jak image_paths) w kształcie recognize_face;
+        element, który nie jest niepustym tekstem, dostaje wynik z błędem (reszta batcha liczona)
+        """
+        search_mode = search_mode or SEARCH_MODE
+        full_paths = [
+            self._normalize_path(path) if isinstance(path, str) and path.strip() else None
+            for path in image_paths
+        ]
+        results = [None] * len(full_paths)
+
+        print(f"\n{'=' * 70}")
+        print(f"🔍 RECOGNIZE FACES BATCH ({len(full_paths)} photos)")
+        print(f"{'=' * 70}")
+
+        def prepare(full_path):
+            """Zwraca: (crop'y twarzy, crop do analizy cech) - (None, None) gdy brak pliku"""
+            if full_path is None:
+                return None, None
+            if not os.path.isfile(full_path):
+                print(f"❌ File not found: {full_path}")
+                return None, None
+            try:
+                # Pełny obraz nie jest trzymany dla całego batcha (pamięć) - tylko crop'y
+                # twarzy i mały crop FEATURE_FACE_SIZE do cech (bez ponownego dekodowania)
+                context = ImageContext.from_path(full_path)
+                if context is None:
+                    return [], None
+                faces = self.detect_faces(context)
+                feature_crop = None
+                if faces and FEATURE_EXTRACTION_ENABLED:
+                    feature_crop = self.feature_analyzer.canonical_face(context)
+                return faces, feature_crop
+            except Exception as e:
+                # Jedno uszkodzone zdjęcie nie może wywrócić całego batcha
+                print(f"❌ Detection failed for {full_path}: {str(e)}")
+                return [], None
+
+        with ThreadPoolExecutor(max_workers=BATCH_DETECT_WORKERS, thread_name_prefix='batch-detect') as pool:
+            prepared = list(pool.map(prepare, full_paths))
+        faces_per_image = [faces for faces, _ in prepared]
+        feature_crops = [crop for _, crop in prepared]
+
+        pending = []
+        for index, faces in enumerate(faces_per_image):
+            if full_paths[index] is None:
+                results[index] = {"Rozpoznano": False, "Wiadomosc": "Nieprawidłowa ścieżka zdjęcia (oczekiwano tekstu)"}
+            elif faces is None:
+                results[index] = {"Rozpoznano": False, "Wiadomosc": "Plik nie znaleziony"}
+            elif faces:
+                pending.append(index)
+
+        # ⭐ Kolejne progi jak w recognize_face - na progu tylko nierozpoznane zdjęcia
+        model_results = {}
+
+        for model_config in self.models:
+            if not pending:
+                break
+
+            model_name = model_config['name']
+            threshold = model_config['threshold']
+            gallery_key = (model_name, model_config['dimensions'])
+            gallery = get_gallery(*gallery_key)
+
+            if len(gallery) == 0:
+                print(f"   ⚠️ No {model_name} encodings registered - skipping model")
+                continue
+
+            if gallery_key not in model_results:
+                model_results[gallery_key] = self._match_batch_with_model(
+                    [faces_per_image[index][0]['face'] for index in pending],
+                    pending, gallery_key, gallery, search_mode
+                )
+
+            still_pending = []
+            for index in pending:
+                best_match, best_distance = model_results[gallery_key].get(index, (None, float('inf')))
+
+                if best_match and best_distance < threshold:
+                    # Cechy tylko dla rozpoznanych - na cropie zapamiętanym w prepare()
+                    query_features = None
+                    if feature_crops[index] is not None:
+                        query_features = self.feature_analyzer.analyze_face_features(
+                            feature_crops[index], canonical=False
+                        )
+
+                    results[index] = self._build_match_result(
+                        best_match, best_distance, threshold, model_name, query_features
+                    )
+                else:
+                    still_pending.append(index)
+
+            print(f"   ✅ {model_name} (threshold {threshold}): {len(pending) - len(still_pending)}/{len(pending)} matched")
+            pending = still_pending
+
+        results = [result if result is not None else self._no_match_result() for result in results]
+
+        print(f"✅ Batch done: {sum(1 for r in results if r.get('Rozpoznano'))}/{len(results)} recognized")
+        print(f"{'=' * 70}\n")
+        return results
+
+    def _match_batch_with_model(self, faces, indexes, gallery_key, gallery, search_mode):
+        """
+        Batchowany embedding + wyszukiwanie dla listy cropów
+        Zwraca: {index: (best_match, best_distance)} - pusty słownik przy błędzie modelu
+        """
+        model_name, expected_dims = gallery_key
+
+        try:
+            print(f"🧠 Running {model_name} on a batch of {len(faces)} faces...")
+            embeddings = self._embed_faces_batch(faces, model_name)
+        except Exception as e:
+            print(f"   ❌ Batch embedding failed with {model_name}: {str(e)}")
+            return {}
+
+        if embeddings.shape[1] != expected_dims:
+            print(f"   ⚠️ {model_name} returned {embeddings.shape[1]} dims - skipping model")
+            return {}
+
+        if search_mode == 'ann':
+            matches = [
+                (self._search_gallery(gallery_key, gallery, query, search_mode) or [(None, float('inf'))])[0]
+                for query in embeddings
+            ]
+        else:
+            matches = gallery.search_batch(embeddings)
+
+        return dict(zip(indexes, matches))
+
+    def _embed_faces_batch(self, faces, model_name):
+        """
+        ⭐ Embedding wielu wyrównanych cropów jednym forward passem modelu
+        (to samo przetwarzanie co _embed_face: letterbox, normalizacja 'base')
+        Zwraca: ndarray (len(faces), wymiary)
+        """
+        model = DeepFace.build_model(model_name)
+        width, height = model.input_shape
+        batch = np.stack([self.letterbox_face(face, (height, width)) for face in faces]).astype(np.float32)
+
+        embeddings = []
+        for start in range(0, len(batch), EMBEDDING_BATCH_SIZE):
+            chunk = batch[start:start + EMBEDDING_BATCH_SIZE]
+            embeddings.append(np.asarray(model.model(chunk, training=False), dtype=np.float32))
+
+        return np.vstack(embeddings)
+
+    def _analyze_query_features(self, context):
+        """
+        Cechy szczególne zdjęcia zapytania (None gdy analiza wyłączona lub brak obrazu)
+        """
+        if not FEATURE_EXTRACTION_ENABLED or context is None:
+            return None
+        return self.analyze_features(context)
+
+    def analyze_features(self, context):
+        """
+        💾 Cechy szczególne zdjęcia - z cache'u na dysku (ten sam skrót bajtów co embeddingi),
+        inaczej detekcja (zapamiętana w kontekście) + analiza na cropie twarzy
+        """
+        features = embedding_cache.get_features(context.content_hash)
+        if features is not None:
+            print(f"💾 Facial features from disk cache")
+            return features
+
+        self.detect_faces(context)
+        print(f"👁️  Analyzing facial features...")
+        features = self.feature_analyzer.analyze_face_features(context)
+        embedding_cache.put_features(context.content_hash, features)
+        return features
+
+    def _build_match_result(self, best_match, best_distance, threshold, model_name, query_features):
+        """Wynik rozpoznania dla dopasowania poniżej progu (+ porównanie cech szczególnych)"""
+        print(f"\n   ✅ MATCH FOUND with {model_name}!")
+        print(f"      PESEL: {best_match}")
+        print(f"      Distance: {best_distance:.4f}")
+
+        person = get_person_by_pesel(best_match)
+
+        # Konwertuj dystans na pewność
+        confidence = 1 - (best_distance / threshold)
+        confidence = max(0, min(1, confidence))
+
+        # ⭐ ANALIZA CECH SZCZEGÓLNYCH
+        feature_score = 1.0
+        feature_details = {}
+
+        if FEATURE_EXTRACTION_ENABLED and query_features:
+            stored_features = get_face_features(best_match)
+            if stored_features:
+                feature_score = compare_features(
+                    query_features,
+                    stored_features
+                )
+                feature_details = {
+                    'eye_color_match': query_features.get('eye_color', {}).get('name') == stored_features.get('eye_color', {}).get('name'),
+                    'hair_color_match': query_features.get('hair_color', {}).get('name') == stored_features.get('hair_color', {}).get('name'),
+                    'feature_similarity': feature_score
+                }
+                print(f"      👁️  Feature similarity: {feature_score:.2%}")
+
+        # Połączony wynik
+        combined_score = (confidence * 0.7) + (feature_score * 0.3)
+
+        return {
+            "Rozpoznano": True,
+            "Pesel": person['pesel'],
+            "Imie": person['first_name'],
+            "Nazwisko": person['last_name'],
+            "DataUrodzenia": person['date_of_birth'],
+            "Plec": person['gender'],
+            "Pewnosc": confidence,
+            "CechyWynik": feature_score,
+            "WynikPolaczony": combined_score,
+            "Model": model_name,
+            "Dystans": best_distance,
+            "SzczegolyCech": feature_details,
+            "Wiadomosc": f"Rozpoznano: {person['first_name']} {person['last_name']}"
+        }
+
+    @staticmethod
+    def _no_match_result():
+        return {
+            "Rozpoznano": False,
+            "Pesel": None,
+            "Imie": None,
+            "Nazwisko": None,
+            "Pewnosc": 0,
+            "CechyWynik": 0,
+            "Wiadomosc": "Twarz nie została rozpoznana - brak dopasowania z żadnym modelem"
+        }
+
+    def _match_with_model(self, context, gallery_key, gallery, search_mode, k=1):
         """
-        ⭐ Porównaj cechy szczególne dwóch twarzy
-        Zwraca wynik podobieństwa (0-1)
+        Embedding zapytania jednym modelem + k najbliższych osób w jego galerii
+        Zwraca: [(pesel, distance), ...] rosnąco lub None gdy nie da się wyciągnąć encodingu
         """
-        total_weight = 0
-        weighted_score = 0
+        model_name, expected_dims = gallery_key
+
+        query_encoding = self.extract_face_encoding(context, model_name, expected_dims, batched=True)
+        if query_encoding is None:
+            print(f"   ⚠️ Could not extract encoding with {model_name}")
+            return None
 
-        # Porównaj każdą cechę
-        for feature_name, weight in FEATURE_WEIGHTS.items():
-            f1 = features1.get(feature_name)
-            f2 = features2.get(feature_name)
+        if len(query_encoding) != expected_dims:
+            print(f"   ⚠️ {model_name} returned {len(query_encoding)} dims - skipping model")
+            return None
 
-            if f1 and f2:
-                similarity = self._compare_single_feature(feature_name, f1, f2)
-                weighted_score += similarity * weight
-                total_weight += weight
+        print(f"   🔎 Comparing with {len(gallery)} stored faces ({search_mode})...")
 
-        return weighted_score / total_weight if total_weight > 0 else 0
+        return self._search_gallery(gallery_key, gallery, query_encoding, search_mode, k)
 
     @staticmethod
-    def _compare_single_feature(feature_name: str, f1: dict, f2: dict) -> float:
-        """
-        Porównaj pojedynczą cechę
-        Zwraca podobieństwo (0-1)
-        """
-        if feature_name in ['eye_color', 'hair_color']:
-            # Porównaj nazwy kolorów
-            if f1.get('name') == f2.get('name'):
-                return 1.0
-            # Sprawdź podobieństwo RGB
-            if 'rgb' in f1 and 'rgb' in f2:
-                diff = np.sqrt(sum((a - b) ** 2 for a, b in zip(f1['rgb'], f2['rgb'])))
-                return max(0, 1 - (diff / 255))
-            return 0.5
-
-        elif feature_name == 'eye_distance':
-            # Porównaj dystans między oczami
-            d1 = f1.get('normalized_distance')
-            d2 = f2.get('normalized_distance')
-            if d1 and d2:
-                diff = abs(d1 - d2)
-                return max(0, 1 - (diff * 5))  # 5% różnicy = 0.95
-            return 0.5
-
-        elif feature_name in ['nose_width', 'mouth_width']:
-            # Porównaj wymiary
-            w1 = f1.get('width_pixels') or f1.get('width_estimate')
-            w2 = f2.get('width_pixels') or f2.get('width_estimate')
-            if w1 and w2:
-                diff = abs(w1 - w2) / max(w1, w2)
-                return max(0, 1 - diff)
-            return 0.5
-
-        elif feature_name == 'eyebrow_shape':
-            # Porównaj kąt brwi
-            a1 = f1.get('average_angle')
-            a2 = f2.get('average_angle')
-            if a1 is not None and a2 is not None:
-                diff = abs(a1 - a2)
-                return max(0, 1 - (diff / 45))  # 45° = 0
-            return 0.5
-
-        elif feature_name == 'facial_asymmetry':
-            # Porównaj asymetrię
-            s1 = f1.get('asymmetry_score', 0.5)
-            s2 = f2.get('asymmetry_score', 0.5)
-            diff = abs(s1 - s2)
-            return max(0, 1 - diff)
-
-        elif feature_name == 'skin_tone':
-            # Porównaj ton skóry
-            t1 = f1.get('skin_tone', 'unknown')
-            t2 = f2.get('skin_tone', 'unknown')
-            if t1 == t2:
-                return 1.0
-            return 0.6
-
-        return 0.5
+    def _search_gallery(gallery_key, gallery, query_encoding, search_mode, k=1):
+        """
+        k najbliższych osób w galerii - dokładnie albo przez indeks IVF
+        Za mała galeria w trybie 'ann' -> zawsze pełny skan
+        Zwraca: [(pesel, distance), ...] rosnąco (pusta lista gdy brak kandydatów)
+        """
+        if search_mode == 'ann':
+            index = ann_indexes.get(gallery_key, gallery)
+            if index is not None:
+                return index.search_top_k(gallery, query_encoding, k)
+
+        return gallery.search_top_k(query_encoding, k)
+
+    def _rank_candidates(self, candidates, model_name, threshold, query_features):
+        """
+        Ranking kandydatów jednego progu: dystans, pewność i (opcjonalnie) zgodność cech
+        Cechy wszystkich kandydatów porównywane jednym przebiegiem galerii cech,
+        wtedy kolejność: najpierw poniżej progu, potem wg wyniku połączonego
+        """
+        feature_scores = None
+        if FEATURE_EXTRACTION_ENABLED and query_features:
+            feature_scores = get_feature_gallery().scores(query_features, [pesel for pesel, _ in candidates])
+
+        # Dane osób wszystkich kandydatów jednym zapytaniem
+        people = get_people_by_pesels([pesel for pesel, _ in candidates])
+
+        ranked = []
+        for i, (pesel, distance) in enumerate(candidates):
+            person = people.get(pesel) or {}
+            confidence = max(0, min(1, 1 - (distance / threshold)))
+            candidate = {
+                "Pesel": pesel,
+                "Imie": person.get('first_name'),
+                "Nazwisko": person.get('last_name'),
+                "Dystans": distance,
+                "Pewnosc": confidence,
+                "PonizejProgu": distance < threshold
+            }
+
+            if feature_scores is not None and not np.isnan(feature_scores[i]):
+                candidate["CechyWynik"] = float(feature_scores[i])
+                candidate["WynikPolaczony"] = (confidence * 0.7) + (candidate["CechyWynik"] * 0.3)
+
+            ranked.append(candidate)
+
+        if feature_scores is not None:
+            ranked.sort(key=lambda c: (not c["PonizejProgu"], -c.get("WynikPolaczony", c["Pewnosc"] * 0.7)))
+
+        return {
+            "Model": model_name,
+            "Prog": threshold,
+            "Kandydaci": ranked
+        }
+
+    def _open_image(self, image, data=None):
+        """
+        ImageContext dla zapytania: gotowy kontekst (np. bajty z żądania HTTP)
+        albo ścieżka (normalizowana, plik dekodowany raz)
+        data: bajty pliku już odczytane (_image_source) - plik nie jest czytany ponownie
+        Zwraca: (context, None) lub (None, komunikat błędu)
+        """
+        if isinstance(image, ImageContext):
+            return image, None
+
+        full_path = self._normalize_path(image)
+        print(f"📁 Full path: {full_path}")
+
+        if not os.path.isfile(full_path):
+            print(f"❌ File not found: {full_path}")
+            return None, "Plik nie znaleziony"
+
+        context = ImageContext.from_path(full_path, data)
+        if context is None:
+            return None, "Nie można odczytać zdjęcia"
+
+        return context, None
 
     @staticmethod
     def _normalize_path(image_path):
@@ -572,8 +1146,8 @@ def main():
     """Główna funkcja do testowania"""
     print("\n🎭 Advanced Face Recognition System - Test Mode\n")
 
-    # Inicjalizuj rozpoznawacz
-    recognizer = FaceRecognizer()
+    # Inicjalizuj rozpoznawacz (modele ładowane leniwie - jedno polecenie)
+    recognizer = FaceRecognizer(preload=False)
 
     # Pobierz argumenty z linii poleceń
     if len(sys.argv) > 1:
@@ -590,14 +1164,51 @@ def main():
             result = recognizer.recognize_face(image_path)
             print(json.dumps(result, default=str))
 
+        elif command == "reindex":
+            import argparse
+            from reindex import run_reindex
+
+            parser = argparse.ArgumentParser(prog="face_recognition.py reindex")
+            parser.add_argument('--workers', type=int, default=REINDEX_WORKERS, help='procesy robocze')
+            parser.add_argument('--batch', type=int, default=REINDEX_BATCH_SIZE, help='osób na transakcję')
+            parser.add_argument('--restart', action='store_true', help='ignoruj checkpoint')
+            parser.add_argument('--no-features', action='store_true', help='tylko encodingi, bez cech')
+            args = parser.parse_args(sys.argv[2:])
+
+            result = run_reindex(
+                recognizer,
+                workers=args.workers,
+                batch_size=args.batch,
+                restart=args.restart,
+                with_features=not args.no_features
+            )
+            print(json.dumps(result))
+
+        elif command == "build-ann":
+            from ann_index import ann_indexes
+
+            # ⭐ Trenowanie indeksów IVF offline - serwer nie trenuje na ścieżce żądania
+            rebuild = '--rebuild' in sys.argv[2:]
+            result = {}
+            for model in recognizer.registration_models:
+                key = (model['name'], model['dimensions'])
+                gallery = get_gallery(*key)
+                index = ann_indexes.rebuild(key, gallery) if rebuild else ann_indexes.ensure(key, gallery)
+                result[f"{key[0]}/{key[1]}"] = index.nlist if index is not None else None
+            print(json.dumps(result))
+
         else:
-            print("Usage:")
-            print("  python face_recognition.py register <pesel> <photo_path>")
-            print("  python face_recognition.py recognize <image_path>")
+            print_usage()
     else:
-        print("Usage:")
-        print("  python face_recognition.py register <pesel> <photo_path>")
-        print("  python face_recognition.py recognize <image_path>")
+        print_usage()
+
+
+def print_usage():
+    print("Usage:")
+    print("  python face_recognition.py register <pesel> <photo_path>")
+    print("  python face_recognition.py recognize <image_path>")
+    print("  python face_recognition.py reindex [--workers N] [--batch N] [--restart] [--no-features]")
+    print("  python face_recognition.py build-ann [--rebuild]")
 
 
 if __name__ == "__main__":
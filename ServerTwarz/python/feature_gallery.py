@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+
+import numpy as np
+
+from config import FEATURE_WEIGHTS
+from utils import (
+    FEATURE_VECTOR_DTYPE,
+    FEATURE_VECTOR_FEATURES,
+    FEATURE_VECTOR_NUMERIC,
+    encode_feature_vector,
+    load_feature_matrix,
+    get_encodings_version
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 👁️  PORÓWNANIE CECH SZCZEGÓLNYCH - DWIE TWARZE (SŁOWNIKI)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def compare_features(features1: dict, features2: dict) -> float:
+    """
+    ⭐ Porównaj cechy szczególne dwóch twarzy
+    Zwraca wynik podobieństwa (0-1)
+    """
+    total_weight = 0
+    weighted_score = 0
+
+    # Porównaj każdą cechę
+    for feature_name, weight in FEATURE_WEIGHTS.items():
+        f1 = features1.get(feature_name)
+        f2 = features2.get(feature_name)
+
+        if f1 and f2:
+            similarity = compare_single_feature(feature_name, f1, f2)
+            weighted_score += similarity * weight
+            total_weight += weight
+
+    return weighted_score / total_weight if total_weight > 0 else 0
+
+
+def compare_single_feature(feature_name: str, f1: dict, f2: dict) -> float:
+    """
+    Porównaj pojedynczą cechę
+    Zwraca podobieństwo (0-1)
+    """
+    if feature_name in ['eye_color', 'hair_color']:
+        # Porównaj nazwy kolorów
+        if f1.get('name') == f2.get('name'):
+            return 1.0
+        # Sprawdź podobieństwo RGB
+        if 'rgb' in f1 and 'rgb' in f2:
+            diff = np.sqrt(sum((a - b) ** 2 for a, b in zip(f1['rgb'], f2['rgb'])))
+            return max(0, 1 - (diff / 255))
+        return 0.5
+
+    elif feature_name == 'eye_distance':
+        # Porównaj dystans między oczami
+        d1 = f1.get('normalized_distance')
+        d2 = f2.get('normalized_distance')
+        if d1 and d2:
+            diff = abs(d1 - d2)
+            return max(0, 1 - (diff * 5))  # 5% różnicy = 0.95
+        return 0.5
+
+    elif feature_name in ['nose_width', 'mouth_width']:
+        # Porównaj wymiary
+        w1 = f1.get('width_pixels') or f1.get('width_estimate')
+        w2 = f2.get('width_pixels') or f2.get('width_estimate')
+        if w1 and w2:
+            diff = abs(w1 - w2) / max(w1, w2)
+            return max(0, 1 - diff)
+        return 0.5
+
+    elif feature_name == 'eyebrow_shape':
+        # Porównaj kąt brwi
+        a1 = f1.get('average_angle')
+        a2 = f2.get('average_angle')
+        if a1 is not None and a2 is not None:
+            diff = abs(a1 - a2)
+            return max(0, 1 - (diff / 45))  # 45° = 0
+        return 0.5
+
+    elif feature_name == 'facial_asymmetry':
+        # Porównaj asymetrię
+        s1 = f1.get('asymmetry_score', 0.5)
+        s2 = f2.get('asymmetry_score', 0.5)
+        diff = abs(s1 - s2)
+        return max(0, 1 - diff)
+
+    elif feature_name == 'skin_tone':
+        # Porównaj ton skóry
+        t1 = f1.get('skin_tone', 'unknown')
+        t2 = f2.get('skin_tone', 'unknown')
+        if t1 == t2:
+            return 1.0
+        return 0.6
+
+    return 0.5
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🗂️  GALERIA CECH - PODOBIEŃSTWO DO WIELU OSÓB JEDNYM PRZEBIEGIEM NUMPY
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class FeatureGallery:
+    """
+    ⭐ Cechy zarejestrowanych osób jako macierze (wiersz i ↔ pesels[i])
+    numeric: N x 11 float32 (NaN = brak wartości), codes: N x 8 int32 (-1 = brak cechy)
+    Wynik identyczny z compare_features, liczony dla wszystkich wierszy naraz
+    """
+
+    def __init__(self, pesels, vectors):
+        vectors = np.asarray(vectors, dtype=FEATURE_VECTOR_DTYPE)
+        self.pesels = np.asarray(pesels, dtype=object)
+        self.numeric = np.ascontiguousarray(vectors['numeric'])
+        self.codes = np.ascontiguousarray(vectors['codes'])
+        self.rows = {pesel: row for row, pesel in enumerate(pesels)}
+
+    @classmethod
+    def from_features(cls, features: dict):
+        """Zbuduj galerię z {pesel: features_dict}"""
+        pesels = list(features)
+        vectors = np.frombuffer(
+            b''.join(encode_feature_vector(features[pesel]) for pesel in pesels),
+            dtype=FEATURE_VECTOR_DTYPE
+        )
+        return cls(pesels, vectors)
+
+    def __len__(self):
+        return self.numeric.shape[0]
+
+    def scores(self, query_features: dict, pesels=None) -> np.ndarray:
+        """
+        Podobieństwo cech zapytania do osób z galerii (0-1)
+        pesels: podzbiór (np. top-k kandydatów) - None = cała galeria
+        Zwraca: float64 w kolejności pesels; NaN dla osób bez zapisanych cech
+        """
+        query = np.frombuffer(encode_feature_vector(query_features), dtype=FEATURE_VECTOR_DTYPE)[0]
+
+        if pesels is None:
+            rows = np.arange(len(self))
+        else:
+            rows = np.array([self.rows.get(pesel, -1) for pesel in pesels], dtype=np.int64)
+
+        known = rows >= 0
+        numeric = self.numeric[rows[known]].astype(np.float64)
+        codes = self.codes[rows[known]]
+
+        weighted = np.zeros(numeric.shape[0])
+        total = np.zeros(numeric.shape[0])
+
+        with np.errstate(invalid='ignore'):
+            for name, weight in FEATURE_WEIGHTS.items():
+                if name not in FEATURE_VECTOR_FEATURES:
+                    continue
+                index = FEATURE_VECTOR_FEATURES.index(name)
+                if query['codes'][index] < 0:
+                    continue
+
+                present = codes[:, index] >= 0
+                similarity = self._similarity(name, query, index, numeric, codes)
+                weighted += np.where(present, similarity * weight, 0.0)
+                total += np.where(present, weight, 0.0)
+
+        result = np.full(rows.shape[0], np.nan)
+        result[known] = np.divide(weighted, total, out=np.zeros_like(weighted), where=total > 0)
+
+        # Osoba bez żadnej zapisanej cechy = brak cech (jak pusty słownik)
+        result[np.flatnonzero(known)[(codes < 0).all(axis=1)]] = np.nan
+        return result
+
+    @staticmethod
+    def _similarity(name, query, index, numeric, codes) -> np.ndarray:
+        """Podobieństwo jednej cechy dla wszystkich wierszy - reguły jak compare_single_feature"""
+        slot = FEATURE_VECTOR_NUMERIC.get(name)
+        q_numeric = query['numeric'].astype(np.float64)
+
+        if name in ('eye_color', 'hair_color'):
+            same_name = codes[:, index] == query['codes'][index]
+            diff = np.linalg.norm(numeric[:, slot] - q_numeric[slot], axis=1)
+            rgb_similarity = np.where(np.isnan(diff), 0.5, np.maximum(0.0, 1 - diff / 255))
+            return np.where(same_name, 1.0, rgb_similarity)
+
+        if name == 'skin_tone':
+            return np.where(codes[:, index] == query['codes'][index], 1.0, 0.6)
+
+        values = numeric[:, slot]
+        diff = np.abs(values - q_numeric[slot])
+
+        if name == 'eye_distance':
+            similarity = 1 - diff * 5
+        elif name in ('nose_width', 'mouth_width'):
+            similarity = 1 - diff / np.maximum(values, q_numeric[slot])
+        elif name == 'eyebrow_shape':
+            similarity = 1 - diff / 45
+        else:
+            # facial_asymmetry - wartość zawsze obecna (domyślnie 0.5)
+            similarity = 1 - diff
+
+        return np.where(np.isnan(diff), 0.5, np.maximum(0.0, similarity))
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 💾 CACHE GALERII CECH - ODŚWIEŻANY PO ZMIANIE DANYCH (gallery_version)
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class FeatureGalleryCache:
+    """Jedna galeria cech na proces, ważna dopóki nie zmieni się wersja z get_encodings_version()"""
+
+    def __init__(self):
+        self._version = None
+        self._gallery = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()     # Jedno ładowanie naraz, poza self._lock
+
+    def get(self) -> FeatureGallery:
+        version = get_encodings_version()
+
+        gallery = self._lookup(version)
+        if gallery is not None:
+            return gallery
+
+        with self._load_lock:
+            # Inny wątek mógł załadować galerię, gdy czekaliśmy
+            gallery = self._lookup(version)
+            if gallery is not None:
+                return gallery
+
+            print("   🔄 Loading feature gallery from database")
+            gallery = FeatureGallery(*load_feature_matrix())
+
+            with self._lock:
+                self._version, self._gallery = version, gallery
+            return gallery
+
+    def _lookup(self, version):
+        """Galeria co najmniej tej wersji albo None (licznik wersji tylko rośnie)"""
+        with self._lock:
+            if self._gallery is not None and version is not None and self._version is not None \
+                    and self._version >= version:
+                return self._gallery
+            return None
+
+    def invalidate(self):
+        with self._lock:
+            self._gallery = None
+
+
+feature_gallery_cache = FeatureGalleryCache()
+
+
+def get_feature_gallery() -> FeatureGallery:
+    """Galeria cech ze wspólnego cache'u procesu"""
+    return feature_gallery_cache.get()
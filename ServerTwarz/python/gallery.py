@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import CACHE_ENCODINGS, MAX_CACHE_SIZE
+from utils import load_encoding_matrix, get_encodings_version
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🗂️  GALERIA ENCODINGÓW - JEDNA MACIERZ ZAMIAST PĘTLI PO PESELACH
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class FaceGallery:
+    """
+    ⭐ Galeria zarejestrowanych encodingów
+    Wszystkie wektory trzymane w jednej ciągłej macierzy float32 (N x D)
+    + równoległa tablica PESELi (wiersz i ↔ pesels[i])
+    """
+
+    def __init__(self, pesels, matrix):
+        self.pesels = np.asarray(pesels, dtype=object)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+        if self.matrix.ndim != 2 or len(self.pesels) != self.matrix.shape[0]:
+            raise ValueError(
+                f"Gallery shape mismatch: {len(self.pesels)} pesels vs matrix {self.matrix.shape}"
+            )
+
+        # ||x||² liczone raz przy budowie galerii
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    @classmethod
+    def from_encodings(cls, encodings: dict, dimensions: int):
+        """
+        Zbuduj galerię z {pesel: encoding_list}
+        Wiersze o innym wymiarze niż `dimensions` są pomijane
+        """
+        pesels = []
+        rows = []
+        skipped = 0
+
+        for pesel, encoding in encodings.items():
+            if len(encoding) != dimensions:
+                skipped += 1
+                continue
+            pesels.append(pesel)
+            rows.append(encoding)
+
+        if skipped:
+            print(f"   ⚠️ Gallery: skipped {skipped} encodings with dimension != {dimensions}")
+
+        matrix = np.array(rows, dtype=np.float32).reshape(len(rows), dimensions)
+        return cls(pesels, matrix)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1]
+
+    def distances(self, query) -> np.ndarray:
+        """
+        Dystans Euklidesowy zapytania do KAŻDEGO wiersza galerii (jedno wywołanie BLAS)
+        ||q - x||² = ||q||² - 2·q·x + ||x||²
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dimensions:
+            raise ValueError(
+                f"Dimension mismatch - query {query.shape[0]} vs gallery {self.dimensions}"
+            )
+
+        sq = self.sq_norms - 2.0 * (self.matrix @ query) + np.dot(query, query)
+        # Błędy zaokrągleń mogą dać minimalnie ujemne wartości
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq)
+
+    def search(self, query):
+        """
+        Najbliższa osoba w galerii
+        Zwraca: (pesel, distance) lub (None, inf) dla pustej galerii
+        """
+        if len(self) == 0:
+            return None, float('inf')
+
+        distances = self.distances(query)
+        best = int(np.argmin(distances))
+        return self.pesels[best], self.exact_distance(query, best)
+
+    def search_top_k(self, query, k: int):
+        """
+        ⭐ k najbliższych osób - argpartition (O(N)) zamiast pełnego sortowania
+        Zwraca: [(pesel, distance), ...] rosnąco wg dokładnego dystansu
+        """
+        k = min(int(k), len(self))
+        if k <= 0:
+            return []
+
+        distances = self.distances(query)
+        rows = np.argpartition(distances, k - 1)[:k] if k < len(self) else np.arange(len(self))
+
+        # Sortowanie tylko k zwycięzców + dokładne dystanse
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        exact = np.linalg.norm(self.matrix[rows] - query, axis=1)
+        order = np.argsort(exact, kind='stable')
+        return [(self.pesels[rows[i]], float(exact[i])) for i in order]
+
+    def search_batch(self, queries, max_block: int = 16_000_000):
+        """
+        ⭐ Najbliższa osoba dla WIELU zapytań - jeden iloczyn macierzy (B x N) na blok
+        Zwraca: [(pesel, distance), ...] w kolejności zapytań
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimensions)
+
+        if len(self) == 0:
+            return [(None, float('inf'))] * queries.shape[0]
+
+        # Blok zapytań tak, żeby macierz dystansów nie przekroczyła max_block elementów
+        block = max(1, max_block // len(self))
+        best_rows = []
+        for start in range(0, queries.shape[0], block):
+            chunk = queries[start:start + block]
+            sq = self.sq_norms[None, :] - 2.0 * (chunk @ self.matrix.T)
+            best_rows.append(np.argmin(sq, axis=1))
+
+        best_rows = np.concatenate(best_rows)
+
+        # Dokładne dystanse dla zwycięzców
+        exact = np.linalg.norm(self.matrix[best_rows] - queries, axis=1)
+        return list(zip(self.pesels[best_rows].tolist(), exact.astype(float).tolist()))
+
+    def exact_distance(self, query, row: int) -> float:
+        """Dokładny dystans do jednego wiersza (bez błędu rozwinięcia ||q-x||²)"""
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        return float(np.linalg.norm(self.matrix[row] - query))
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 💾 CACHE GALERII - ŁADOWANY RAZ, ODŚWIEŻANY TYLKO PO ZMIANIE DANYCH
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class GalleryCache:
+    """
+    ⭐ Cache galerii w pamięci procesu
+    - klucz: (model_name, dimensions)
+    - ważność: wersja z utils.get_encodings_version() (PRAGMA data_version + triggery)
+    - limit: łączna liczba encodingów <= max_size, eviction LRU
+    """
+
+    def __init__(self, max_size: int = MAX_CACHE_SIZE, enabled: bool = CACHE_ENCODINGS):
+        self.max_size = max_size
+        self.enabled = enabled
+        self._entries = OrderedDict()   # key -> (version, FaceGallery)
+        self._lock = threading.RLock()
+        self._load_locks = {}           # key -> Lock (jedno ładowanie na klucz)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name: str, dimensions: int = 128) -> FaceGallery:
+        """
+        Pobierz galerię - z cache'u jeśli aktualna, w przeciwnym razie z bazy
+        Ładowanie poza wspólnym lockiem (trafienia innych modeli nie czekają),
+        lock klucza - równoległe chybienia tego samego modelu ładują raz
+        """
+        key = (model_name, dimensions)
+        version = get_encodings_version()
+
+        with self._lock:
+            gallery = self._lookup(key, version)
+            if gallery is not None:
+                return gallery
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Inny wątek mógł załadować galerię, gdy czekaliśmy
+            with self._lock:
+                gallery = self._lookup(key, version)
+                if gallery is not None:
+                    return gallery
+                self.misses += 1
+
+            gallery = self._load(model_name, dimensions)
+
+            if self.enabled and version is not None:
+                with self._lock:
+                    self._store(key, version, gallery)
+
+            return gallery
+
+    def invalidate(self):
+        """Wyrzuć wszystkie galerie (np. po masowej zmianie danych)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'galleries': len(self._entries),
+                'cached_encodings': self._total_size(),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _lookup(self, key, version):
+        """
+        Galeria z cache'u co najmniej tej wersji albo None (wywoływać pod self._lock)
+        Nowsza wersja też pasuje - licznik tylko rośnie, wątek czekający na
+        load_lock nie nadpisze świeżej galerii starszą
+        """
+        if not self.enabled or version is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < version:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    @staticmethod
+    def _load(model_name, dimensions) -> FaceGallery:
+        print(f"   🔄 Loading gallery from database (model: {model_name}, dims: {dimensions})")
+        pesels, matrix = load_encoding_matrix(model_name, dimensions)
+        return FaceGallery(pesels, matrix)
+
+    def _store(self, key, version, gallery: FaceGallery):
+        self._entries.pop(key, None)
+
+        if len(gallery) > self.max_size:
+            print(f"   ⚠️ Gallery too large for cache ({len(gallery)} > {self.max_size}) - not cached")
+            return
+
+        self._entries[key] = (version, gallery)
+
+        # Eviction LRU aż łączny rozmiar zmieści się w limicie
+        while self._total_size() > self.max_size:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            print(f"   🗑️  Evicted gallery {evicted_key} from cache")
+
+    def _total_size(self) -> int:
+        return sum(len(gallery) for _, gallery in self._entries.values())
+
+
+gallery_cache = GalleryCache()
+
+
+def get_gallery(model_name: str, dimensions: int = 128) -> FaceGallery:
+    """Galeria dla modelu/wymiaru ze wspólnego cache'u procesu"""
+    return gallery_cache.get(model_name, dimensions)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🖼️  IMAGE CONTEXT - ZDJĘCIE DEKODOWANE RAZ NA ŻĄDANIE
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Detekcja, embedding i analiza cech korzystają z tego samego obiektu:
+#   - dekodowanie pliku albo bufora z żądania (z orientacją EXIF) tylko raz
+#   - widoki RGB / gray / HSV / pomniejszony liczone leniwie i zapamiętywane
+#   - wynik detekcji (wyrównane crop'y twarzy) zapamiętany w `faces`
+#   - crop twarzy w stałym rozmiarze dla analizy cech (face_crop)
+#   - skrót bajtów zdjęcia (content_hash) jako klucz cache'u wyników
+# ═══════════════════════════════════════════════════════════════════════════
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def content_hash(data: bytes) -> str:
+    """Skrót zawartości zdjęcia (BLAKE2b, 128 bitów) - te same bajty = ten sam klucz"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def read_file_bytes(full_path: str):
+    """Bajty pliku albo None gdy nie da się go odczytać"""
+    try:
+        with open(full_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class ImageContext:
+    """
+    ⭐ Zdekodowane zdjęcie + leniwie liczone widoki (jeden obiekt na żądanie)
+    Bazowy obraz: BGR uint8 (jak cv2.imread)
+    """
+
+    def __init__(self, bgr, path: str = None):
+        self.bgr = np.ascontiguousarray(bgr)
+        self.path = path
+        self.faces = None       # Wynik FaceRecognizer.detect_faces (cache)
+        self.content_hash = None    # Skrót bajtów źródłowych (from_path / from_bytes)
+        self._views = {}
+
+    @classmethod
+    def from_path(cls, full_path: str, data: bytes = None):
+        """
+        Zdekoduj plik RAZ - orientacja EXIF zastosowana w pamięci
+        (plik nigdy nie jest nadpisywany). Zwraca ImageContext lub None
+        data: bajty pliku już odczytane (np. do skrótu) - bez ponownego odczytu z dysku
+        """
+        try:
+            if data is None:
+                with open(full_path, 'rb') as f:
+                    data = f.read()
+
+            with Image.open(io.BytesIO(data)) as image:
+                orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+                if orientation != 1:
+                    print(f"   📐 EXIF Orientation: {orientation} - rotating in memory")
+                rgb = np.asarray(ImageOps.exif_transpose(image).convert('RGB'))
+
+            context = cls(rgb[:, :, ::-1], path=full_path)
+            context._views['rgb'] = rgb
+            context.content_hash = content_hash(data)
+            return context
+
+        except Exception as e:
+            print(f"❌ Cannot read image: {full_path} ({e})")
+            return None
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Zdekoduj zdjęcie prosto z bufora w pamięci (upload bez zapisu na dysk)
+        cv2.imdecode z IMREAD_COLOR stosuje orientację EXIF. Zwraca ImageContext lub None
+        """
+        try:
+            bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception as e:
+            print(f"❌ Cannot decode image bytes: {e}")
+            return None
+
+        if bgr is None:
+            print(f"❌ Cannot decode image bytes ({len(data)} B)")
+            return None
+
+        context = cls(bgr)
+        context.content_hash = content_hash(data)
+        return context
+
+    @classmethod
+    def of(cls, image):
+        """ImageContext z kontekstu, obrazu BGR albo ścieżki (None gdy nie da się odczytać)"""
+        if image is None or isinstance(image, cls):
+            return image
+        if isinstance(image, str):
+            return cls.from_path(image)
+        return cls(image)
+
+    def __str__(self):
+        return self.path or f"<in-memory image {self.bgr.shape[1]}x{self.bgr.shape[0]}>"
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def _view(self, name, compute):
+        view = self._views.get(name)
+        if view is None:
+            view = compute()
+            self._views[name] = view
+        return view
+
+    @property
+    def rgb(self):
+        return self._view('rgb', lambda: np.ascontiguousarray(self.bgr[:, :, ::-1]))
+
+    @property
+    def gray(self):
+        return self._view('gray', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def hsv(self):
+        return self._view('hsv', lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2HSV))
+
+    def downscaled(self, max_side: int):
+        """
+        Kopia BGR z dłuższym bokiem <= max_side (INTER_AREA)
+        Zwraca: (obraz, skala) - skala do przeliczenia współrzędnych na oryginał
+        """
+        def compute():
+            height, width = self.bgr.shape[:2]
+            scale = min(1.0, max_side / max(height, width))
+            if scale >= 1.0:
+                return self.bgr, 1.0
+            size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+            return cv2.resize(self.bgr, size, interpolation=cv2.INTER_AREA), scale
+
+        return self._view(('downscaled', max_side), compute)
+
+    def face_crop(self, size: int, margin: float = 0.0):
+        """
+        ⭐ Twarz z detekcji (faces[0]) jako kwadrat size x size (nowy ImageContext)
+        margin: poszerzenie ramki z każdej strony (ułamek boku) - np. na włosy i brwi
+        Poza kadrem obraz jest dopełniany powieleniem krawędzi
+        Zwraca None gdy nie wykryto twarzy
+        """
+        if not self.faces:
+            return None
+
+        def compute():
+            area = self.faces[0].get('facial_area') or {}
+            if not all(key in area for key in ('x', 'y', 'w', 'h')):
+                return None
+
+            x, y, w, h = (int(area[key]) for key in ('x', 'y', 'w', 'h'))
+            side = max(1, int(max(w, h) * (1 + 2 * margin)))
+            x0 = int(round(x + w / 2 - side / 2))
+            y0 = int(round(y + h / 2 - side / 2))
+
+            height, width = self.bgr.shape[:2]
+            crop = self.bgr[max(0, y0):min(height, y0 + side), max(0, x0):min(width, x0 + side)]
+            if crop.size == 0:
+                return None
+
+            crop = cv2.copyMakeBorder(
+                crop,
+                max(0, -y0), max(0, y0 + side - height),
+                max(0, -x0), max(0, x0 + side - width),
+                cv2.BORDER_REPLICATE
+            )
+            interpolation = cv2.INTER_AREA if side > size else cv2.INTER_LINEAR
+            return ImageContext(cv2.resize(crop, (size, size), interpolation=interpolation))
+
+        return self._view(('face_crop', size, margin), compute)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import REGISTRATION_WORKERS, REGISTRATION_QUEUE_MAX, JOB_RETENTION_SECONDS, JOB_PRUNE_INTERVAL_SECONDS
+from utils import save_job, get_job, delete_jobs_finished_before, fail_unfinished_jobs
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📝 ZADANIA W TLE - REJESTRACJA BEZ BLOKOWANIA WĄTKU ŻĄDANIA
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Endpoint przyjmuje zadanie (202 + job id) i od razu zwalnia wątek Flaska.
+# Ograniczona pula wątków przetwarza kolejkę, status dostępny pod /api/jobs/<id>.
+# Stany: queued -> running -> done | failed
+# Zakończone zadania trzymane JOB_RETENTION_SECONDS, potem usuwane.
+# Status zapisywany też w tabeli 'jobs' - przy wielu procesach (serve.py)
+# zapytanie o status może trafić do innego procesu niż ten, który liczy.
+# Zadanie pamięta PID procesu - po awarii / restarcie jego queued / running
+# oznaczane są jako failed (fail_interrupted_jobs), inaczej wisiałyby w bazie na zawsze.
+
+
+class QueueFullError(Exception):
+    """Kolejka zadań pełna - klient powinien spróbować później"""
+
+
+class JobQueue:
+    """
+    ⭐ Kolejka zadań przetwarzana przez pulę `workers` wątków
+    Maks `max_pending` zadań czekających + w toku
+    """
+
+    def __init__(self, workers: int = REGISTRATION_WORKERS, max_pending: int = REGISTRATION_QUEUE_MAX,
+                 retention_seconds: int = JOB_RETENTION_SECONDS, name: str = 'jobs',
+                 prune_interval: float = JOB_PRUNE_INTERVAL_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self._last_db_prune = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **info) -> dict:
+        """
+        Dodaj zadanie func(*args) do kolejki
+        info: dodatkowe pola widoczne w statusie (np. pesel)
+        Zwraca: status zadania (dict) albo rzuca QueueFullError
+        """
+        with self._lock:
+            self._prune()
+
+            if self._pending() >= self.max_pending:
+                raise QueueFullError(f"{self.max_pending} jobs already queued or running")
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'state': 'queued',
+                'pid': os.getpid(),
+                **info,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'timings': {},
+                'result': None,
+                'error': None
+            }
+            self._jobs[job['id']] = job
+            snapshot = self._snapshot(job)
+
+        save_job(snapshot)
+        self._pool.submit(self._run, job, func, args)
+        self._prune_db()
+        return snapshot
+
+    def get(self, job_id: str) -> dict:
+        """Status zadania (kopia) albo None gdy nieznane / usunięte - z pamięci albo z bazy"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return self._snapshot(job)
+        return get_job(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job['state']] = states.get(job['state'], 0) + 1
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending(),
+                'states': states
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Nie przyjmuj nowych zadań; wait=True - dokończ te w kolejce"""
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job, func, args):
+        with self._lock:
+            job['state'] = 'running'
+            job['started_at'] = time.time()
+            job['timings']['queued_seconds'] = round(job['started_at'] - job['created_at'], 3)
+            snapshot = self._snapshot(job)
+
+        save_job(snapshot)
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+            state, error = 'done', None
+        except Exception as e:
+            print(f"❌ Job {job['id']} failed: {e}")
+            traceback.print_exc()
+            result, state, error = None, 'failed', str(e)
+
+        with self._lock:
+            job['timings']['run_seconds'] = round(time.perf_counter() - start, 3)
+            job['finished_at'] = time.time()
+            job['result'] = result
+            job['error'] = error
+            job['state'] = state
+            snapshot = self._snapshot(job)
+
+        save_job(snapshot)
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job['state'] in ('queued', 'running'))
+
+    def _prune(self):
+        """Usuń z pamięci zakończone zadania starsze niż retention_seconds (pod self._lock)"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and job['finished_at'] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _prune_db(self):
+        """
+        Stare zadania (także innych procesów) z tabeli 'jobs' - najwyżej raz na prune_interval
+        DELETE poza self._lock: zapis do SQLite nie blokuje innych zgłoszeń ani odczytów statusu
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._last_db_prune < self.prune_interval:
+                return
+            self._last_db_prune = now
+
+        delete_jobs_finished_before(now - self.retention_seconds)
+
+    @staticmethod
+    def _snapshot(job) -> dict:
+        return {**job, 'timings': dict(job['timings'])}
+
+
+def fail_interrupted_jobs(pid: int = None) -> int:
+    """
+    Niezakończone zadania martwego procesu -> failed
+    pid=None: przy starcie serwera (żadne zadanie tego serwera jeszcze nie działa),
+    pid: proces roboczy serve.py, który właśnie padł
+    """
+    count = fail_unfinished_jobs("interrupted - worker process stopped", pid)
+    if count:
+        print(f"⚠️ Marked {count} interrupted job(s) as failed" + (f" (pid {pid})" if pid else ""))
+    return count
+
+
+registration_jobs = JobQueue(name='register')
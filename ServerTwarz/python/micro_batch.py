@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import numpy as np
+
+from config import MICRO_BATCH_WINDOW_MS, MICRO_BATCH_MAX_SIZE
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🧺 MICRO-BATCHING - CROPY Z RÓWNOLEGŁYCH ŻĄDAŃ W JEDNYM FORWARD PASSIE
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Wątek żądania wrzuca wyrównany crop do kolejki modelu i czeka.
+# Wątek modelu zbiera cropy przez `window_ms` od najstarszego
+# (albo do `max_batch` - wtedy startuje od razu), liczy embeddingi
+# jednym wywołaniem embed_batch(faces, model_name) i oddaje każdemu jego wiersz.
+# Cropy, które przyszły w trakcie forward passu, trafiają do następnej paczki.
+
+
+class _Request:
+    __slots__ = ('face', 'arrived', 'done', 'embedding', 'error')
+
+    def __init__(self, face):
+        self.face = face
+        self.arrived = time.monotonic()
+        self.done = threading.Event()
+        self.embedding = None
+        self.error = None
+
+
+class _ModelQueue:
+    """Kolejka + wątek jednego modelu (modele liczą się równolegle)"""
+
+    def __init__(self, batcher, model_name):
+        self.batcher = batcher
+        self.model_name = model_name
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.batches = 0
+        self.requests = 0
+        self.sizes = {}                 # rozmiar paczki -> liczba paczek
+        self.wait_ms = 0.0              # suma czasu w kolejce
+        self.run_ms = 0.0               # suma czasu forward passów
+
+    def put(self, request):
+        with self.cond:
+            # Po fork() wątek rodzica nie istnieje - start leniwie w każdym procesie
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._loop, name=f'micro-batch-{self.model_name}', daemon=True
+                )
+                self.thread.start()
+            self.pending.append(request)
+            self.cond.notify()
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+
+                # Okno liczone od najstarszego cropa - pełna paczka nie czeka
+                deadline = self.pending[0].arrived + self.batcher.window_ms / 1000
+                while len(self.pending) < self.batcher.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                batch = self.pending[:self.batcher.max_batch]
+                del self.pending[:self.batcher.max_batch]
+
+            self._run(batch)
+
+    def _run(self, batch):
+        start = time.monotonic()
+        try:
+            embeddings = np.asarray(
+                self.batcher.embed_batch([request.face for request in batch], self.model_name)
+            )
+            for request, embedding in zip(batch, embeddings):
+                request.embedding = embedding.tolist()
+        except Exception as e:
+            for request in batch:
+                request.error = e
+
+        finished = time.monotonic()
+        with self.cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.sizes[len(batch)] = self.sizes.get(len(batch), 0) + 1
+            self.wait_ms += sum(start - request.arrived for request in batch) * 1000
+            self.run_ms += (finished - start) * 1000
+
+        for request in batch:
+            request.done.set()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else None,
+                'avg_wait_ms': round(self.wait_ms / self.requests, 2) if self.requests else None,
+                'avg_run_ms': round(self.run_ms / self.batches, 2) if self.batches else None,
+                'batch_sizes': dict(sorted(self.sizes.items())),
+                'queued': len(self.pending)
+            }
+
+
+class MicroBatcher:
+    """
+    ⭐ Embedding pojedynczych cropów zbieranych w paczki między wątkami
+    embed_batch(faces, model_name) -> ndarray (len(faces), wymiary)
+    """
+
+    def __init__(self, embed_batch, window_ms: float = MICRO_BATCH_WINDOW_MS,
+                 max_batch: int = MICRO_BATCH_MAX_SIZE):
+        self.embed_batch = embed_batch
+        self.window_ms = window_ms
+        self.max_batch = max(1, max_batch)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def embed(self, face, model_name):
+        """Embedding jednego cropa (lista liczb) - blokuje do końca paczki, błąd modelu rzucany dalej"""
+        with self._lock:
+            queue = self._queues.get(model_name)
+            if queue is None:
+                queue = self._queues[model_name] = _ModelQueue(self, model_name)
+
+        request = _Request(face)
+        queue.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.embedding
+
+    def stats(self) -> dict:
+        with self._lock:
+            queues = dict(self._queues)
+        return {
+            'window_ms': self.window_ms,
+            'max_batch': self.max_batch,
+            'models': {name: queue.stats() for name, queue in queues.items()}
+        }
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🔧 Migracja face_encodings: JSON (TEXT) -> BLOB float32 (little-endian)
+
+Działa ONLINE - małe paczki w krótkich transakcjach, więc serwer Python
+i Node.js mogą w tym czasie normalnie czytać i zapisywać bazę.
+
+Użycie:
+  python migrate_encodings.py               # migracja paczkami po 500 wierszy
+  python migrate_encodings.py --batch 2000
+  python migrate_encodings.py --vacuum      # + odzyskanie miejsca na dysku
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+from config import DATABASE_PATH
+from utils import encode_encoding, decode_encoding
+
+
+def encoding_storage_stats(db):
+    """Liczba wierszy i rozmiar kolumny encoding wg typu (text / blob)"""
+    rows = db.execute('''
+        SELECT typeof(encoding), COUNT(*), COALESCE(SUM(length(CAST(encoding AS BLOB))), 0)
+        FROM face_encodings
+        GROUP BY typeof(encoding)
+    ''').fetchall()
+    return {kind: (count, size) for kind, count, size in rows}
+
+
+def migrate(batch_size: int = 500, vacuum: bool = False):
+    print("=" * 70)
+    print("🔧 MIGRATING face_encodings: JSON -> BLOB float32")
+    print("=" * 70)
+    print(f"📁 Database: {DATABASE_PATH}")
+
+    db = sqlite3.connect(DATABASE_PATH, timeout=30)
+    db.execute('PRAGMA busy_timeout = 30000')
+
+    before = encoding_storage_stats(db)
+    file_before = os.path.getsize(DATABASE_PATH)
+    for kind, (count, size) in before.items():
+        print(f"   📊 {kind}: {count} rows, {size / 1024:.1f} KB")
+
+    migrated = 0
+    failed = 0
+    start = time.perf_counter()
+    last_id = 0
+
+    while True:
+        rows = db.execute('''
+            SELECT id, pesel, encoding FROM face_encodings
+            WHERE typeof(encoding) = 'text' AND id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, batch_size)).fetchall()
+
+        if not rows:
+            break
+
+        updates = []
+        for row_id, pesel, value in rows:
+            last_id = row_id
+            try:
+                vector = decode_encoding(value)
+                updates.append((encode_encoding(vector), vector.shape[0], row_id))
+            except Exception as e:
+                failed += 1
+                print(f"   ⚠️ {pesel}: cannot decode JSON encoding - skipped ({e})")
+
+        # Krótka transakcja na paczkę; warunek typeof chroni przed nadpisaniem
+        # wiersza, który w międzyczasie został zapisany na nowo jako BLOB
+        with db:
+            db.executemany('''
+                UPDATE face_encodings SET encoding = ?, dimensions = ?
+                WHERE id = ? AND typeof(encoding) = 'text'
+            ''', updates)
+
+        migrated += len(updates)
+        print(f"   ✅ {migrated} rows migrated...")
+
+    print(f"\n⏱️  Migrated {migrated} rows in {time.perf_counter() - start:.2f} s ({failed} failed)")
+
+    if vacuum:
+        print("🧹 VACUUM...")
+        db.execute('VACUUM')
+
+    after = encoding_storage_stats(db)
+    db.close()
+
+    for kind, (count, size) in after.items():
+        print(f"   📊 {kind}: {count} rows, {size / 1024:.1f} KB")
+    print(f"   💾 faces.db: {file_before / 1024:.1f} KB -> {os.path.getsize(DATABASE_PATH) / 1024:.1f} KB")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate face_encodings to float32 BLOBs")
+    parser.add_argument('--batch', type=int, default=500, help='wierszy na transakcję')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM po migracji')
+    args = parser.parse_args()
+
+    migrate(args.batch, args.vacuum)
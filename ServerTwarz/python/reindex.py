@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🔁 Masowa ponowna rejestracja całej tabeli 'faces' (po zmianie modelu / detektora)
+
+Uruchamiane przez: python face_recognition.py reindex [--workers N] [--batch N] [--restart] [--no-features]
+
+- osoby strumieniowane z 'faces' w kolejności PESEL (bez ładowania całej tabeli)
+- praca rozdzielana na pulę procesów - każdy proces ładuje modele RAZ
+- zapis encodingów + cech paczkami w jednej transakcji (jeden pisarz - główny proces)
+- checkpoint w ENCODINGS_DIR - przerwany reindex wznawia się od ostatniej paczki,
+  nieudane PESELe z przerwanego przebiegu są ponawiane na początku; usuwany po zakończeniu
+- przeliczane są tylko encodingi z nieaktualnym model_version i cechy z nieaktualnym
+  feature_version (--no-features: cechy zostają nieaktualne do następnego pełnego reindexu)
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from config import REINDEX_WORKERS, REINDEX_BATCH_SIZE, REINDEX_CHECKPOINT_PATH
+from utils import (
+    count_people_with_photos,
+    iter_people_with_photos,
+    get_people_photos,
+    get_encoding_versions,
+    get_feature_versions,
+    save_reindex_batch,
+    get_full_path
+)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 👷 PROCES ROBOCZY
+# ═══════════════════════════════════════════════════════════════════════════
+
+_worker_recognizer = None
+
+
+def _init_worker():
+    """Jeden FaceRecognizer (detektor + modele) na proces roboczy"""
+    global _worker_recognizer
+    from face_recognition import FaceRecognizer
+
+    _worker_recognizer = FaceRecognizer(preload=False)
+    _worker_recognizer.warm_up()
+
+
+def _reindex_person(task):
+    """
+    Policz encodingi nieaktualnych modeli (+ nieaktualne cechy) dla jednej osoby
+    Zwraca: {'pesel', 'encodings': {model: ndarray}, 'features', 'error', 'skipped'}
+    """
+    pesel, photo_path, models, with_features = task
+    skipped = not models and not with_features
+    result = {'pesel': pesel, 'encodings': {}, 'features': None, 'error': None, 'skipped': skipped}
+
+    # Encodingi i cechy aktualne - nic do liczenia
+    if skipped:
+        return result
+
+    try:
+        full_path = get_full_path(photo_path)
+        if not os.path.isfile(full_path):
+            result['error'] = f"file not found: {full_path}"
+            return result
+
+        registration = _worker_recognizer.extract_registration_data(
+            pesel, full_path, models, with_features=with_features
+        )
+
+        if registration is None:
+            result['error'] = "no encoding extracted"
+            return result
+
+        result['encodings'], result['features'] = registration
+        if not models and not result['features']:
+            result['error'] = "no features extracted"
+
+    except Exception as e:
+        result['error'] = str(e)
+
+    return result
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 💾 CHECKPOINT
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def load_checkpoint(path, versions):
+    """Checkpoint tylko jeśli dotyczy tych samych wersji modeli"""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except Exception as e:
+        print(f"⚠️ Cannot read checkpoint {path}: {e}")
+        return None
+
+    if checkpoint.get('versions') != versions:
+        print("⚠️ Checkpoint is for different model versions - starting from scratch")
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Zapis atomowy (tmp + replace) - przerwanie w trakcie nie psuje pliku"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🔁 REINDEX
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def _stale_tasks(recognizer, people, versions, feature_version, page_size):
+    """
+    Generator zadań (pesel, photo_path, nieaktualne_modele, czy_liczyć_cechy)
+    people: iterowalne (pesel, photo_path)
+    feature_version: aktualna wersja cech albo None (--no-features - cech nie liczymy)
+    Wersje encodingów i cech sprawdzane jednym zapytaniem na stronę osób
+    """
+    page = []
+
+    def flush():
+        pesels = [pesel for pesel, _ in page]
+        current = get_encoding_versions(pesels)
+        current_features = get_feature_versions(pesels) if feature_version else {}
+        for pesel, photo_path in page:
+            stale = [
+                model for model in recognizer.registration_models
+                if current.get((pesel, model['name'])) != versions[model['name']]
+            ]
+            stale_features = feature_version is not None and current_features.get(pesel) != feature_version
+            yield pesel, photo_path, stale, stale_features
+
+    for person in people:
+        page.append(person)
+        if len(page) >= page_size:
+            yield from flush()
+            page = []
+
+    if page:
+        yield from flush()
+
+
+def run_reindex(recognizer, workers=REINDEX_WORKERS, batch_size=REINDEX_BATCH_SIZE,
+                restart=False, with_features=True, checkpoint_path=REINDEX_CHECKPOINT_PATH):
+    """
+    ⭐ Przelicz encodingi (i cechy) wszystkich osób z nieaktualnym model_version
+    recognizer: FaceRecognizer głównego procesu (konfiguracja modeli, bez ładowania)
+    """
+    versions = {model['name']: recognizer.model_version(model['name']) for model in recognizer.registration_models}
+    feature_version = recognizer.feature_version() if with_features else None
+
+    print(f"\n{'=' * 70}")
+    print(f"🔁 REINDEX - {', '.join(versions.values())}")
+    print(f"{'=' * 70}")
+
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, versions)
+    if checkpoint is None:
+        checkpoint = {'versions': versions, 'last_pesel': '', 'processed': 0, 'failed': [], 'retry': []}
+    else:
+        print(f"▶️  Resuming after PESEL {checkpoint['last_pesel']} ({checkpoint['processed']} already done)")
+
+    # ⭐ Nieudane w przerwanym przebiegu - last_pesel już je minął, więc ponów je na początku
+    # ('retry' = jeszcze nieponowione, ponowny błąd wraca do 'failed')
+    checkpoint['retry'] = checkpoint.get('retry', []) + checkpoint['failed']
+    checkpoint['failed'] = []
+    retry = set(checkpoint['retry'])
+    if retry:
+        print(f"🔁 Retrying {len(retry)} PESELs that failed before the interruption")
+
+    total = count_people_with_photos(checkpoint['last_pesel']) + len(retry)
+    print(f"📊 People to scan: {total}, workers: {workers}, batch: {batch_size}")
+
+    scanned = 0
+    embedded = 0
+    failed = 0
+    start = time.perf_counter()
+
+    encoding_rows = []
+    feature_rows = []
+    batch_pesels = []
+
+    def commit_batch(last_pesel):
+        nonlocal encoding_rows, feature_rows, batch_pesels
+        if encoding_rows or feature_rows:
+            if not save_reindex_batch(encoding_rows, feature_rows):
+                raise RuntimeError("batch write failed - checkpoint not advanced")
+
+        checkpoint['last_pesel'] = last_pesel
+        checkpoint['processed'] += len(batch_pesels)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+        elapsed = time.perf_counter() - start
+        rate = scanned / elapsed if elapsed > 0 else 0
+        eta = (total - scanned) / rate if rate > 0 else 0
+        print(f"   ✅ {scanned}/{total} scanned, {embedded} re-embedded, {failed} failed "
+              f"| {rate:.1f} people/s | ETA {eta / 60:.1f} min")
+
+        encoding_rows, feature_rows, batch_pesels = [], [], []
+
+    page_size = batch_size * 10
+    people = itertools.chain(
+        get_people_photos(sorted(retry)),
+        iter_people_with_photos(checkpoint['last_pesel'], page_size)
+    )
+    tasks = _stale_tasks(recognizer, people, versions, feature_version, page_size)
+
+    # 'spawn' - TensorFlow nie znosi fork() po inicjalizacji
+    context = multiprocessing.get_context('spawn')
+    last_pesel = checkpoint['last_pesel']
+
+    with context.Pool(processes=workers, initializer=_init_worker) as pool:
+        # imap zachowuje kolejność -> checkpoint = prefiks przetworzonych PESELi
+        # (osoby z aktualnymi encodingami wracają z procesu od razu)
+        for result in pool.imap(_reindex_person, tasks, chunksize=1):
+            scanned += 1
+            pesel = result['pesel']
+            batch_pesels.append(pesel)
+
+            # Ponowienia mają PESEL < last_pesel - nie przesuwają checkpointu
+            if pesel in retry:
+                retry.discard(pesel)
+                checkpoint['retry'].remove(pesel)
+            else:
+                last_pesel = pesel
+
+            if result['error']:
+                failed += 1
+                checkpoint['failed'].append(pesel)
+                print(f"   ⚠️ {pesel}: {result['error']}")
+            elif not result['skipped']:
+                embedded += 1
+                for model_name, encoding in result['encodings'].items():
+                    encoding_rows.append((pesel, model_name, versions[model_name], encoding))
+                if result['features']:
+                    feature_rows.append((pesel, result['features'], feature_version))
+
+            if len(batch_pesels) >= batch_size:
+                commit_batch(last_pesel)
+
+    if batch_pesels or encoding_rows:
+        commit_batch(last_pesel)
+
+    # Przebieg kompletny - checkpoint niepotrzebny (retry bez zdjęcia w 'faces' też odpada)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n⏱️  Reindex done in {elapsed:.1f} s: {embedded} re-embedded, {failed} failed, {scanned} scanned")
+    if checkpoint['failed']:
+        # Encodingi nieudanych zostają nieaktualne - następny reindex weźmie je ponownie
+        print(f"   ⚠️ Failed PESELs (retried by the next reindex): {', '.join(checkpoint['failed'])}")
+
+    _rebuild_ann_indexes(recognizer)
+    print(f"{'=' * 70}\n")
+
+    return {'scanned': scanned, 'embedded': embedded, 'failed': failed,
+            'failed_pesels': checkpoint['failed'], 'seconds': elapsed}
+
+
+def _rebuild_ann_indexes(recognizer):
+    """Istniejące indeksy IVF były trenowane na starych encodingach - trenuj od nowa"""
+    from gallery import get_gallery
+    from ann_index import ann_indexes
+
+    for model in recognizer.registration_models:
+        key = (model['name'], model['dimensions'])
+        if os.path.exists(ann_indexes.path_for(key)):
+            print(f"🧭 Rebuilding IVF index {key}...")
+            ann_indexes.rebuild(key, get_gallery(*key))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+from config import RESULT_CACHE_ENABLED, RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS
+
+# ═══════════════════════════════════════════════════════════════════════════
+# ⚡ CACHE WYNIKÓW ROZPOZNAWANIA - PONOWIENIA TEGO SAMEGO ZDJĘCIA
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Klucz: skrót bajtów zdjęcia + konfiguracja (modele, progi, detektor,
+# search_mode, top_k). Wpis ważny tylko dla wersji galerii, przy której go
+# policzono (utils.get_encodings_version - triggery na encodingach, cechach
+# i usuwaniu osób) i maks `ttl_seconds` (zmiana imienia w Node.js nie podbija wersji).
+# Każdy proces (serve.py) ma własny cache.
+
+
+class RecognitionCache:
+    """
+    ⭐ LRU + TTL wyników FaceRecognizer.recognize_face
+    - wartość: (wersja galerii, czas zapisu, wynik)
+    - limit: `max_entries` wyników, eviction LRU
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+                 enabled: bool = RESULT_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """Wynik dla klucza przy tej wersji galerii albo None (brak / nieaktualny / wygasły)"""
+        if not self.enabled or key is None or version is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, stored_at, result = entry
+                if entry_version == version and time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, version, result):
+        """
+        Zapamiętaj wynik - `version` odczytana PRZED rozpoznawaniem
+        (zmiana galerii w trakcie = wpis od razu nieaktualny)
+        """
+        if not self.enabled or key is None or version is None:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, time.monotonic(), result)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+recognition_cache = RecognitionCache()
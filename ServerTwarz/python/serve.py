@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🚀 Tryb produkcyjny API: proces rodzic + N procesów roboczych (prefork)
+
+Rodzic (NIE inicjalizuje TensorFlow - jego wątki i stan nie przeżywają fork(),
+tak jak w reindex.py, który z tego powodu używa 'spawn'):
+  - pliki wag detektora i modeli pobierane na dysk w osobnym procesie ('spawn')
+  - galerie encodingów, indeksy ANN i galeria cech ładowane RAZ, potem gc.freeze()
+    -> procesy robocze dzielą te strony pamięci (copy-on-write)
+  - otwiera gniazdo i robi fork() procesów roboczych (wspólne accept())
+  - pilnuje procesów: awaria -> restart z rosnącym opóźnieniem,
+    SIGTERM / SIGINT -> łagodne zamknięcie (dokończenie żądań i zadań w tle)
+
+Proces roboczy:
+  - wątki TF + budowa modeli z plików na dysku + warm-up (próbna inferencja) po fork()
+  - serwer WSGI (werkzeug, wątek na żądanie) na wspólnym gnieździe
+
+Użycie:
+  python serve.py
+  python serve.py --workers 8 --tf-intra 1 --port 5001
+  python serve.py --no-preload        # każdy proces ładuje galerie sam
+
+Do developmentu dalej: python app.py (jeden proces, debug)
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import config
+from config import (
+    API_PORT,
+    SEARCH_MODE,
+    DETECTOR_BACKEND,
+    SERVE_HOST,
+    SERVE_WORKERS,
+    SERVE_TF_INTRA_OP_THREADS,
+    SERVE_TF_INTER_OP_THREADS,
+    SERVE_PRELOAD,
+    SERVE_RESTART_DELAY,
+    SERVE_MAX_RESTART_DELAY,
+    SERVE_SHUTDOWN_TIMEOUT
+)
+
+# Proces roboczy, który padł szybciej niż po tylu sekundach, liczy się jako "szybka awaria"
+CRASH_LOOP_SECONDS = 10
+
+
+def set_thread_env(intra_op: int, inter_op: int):
+    """Wątki TF/OpenMP przez zmienne środowiskowe - dziedziczone przez procesy robocze"""
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op)
+    os.environ.setdefault('OMP_NUM_THREADS', str(intra_op))
+
+
+def configure_tensorflow_threads(intra_op: int, inter_op: int):
+    """Wątki TF w procesie roboczym - po fork(), ZANIM TensorFlow utworzy swoje pule"""
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except Exception as e:
+        print(f"⚠️ Cannot configure TensorFlow threads: {e}")
+
+
+def _fetch_weights(model_names):
+    """Proces pomocniczy ('spawn'): pobierz pliki wag na dysk (~/.deepface) i zakończ"""
+    from deepface import DeepFace
+    from deepface.detectors import DetectorWrapper
+
+    DetectorWrapper.build_model(DETECTOR_BACKEND)
+    for model_name in model_names:
+        DeepFace.build_model(model_name)
+
+
+def fetch_weights(model_names):
+    """
+    Pliki wag gotowe na dysku przed fork() - procesy robocze nie pobierają ich naraz
+    Osobny proces 'spawn': TensorFlow rodzica zostaje niezainicjalizowany
+    """
+    print(f"\n📦 Fetching detector + model weights ({', '.join(model_names)})...")
+    start = time.perf_counter()
+
+    process = multiprocessing.get_context('spawn').Process(target=_fetch_weights, args=(model_names,))
+    process.start()
+    process.join()
+
+    if process.exitcode != 0:
+        print(f"⚠️ Weight fetch exited with {process.exitcode} - workers will load weights themselves")
+    else:
+        print(f"✅ Weights on disk in {time.perf_counter() - start:.1f} s")
+
+
+def preload(service):
+    """Stan bezpieczny dla fork(): pliki wag na dysku + galerie i indeksy w pamięci rodzica"""
+    from gallery import get_gallery
+    from ann_index import ann_indexes
+    from feature_gallery import get_feature_gallery
+
+    fetch_weights(list(dict.fromkeys(m['name'] for m in service.recognizer.models)))
+
+    for model in service.recognizer.registration_models:
+        key = (model['name'], model['dimensions'])
+        gallery = get_gallery(*key)
+        if SEARCH_MODE == 'ann':
+            ann_indexes.ensure(key, gallery)      # Trenowanie tutaj, nie w wątku przed fork()
+
+    if config.FEATURE_EXTRACTION_ENABLED:
+        get_feature_gallery()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 👷 PROCES ROBOCZY
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+def run_worker(service, listener, worker_id, tf_threads):
+    """Modele + warm-up po fork(), potem obsługa żądań z gniazda rodzica do SIGTERM"""
+    from werkzeug.serving import make_server
+    from jobs import registration_jobs
+
+    # Ctrl+C trafia do całej grupy procesów - zamykaniem steruje rodzic
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    print(f"👷 Worker {worker_id} (pid {os.getpid()}) loading models...")
+    configure_tensorflow_threads(*tf_threads)
+    service.recognizer.warm_up()
+    if service.recognizer.warmup_status['state'] == 'failed':
+        print(f"❌ Worker {worker_id}: warm-up failed")
+        return 3
+
+    server = make_server(
+        listener.getsockname()[0], listener.getsockname()[1],
+        service.app, threaded=True, fd=listener.fileno()
+    )
+
+    def stop(signum, frame):
+        # shutdown() czeka na pętlę serve_forever - musi być wołane z innego wątku
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"✅ Worker {worker_id} (pid {os.getpid()}) serving")
+    server.serve_forever()
+
+    print(f"🛑 Worker {worker_id} (pid {os.getpid()}) finishing background jobs...")
+    registration_jobs.shutdown(wait=True)
+    return 0
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🧭 RODZIC - NADZÓR PROCESÓW ROBOCZYCH
+# ═══════════════════════════════════════════════════════════════════════════
+
+
+class Supervisor:
+    """Fork N procesów roboczych, restart po awarii, łagodne zamknięcie"""
+
+    def __init__(self, service, listener, workers: int, tf_threads):
+        self.service = service
+        self.listener = listener
+        self.workers = workers
+        self.tf_threads = tf_threads            # (intra_op, inter_op) na proces roboczy
+        self.children = {}                      # pid -> worker_id
+        self.started_at = {}                    # worker_id -> time.monotonic()
+        self.restart_delay = {}                 # worker_id -> opóźnienie następnego restartu
+        self.pending_restarts = {}              # worker_id -> kiedy uruchomić
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.service, self.listener, worker_id, self.tf_threads)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                # Bez handlerów atexit rodzica (TF, logowanie)
+                os._exit(code)
+
+        self.children[pid] = worker_id
+        self.started_at[worker_id] = time.monotonic()
+
+    def stop(self, signum, frame):
+        if not self.stopping:
+            print(f"\n🛑 Signal {signum} - stopping {len(self.children)} workers...")
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+        while not self.stopping:
+            self._reap()
+            self._restart_due()
+            time.sleep(0.5)
+
+        self._shutdown()
+
+    def _reap(self):
+        """Zbierz zakończone procesy i zaplanuj restart (z rosnącym opóźnieniem przy szybkich awariach)"""
+        from jobs import fail_interrupted_jobs
+
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None:
+                continue
+
+            uptime = time.monotonic() - self.started_at[worker_id]
+            if uptime < CRASH_LOOP_SECONDS:
+                delay = min(self.restart_delay.get(worker_id, SERVE_RESTART_DELAY / 2) * 2, SERVE_MAX_RESTART_DELAY)
+            else:
+                delay = SERVE_RESTART_DELAY
+            self.restart_delay[worker_id] = delay
+
+            print(f"⚠️ Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)} "
+                  f"after {uptime:.1f} s - restarting in {delay:.1f} s")
+            self.pending_restarts[worker_id] = time.monotonic() + delay
+
+            # Kolejka zadań zginęła razem z procesem
+            fail_interrupted_jobs(pid)
+
+    def _restart_due(self):
+        now = time.monotonic()
+        for worker_id, when in list(self.pending_restarts.items()):
+            if when <= now:
+                del self.pending_restarts[worker_id]
+                self.spawn(worker_id)
+
+    def _shutdown(self):
+        for pid in self.children:
+            self._signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + SERVE_SHUTDOWN_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.2)
+            else:
+                self.children.pop(pid, None)
+
+        for pid in self.children:
+            print(f"⚠️ Worker pid {pid} did not stop in {SERVE_SHUTDOWN_TIMEOUT} s - killing")
+            self._signal(pid, signal.SIGKILL)
+
+        print("✅ All workers stopped")
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face recognition API - production prefork server")
+    parser.add_argument('--host', default=SERVE_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help='procesy robocze')
+    parser.add_argument('--tf-intra', type=int, default=SERVE_TF_INTRA_OP_THREADS, help='wątki TF na operację')
+    parser.add_argument('--tf-inter', type=int, default=SERVE_TF_INTER_OP_THREADS, help='równoległe operacje TF')
+    parser.add_argument('--no-preload', action='store_true', help='galerie ładowane w każdym procesie osobno')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 70)
+    print("🚀 Face Recognition API - production mode")
+    print("=" * 70)
+    print(f"📍 http://{args.host}:{args.port}, workers: {args.workers}, "
+          f"TF threads: {args.tf_intra} intra / {args.tf_inter} inter")
+
+    set_thread_env(args.tf_intra, args.tf_inter)
+
+    # app.py tworzy FaceRecognizer przy imporcie - bez warm-up (TensorFlow) w rodzicu
+    config.PRELOAD_MODELS = False
+    import app as service
+
+    if not hasattr(os, 'fork'):
+        # Windows: brak fork() - jeden proces, wiele wątków, bez trybu debug
+        from werkzeug.serving import make_server
+        print("⚠️ os.fork() not available - serving from a single process")
+        configure_tensorflow_threads(args.tf_intra, args.tf_inter)
+        service.recognizer.warm_up()
+        make_server(args.host, args.port, service.app, threaded=True).serve_forever()
+        return
+
+    if SERVE_PRELOAD and not args.no_preload:
+        preload(service)
+
+    # Obiekty rodzica poza GC - zliczanie referencji nie kopiuje ich stron w procesach roboczych
+    gc.collect()
+    gc.freeze()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+
+    print("=" * 70 + "\n")
+    Supervisor(service, listener, args.workers, (args.tf_intra, args.tf_inter)).run()
+    listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,181 @@
 import sqlite3
 import json
 import os
-from config import DATABASE_PATH
+import threading
+import time
+import zlib
+import numpy as np
+from config import (
+    DATABASE_PATH,
+    DB_POOL_ENABLED,
+    DB_POOL_SIZE,
+    DB_JOURNAL_MODE,
+    DB_BUSY_TIMEOUT_MS,
+    DB_MMAP_SIZE,
+    DB_CACHE_SIZE_KB,
+    DB_STATEMENT_CACHE
+)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 🗄️  DATABASE UTILITIES - KOMPATYBILNE Z NODE.JS
 # ═══════════════════════════════════════════════════════════════════════════
+#
+# ⭐ PULA POŁĄCZEŃ: get_db() wydaje długo żyjące połączenie z puli,
+#   db.close() oddaje je do puli (niezatwierdzona transakcja jest cofana).
+#   Połączenie nieoddane (wyjątek przed close) zamyka garbage collector.
+#   Każde połączenie: WAL, busy_timeout, mmap, cache stron i cache
+#   przygotowanych zapytań - przy krótkich połączeniach nic z tego nie działało.
+
+class PooledConnection(sqlite3.Connection):
+    """Połączenie z puli - close() oddaje je do puli zamiast zamykać"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+class ConnectionPool:
+    """
+    ⭐ Pula połączeń SQLite współdzielona przez wątki (LIFO - najcieplejsze połączenie)
+    Połączenie używa naraz tylko jeden wątek (od get_db do close)
+    """
+
+    def __init__(self, database_path=None, size: int = DB_POOL_SIZE, enabled: bool = DB_POOL_ENABLED):
+        self.database_path = database_path
+        self.size = size
+        self.enabled = enabled
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            # Po fork() połączenia rodzica nie mogą być używane w dziecku
+            if self._pid != os.getpid():
+                self._idle = []
+                self._pid = os.getpid()
+
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+
+            self.created += 1
+
+        return self._connect()
+
+    def release(self, db: sqlite3.Connection):
+        if db.in_transaction:
+            db.rollback()
+        db.row_factory = sqlite3.Row
+
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(db)
+                return
+
+        sqlite3.Connection.close(db)
+
+    def close_all(self):
+        """Zamknij bezczynne połączenia (np. przed podmianą pliku bazy)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for db in idle:
+            sqlite3.Connection.close(db)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'idle': len(self._idle),
+                'size': self.size,
+                'created': self.created,
+                'reused': self.reused
+            }
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(
+            self.database_path or DATABASE_PATH,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+            factory=PooledConnection
+        )
+        db.pool = self
+        db.row_factory = sqlite3.Row
+        configure_connection(db)
+        return db
+
+def configure_connection(db: sqlite3.Connection):
+    """Pragmy wydajnościowe dla długo żyjącego połączenia"""
+    db.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}')
+    if DB_JOURNAL_MODE:
+        # Tryb dziennika zapisywany w pliku bazy - Node.js też przejdzie na WAL
+        # (zmiana wymaga chwili bez innych zapisów - nieudana próba nie blokuje połączenia)
+        try:
+            mode = db.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}').fetchone()[0]
+            if mode.upper() == 'WAL':
+                db.execute('PRAGMA synchronous = NORMAL')
+        except sqlite3.OperationalError as e:
+            print(f"⚠️ Cannot switch journal_mode to {DB_JOURNAL_MODE}: {e}")
+    db.execute(f'PRAGMA mmap_size = {int(DB_MMAP_SIZE)}')
+    db.execute(f'PRAGMA cache_size = {-int(DB_CACHE_SIZE_KB)}')
+    db.execute('PRAGMA temp_store = MEMORY')
+
+db_pool = ConnectionPool()
 
 def get_db():
-    """Pobierz połączenie do bazy danych"""
+    """Pobierz połączenie do bazy danych (z puli - oddaj przez db.close())"""
+    if db_pool.enabled:
+        return db_pool.acquire()
+
     db = sqlite3.connect(DATABASE_PATH)
     db.row_factory = sqlite3.Row
     return db
 
+FACE_ENCODINGS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pesel TEXT NOT NULL,
+        encoding BLOB NOT NULL,
+        model_name TEXT NOT NULL DEFAULT 'Facenet',
+        model_version TEXT,
+        dimensions INTEGER DEFAULT 128,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (pesel, model_name),
+        FOREIGN KEY (pesel) REFERENCES faces(pesel) ON DELETE CASCADE
+    )
+'''
+
+def _migrate_face_encodings_per_model(cursor):
+    """
+    Stara tabela miała 'pesel UNIQUE' (jeden encoding na osobę).
+    SQLite nie usuwa ograniczeń przez ALTER - przebuduj tabelę na UNIQUE(pesel, model_name).
+    """
+    for index in cursor.execute('PRAGMA index_list(face_encodings)').fetchall():
+        if not index['unique']:
+            continue
+        columns = [col['name'] for col in cursor.execute(f"PRAGMA index_info('{index['name']}')").fetchall()]
+        if columns == ['pesel']:
+            break
+    else:
+        return
+
+    print("🔧 Migrating face_encodings: UNIQUE(pesel) -> UNIQUE(pesel, model_name)")
+    cursor.execute('DROP TABLE IF EXISTS face_encodings_new')
+    cursor.execute(FACE_ENCODINGS_SCHEMA.format(table='face_encodings_new'))
+    cursor.execute('''
+        INSERT INTO face_encodings_new (id, pesel, encoding, model_name, dimensions, created_at)
+        SELECT id, pesel, encoding, COALESCE(model_name, 'Facenet'), dimensions, created_at
+        FROM face_encodings
+    ''')
+    cursor.execute('DROP TABLE face_encodings')
+    cursor.execute('ALTER TABLE face_encodings_new RENAME TO face_encodings')
+
 def init_db():
     """
     Inicjalizuj bazę danych - UŻYWAJ TEJ SAMEJ STRUKTURY CO NODE.JS!
@@ -45,19 +208,15 @@ def init_db():
         ''')
         print("✅ Tabela 'faces' gotowa (kompatybilna z Node.js)")
 
-        # ✅ TABELA: face_encodings (dla python - zawiera encoding z Facenet)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS face_encodings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pesel TEXT UNIQUE NOT NULL,
-                encoding TEXT NOT NULL,
-                model_name TEXT DEFAULT 'Facenet',
-                dimensions INTEGER DEFAULT 128,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (pesel) REFERENCES faces(pesel) ON DELETE CASCADE
-            )
-        ''')
-        print("✅ Tabela 'face_encodings' gotowa (Python encodingi)")
+        # ✅ TABELA: face_encodings (dla python - jeden encoding na parę pesel + model)
+        cursor.execute(FACE_ENCODINGS_SCHEMA.format(table='face_encodings'))
+        _migrate_face_encodings_per_model(cursor)
+
+        # model_version: wersja modelu/detektora/preprocessingu encodingu (reindex)
+        columns = [col['name'] for col in cursor.execute('PRAGMA table_info(face_encodings)').fetchall()]
+        if 'model_version' not in columns:
+            cursor.execute('ALTER TABLE face_encodings ADD COLUMN model_version TEXT')
+        print("✅ Tabela 'face_encodings' gotowa (Python encodingi, galeria per model)")
 
         # ✅ TABELA: face_features (dla python - cechy szczególne)
         cursor.execute('''
@@ -75,12 +234,64 @@ def init_db():
                 age_estimate TEXT,
                 skin_tone TEXT,
                 features_json TEXT,
+                feature_vector BLOB,
+                feature_version TEXT,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (pesel) REFERENCES faces(pesel) ON DELETE CASCADE
             )
         ''')
+
+        # Tabela utworzona przez Node.js ma 'skin_texture' zamiast 'skin_features'
+        columns = [col['name'] for col in cursor.execute('PRAGMA table_info(face_features)').fetchall()]
+        if 'skin_features' not in columns:
+            cursor.execute('ALTER TABLE face_features ADD COLUMN skin_features TEXT')
+        # feature_vector: cechy jako wektor liczbowy (galeria cech, porównanie wektorowe)
+        if 'feature_vector' not in columns:
+            cursor.execute('ALTER TABLE face_features ADD COLUMN feature_vector BLOB')
+        # feature_version: wersja analizy cech (reindex) - niezależna od model_version encodingów
+        if 'feature_version' not in columns:
+            cursor.execute('ALTER TABLE face_features ADD COLUMN feature_version TEXT')
         print("✅ Tabela 'face_features' gotowa (Python cechy)")
 
+        # ✅ TABELA: jobs (status zadań w tle - widoczny dla każdego procesu roboczego)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                job_json TEXT NOT NULL,
+                finished_at REAL
+            )
+        ''')
+        print("✅ Tabela 'jobs' gotowa (zadania w tle)")
+
+        # ✅ LICZNIK ZMIAN GALERII - podbijany triggerami przy KAŻDYM zapisie
+        # (także z Node.js), dzięki temu cache encodingów i cech wie kiedy się przeładować
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS gallery_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO gallery_version (id, version) VALUES (1, 0)')
+
+        for trigger_name, event, table in (
+            ('face_encodings_version_ai', 'INSERT', 'face_encodings'),
+            ('face_encodings_version_au', 'UPDATE', 'face_encodings'),
+            ('face_encodings_version_ad', 'DELETE', 'face_encodings'),
+            ('faces_version_ad', 'DELETE', 'faces'),
+            ('face_features_version_ai', 'INSERT', 'face_features'),
+            ('face_features_version_au', 'UPDATE', 'face_features'),
+            ('face_features_version_ad', 'DELETE', 'face_features'),
+        ):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {trigger_name}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE gallery_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+        print("✅ Licznik 'gallery_version' gotowy (invalidacja cache)")
+
         db.commit()
         db.close()
 
@@ -114,21 +325,48 @@ def get_person_by_pesel(pesel: str) -> dict:
         db.close()
 
         if row:
-            return {
-                'pesel': row['pesel'],
-                'first_name': row['first_name'],
-                'last_name': row['last_name'],
-                'date_of_birth': row['date_of_birth'],
-                'gender': row['gender'],
-                'photo_path': row['photo_path'],
-                'created_at': row['created_at']
-            }
+            return _person_from_row(row)
         return None
 
     except Exception as e:
         print(f"❌ Error getting person: {str(e)}")
         return None
 
+def get_people_by_pesels(pesels: list) -> dict:
+    """
+    ⭐ Wiele osób JEDNYM zapytaniem (np. ranking kandydatów top_k)
+    Zwraca: {pesel: osoba} - PESELi bez osoby w 'faces' nie ma w wyniku
+    """
+    pesels = list(dict.fromkeys(pesels))
+    if not pesels:
+        return {}
+
+    try:
+        db = get_db()
+        placeholders = ','.join('?' * len(pesels))
+        rows = db.execute(
+            f'SELECT * FROM faces WHERE pesel IN ({placeholders})',
+            pesels
+        ).fetchall()
+        db.close()
+
+        return {row['pesel']: _person_from_row(row) for row in rows}
+
+    except Exception as e:
+        print(f"❌ Error getting people: {str(e)}")
+        return {}
+
+def _person_from_row(row) -> dict:
+    return {
+        'pesel': row['pesel'],
+        'first_name': row['first_name'],
+        'last_name': row['last_name'],
+        'date_of_birth': row['date_of_birth'],
+        'gender': row['gender'],
+        'photo_path': row['photo_path'],
+        'created_at': row['created_at']
+    }
+
 def get_all_people() -> list:
     """Pobierz wszystkie osoby ze tabeli 'faces'"""
     try:
@@ -148,56 +386,68 @@ def get_all_people() -> list:
 # ═══════════════════════════════════════════════════════════════════════════
 # 🧠 FACE ENCODING FUNCTIONS - PYTHON ENCODINGI (128-dim)
 # ═══════════════════════════════════════════════════════════════════════════
+#
+# ⭐ FORMAT: encoding zapisywany jako BLOB - little-endian float32
+#   (128 wymiarów = 512 bajtów zamiast ~2.5 KB tekstu JSON)
+#   Stare wiersze z JSON (TEXT) są nadal czytane - migracja:
+#   python migrate_encodings.py
+
+ENCODING_DTYPE = np.dtype('<f4')
+
+def encode_encoding(encoding) -> bytes:
+    """Encoding (lista / ndarray) -> bajty little-endian float32"""
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+def decode_encoding(value) -> np.ndarray:
+    """
+    Bajty (BLOB) albo stary JSON (TEXT) -> ndarray float32
+    BLOB czytany przez np.frombuffer - bez kopiowania
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=ENCODING_DTYPE)
+    return np.asarray(json.loads(value), dtype=ENCODING_DTYPE)
 
-def save_face_encoding(pesel: str, encoding: list, model_name: str = 'Facenet') -> bool:
+def save_face_encoding(pesel: str, encoding: list, model_name: str = 'Facenet', model_version: str = None) -> bool:
     """
     Zapisz encoding twarzy do tabeli 'face_encodings'
     
-    ⚠️ WAŻNE: To przechowuje encoding z Facenet (128 wymiarów)
+    ⚠️ WAŻNE: Jeden wiersz na parę (pesel, model_name) - każdy model ma własną galerię
     Node.js embedding w tabeli 'faces' zostaje niezmieniony
     
     Args:
         pesel: PESEL osoby
         encoding: lista liczb (128-wymiarowy wektor)
-        model_name: nazwa modelu (zawsze 'Facenet')
+        model_name: nazwa modelu (np. 'Facenet', 'OpenFace')
+        model_version: wersja pipeline'u encodingu (np. 'Facenet/retinaface/v1')
     """
     try:
         db = get_db()
         cursor = db.cursor()
 
-        # Konwertuj encoding na JSON
-        encoding_json = json.dumps(encoding)
+        # Konwertuj encoding na BLOB float32
+        encoding_blob = encode_encoding(encoding)
         dimensions = len(encoding)
 
         print(f"   💾 Saving encoding to face_encodings for {pesel}")
         print(f"      Model: {model_name}, Dimensions: {dimensions}")
 
-        # Sprawdź czy encoding już istnieje
-        cursor.execute(
-            'SELECT id FROM face_encodings WHERE pesel = ?',
-            (pesel,)
-        )
-
-        existing = cursor.fetchone()
-
-        if existing:
-            # Update istniejącego
-            cursor.execute('''
-                UPDATE face_encodings 
-                SET encoding = ?, model_name = ?, dimensions = ?
-                WHERE pesel = ?
-            ''', (encoding_json, model_name, dimensions, pesel))
-            print(f"   ✅ Encoding UPDATED for {pesel}")
-        else:
-            # Wstaw nowy
-            cursor.execute('''
-                INSERT INTO face_encodings (pesel, encoding, model_name, dimensions)
-                VALUES (?, ?, ?, ?)
-            ''', (pesel, encoding_json, model_name, dimensions))
-            print(f"   ✅ Encoding INSERTED for {pesel}")
+        # ⭐ UPSERT jednym poleceniem - równoległe rejestracje tej samej osoby (kolejka zadań)
+        # nie kończą się IntegrityError jak przy SELECT + INSERT
+        cursor.execute('''
+            INSERT INTO face_encodings (pesel, encoding, model_name, model_version, dimensions)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (pesel, model_name) DO UPDATE SET
+                encoding = excluded.encoding,
+                model_version = excluded.model_version,
+                dimensions = excluded.dimensions
+        ''', (pesel, encoding_blob, model_name, model_version, dimensions))
+        print(f"   ✅ Encoding SAVED for {pesel}")
 
         db.commit()
         db.close()
+
+        # ⭐ Galeria w pamięci jest już nieaktualna
+        invalidate_encodings_version()
         return True
 
     except Exception as e:
@@ -206,44 +456,47 @@ def save_face_encoding(pesel: str, encoding: list, model_name: str = 'Facenet')
         traceback.print_exc()
         return False
 
-def get_face_encoding(pesel: str) -> list:
-    """Pobierz encoding twarzy dla osoby z tabeli 'face_encodings'"""
+def get_face_encoding(pesel: str, model_name: str = 'Facenet') -> list:
+    """Pobierz encoding twarzy (danego modelu) dla osoby z tabeli 'face_encodings'"""
     try:
         db = get_db()
         cursor = db.cursor()
 
         cursor.execute(
-            'SELECT encoding FROM face_encodings WHERE pesel = ?',
-            (pesel,)
+            'SELECT encoding FROM face_encodings WHERE pesel = ? AND model_name = ?',
+            (pesel, model_name)
         )
 
         row = cursor.fetchone()
         db.close()
 
         if row:
-            return json.loads(row['encoding'])
+            return decode_encoding(row['encoding']).tolist()
         return None
 
     except Exception as e:
         print(f"❌ Error getting encoding: {str(e)}")
         return None
 
-def get_all_face_encodings() -> dict:
+def get_all_face_encodings(model_name: str = 'Facenet') -> dict:
     """
-    Pobierz wszystkie encodingi z tabeli 'face_encodings'
-    Zwraca: {pesel: encoding_list}
+    Pobierz wszystkie encodingi danego modelu z tabeli 'face_encodings'
+    Zwraca: {pesel: ndarray float32}
     """
     try:
         db = get_db()
         cursor = db.cursor()
 
-        cursor.execute('SELECT pesel, encoding FROM face_encodings')
+        cursor.execute(
+            'SELECT pesel, encoding FROM face_encodings WHERE model_name = ?',
+            (model_name,)
+        )
         rows = cursor.fetchall()
         db.close()
 
         result = {}
         for row in rows:
-            result[row['pesel']] = json.loads(row['encoding'])
+            result[row['pesel']] = decode_encoding(row['encoding'])
 
         print(f"   📊 Loaded {len(result)} encodings from face_encodings table")
         return result
@@ -252,64 +505,234 @@ def get_all_face_encodings() -> dict:
         print(f"❌ Error getting all encodings: {str(e)}")
         return {}
 
+def load_encoding_matrix(model_name: str, dimensions: int):
+    """
+    ⭐ Wczytaj galerię modelu od razu jako macierz float32 (N x dimensions)
+    Zwraca: (pesels, matrix)
+
+    Wiersze BLOB są sklejane i dekodowane JEDNYM np.frombuffer,
+    stare wiersze JSON dekodowane pojedynczo (kompatybilność).
+    """
+    try:
+        db = get_db()
+        cursor = db.cursor()
+
+        cursor.execute(
+            'SELECT pesel, encoding FROM face_encodings WHERE model_name = ? AND dimensions = ?',
+            (model_name, dimensions)
+        )
+        rows = cursor.fetchall()
+        db.close()
+
+        row_bytes = dimensions * ENCODING_DTYPE.itemsize
+        pesels = []
+        chunks = []
+        legacy = 0
+
+        for pesel, value in rows:
+            if isinstance(value, bytes):
+                if len(value) != row_bytes:
+                    continue
+                chunks.append(value)
+            else:
+                vector = decode_encoding(value)
+                if vector.shape[0] != dimensions:
+                    continue
+                chunks.append(vector.tobytes())
+                legacy += 1
+            pesels.append(pesel)
+
+        matrix = np.frombuffer(b''.join(chunks), dtype=ENCODING_DTYPE).reshape(len(pesels), dimensions)
+
+        print(f"   📊 Loaded {len(pesels)} {model_name} encodings from face_encodings table"
+              + (f" ({legacy} legacy JSON rows - run migrate_encodings.py)" if legacy else ""))
+        return pesels, matrix
+
+    except Exception as e:
+        print(f"❌ Error loading encoding matrix: {str(e)}")
+        return [], np.empty((0, dimensions), dtype=ENCODING_DTYPE)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🔄 WERSJA GALERII - WYKRYWANIE ZMIAN (Python + Node.js)
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# PRAGMA data_version zmienia się gdy INNE połączenie (np. Node.js albo
+# save_face_encoding) zatwierdzi transakcję. Sprawdzenie nie czyta żadnej
+# tabeli, więc na gorącej ścieżce kosztuje praktycznie zero. Dopiero gdy
+# data_version się zmieni, czytamy licznik 'gallery_version' podbijany
+# triggerami - zapisy do innych tabel (logi, historia) nie przeładowują galerii.
+
+_version_lock = threading.Lock()
+_version_db = None
+_version_state = {'data_version': None, 'version': None}
+
+def get_encodings_version():
+    """
+    Pobierz aktualną wersję galerii encodingów
+    Zwraca: int lub None (nie da się ustalić -> cache nie powinien ufać danym)
+    """
+    global _version_db
+
+    with _version_lock:
+        try:
+            if _version_db is None:
+                _version_db = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+
+            data_version = _version_db.execute('PRAGMA data_version').fetchone()[0]
+
+            if (_version_state['version'] is None
+                    or data_version != _version_state['data_version']):
+                row = _version_db.execute(
+                    'SELECT version FROM gallery_version WHERE id = 1'
+                ).fetchone()
+                _version_state['data_version'] = data_version
+                _version_state['version'] = row[0] if row else 0
+
+            return _version_state['version']
+
+        except Exception as e:
+            print(f"❌ Error getting encodings version: {str(e)}")
+            return None
+
+def invalidate_encodings_version():
+    """Wymuś ponowne odczytanie licznika przy następnym get_encodings_version()"""
+    with _version_lock:
+        _version_state['version'] = None
+
+def _reset_after_fork():
+    """
+    Proces potomny (serve.py) nie może używać połączeń SQLite rodzica
+    Pula sprawdza PID sama, połączenie do data_version otwieramy od nowa
+    """
+    global _version_db, _version_lock
+    _version_db = None
+    _version_lock = threading.Lock()
+    _version_state['version'] = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
 # ═══════════════════════════════════════════════════════════════════════════
 # 👁️  FACE FEATURES FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════
 
-def save_face_features(pesel: str, features: dict) -> bool:
+# ⭐ FORMAT: feature_vector BLOB = stały układ (struktura FEATURE_VECTOR_DTYPE)
+#   numeric: 11 x float32 - RGB oczu, RGB włosów, rozstaw oczu, nos, usta, kąt brwi, asymetria
+#            (NaN = brak wartości -> porównanie daje 0.5 jak w compare_single_feature)
+#   codes:   8 x int32 - jeden na cechę z FEATURE_VECTOR_FEATURES
+#            (-1 = brak cechy, nazwy kolorów / tonu skóry jako crc32, 0 = cecha liczbowa obecna)
+#   Stare wiersze bez feature_vector są kodowane z features_json przy ładowaniu galerii
+
+FEATURE_VECTOR_FEATURES = (
+    'eye_color', 'hair_color', 'eye_distance', 'nose_width',
+    'mouth_width', 'eyebrow_shape', 'facial_asymmetry', 'skin_tone'
+)
+FEATURE_VECTOR_NUMERIC = {
+    'eye_color': slice(0, 3),
+    'hair_color': slice(3, 6),
+    'eye_distance': 6,
+    'nose_width': 7,
+    'mouth_width': 8,
+    'eyebrow_shape': 9,
+    'facial_asymmetry': 10
+}
+FEATURE_VECTOR_DTYPE = np.dtype([
+    ('numeric', '<f4', (11,)),
+    ('codes', '<i4', (len(FEATURE_VECTOR_FEATURES),))
+])
+
+def _category_code(value) -> int:
+    """Stały kod kategorii (nazwa koloru, ton skóry) - crc32, bez słownika nazw"""
+    return zlib.crc32(str(value).encode('utf-8')) & 0x7fffffff
+
+def encode_feature_vector(features: dict) -> bytes:
+    """Słownik cech (jak z FaceFeatureAnalyzer) -> bajty FEATURE_VECTOR_DTYPE"""
+    vector = np.zeros(1, dtype=FEATURE_VECTOR_DTYPE)[0]
+    vector['numeric'][:] = np.nan
+    vector['codes'][:] = -1
+
+    for index, name in enumerate(FEATURE_VECTOR_FEATURES):
+        feature = features.get(name)
+        if not feature or not isinstance(feature, dict):
+            continue
+
+        slot = FEATURE_VECTOR_NUMERIC.get(name)
+        vector['codes'][index] = 0
+
+        if name in ('eye_color', 'hair_color'):
+            vector['codes'][index] = _category_code(feature.get('name'))
+            rgb = feature.get('rgb')
+            if rgb is not None and len(rgb) == 3:
+                vector['numeric'][slot] = rgb
+        elif name == 'skin_tone':
+            vector['codes'][index] = _category_code(feature.get('skin_tone', 'unknown'))
+        elif name == 'eye_distance':
+            value = feature.get('normalized_distance')
+            vector['numeric'][slot] = value if value else np.nan
+        elif name in ('nose_width', 'mouth_width'):
+            value = feature.get('width_pixels') or feature.get('width_estimate')
+            vector['numeric'][slot] = value if value else np.nan
+        elif name == 'eyebrow_shape':
+            value = feature.get('average_angle')
+            vector['numeric'][slot] = value if value is not None else np.nan
+        elif name == 'facial_asymmetry':
+            value = feature.get('asymmetry_score', 0.5)
+            vector['numeric'][slot] = value if value is not None else 0.5
+
+    return vector.tobytes()
+
+def _feature_columns(features: dict) -> tuple:
+    """Wartości kolumn face_features wyciągnięte ze słownika cech (kolejność jak w tabeli)"""
+    eye_color = features.get('eye_color', {}).get('name', 'unknown') if isinstance(features.get('eye_color'), dict) else features.get('eye_color', 'unknown')
+    hair_color = features.get('hair_color', {}).get('name', 'unknown') if isinstance(features.get('hair_color'), dict) else features.get('hair_color', 'unknown')
+    eye_distance = features.get('eye_distance', {}).get('normalized_distance', 0) if isinstance(features.get('eye_distance'), dict) else 0
+    nose_width = features.get('nose_width', {}).get('width_estimate', 0) if isinstance(features.get('nose_width'), dict) else 0
+    mouth_width = features.get('mouth_width', {}).get('aspect_ratio', 0) if isinstance(features.get('mouth_width'), dict) else 0
+    eyebrow_shape = features.get('eyebrow_shape', {}).get('shape_description', 'unknown') if isinstance(features.get('eyebrow_shape'), dict) else features.get('eyebrow_shape', 'unknown')
+    skin_features = features.get('skin_features', {}).get('texture_description', 'unknown') if isinstance(features.get('skin_features'), dict) else 'unknown'
+    facial_asymmetry = features.get('facial_asymmetry', {}).get('asymmetry_score', 0) if isinstance(features.get('facial_asymmetry'), dict) else 0
+    age_estimate = features.get('age_estimate', {}).get('estimated_age_group', 'unknown') if isinstance(features.get('age_estimate'), dict) else 'unknown'
+    skin_tone = features.get('skin_tone', {}).get('skin_tone', 'unknown') if isinstance(features.get('skin_tone'), dict) else features.get('skin_tone', 'unknown')
+
+    return (eye_color, hair_color, eye_distance, nose_width, mouth_width, eyebrow_shape,
+            skin_features, facial_asymmetry, age_estimate, skin_tone)
+
+def save_face_features(pesel: str, features: dict, feature_version: str = None) -> bool:
     """
     Zapisz cechy szczególne twarzy do tabeli 'face_features'
+    feature_version: wersja analizy cech (np. 'features/retinaface/v3') - reindex
     """
     try:
         db = get_db()
         cursor = db.cursor()
 
-        # Konwertuj features na JSON
+        # Konwertuj features na JSON + wektor liczbowy (galeria cech)
         features_json = json.dumps(features)
+        feature_vector = encode_feature_vector(features)
 
         # Wyciągnij konkretne pola
-        eye_color = features.get('eye_color', {}).get('name', 'unknown') if isinstance(features.get('eye_color'), dict) else features.get('eye_color', 'unknown')
-        hair_color = features.get('hair_color', {}).get('name', 'unknown') if isinstance(features.get('hair_color'), dict) else features.get('hair_color', 'unknown')
-        eye_distance = features.get('eye_distance', {}).get('normalized_distance', 0) if isinstance(features.get('eye_distance'), dict) else 0
-        nose_width = features.get('nose_width', {}).get('width_estimate', 0) if isinstance(features.get('nose_width'), dict) else 0
-        mouth_width = features.get('mouth_width', {}).get('aspect_ratio', 0) if isinstance(features.get('mouth_width'), dict) else 0
-        eyebrow_shape = features.get('eyebrow_shape', {}).get('shape_description', 'unknown') if isinstance(features.get('eyebrow_shape'), dict) else features.get('eyebrow_shape', 'unknown')
-        skin_features = features.get('skin_features', {}).get('texture_description', 'unknown') if isinstance(features.get('skin_features'), dict) else 'unknown'
-        facial_asymmetry = features.get('facial_asymmetry', {}).get('asymmetry_score', 0) if isinstance(features.get('facial_asymmetry'), dict) else 0
-        age_estimate = features.get('age_estimate', {}).get('estimated_age_group', 'unknown') if isinstance(features.get('age_estimate'), dict) else 'unknown'
-        skin_tone = features.get('skin_tone', {}).get('skin_tone', 'unknown') if isinstance(features.get('skin_tone'), dict) else features.get('skin_tone', 'unknown')
-
-        # Sprawdź czy features już istnieją
-        cursor.execute(
-            'SELECT id FROM face_features WHERE pesel = ?',
-            (pesel,)
-        )
+        (eye_color, hair_color, eye_distance, nose_width, mouth_width, eyebrow_shape,
+         skin_features, facial_asymmetry, age_estimate, skin_tone) = _feature_columns(features)
 
-        existing = cursor.fetchone()
-
-        if existing:
-            # Update istniejących
-            cursor.execute('''
-                UPDATE face_features 
-                SET eye_color = ?, hair_color = ?, eye_distance = ?, nose_width = ?,
-                    mouth_width = ?, eyebrow_shape = ?, skin_features = ?,
-                    facial_asymmetry = ?, age_estimate = ?, skin_tone = ?, features_json = ?
-                WHERE pesel = ?
-            ''', (eye_color, hair_color, eye_distance, nose_width, mouth_width,
-                  eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone,
-                  features_json, pesel))
-            print(f"   ✅ Features UPDATED for {pesel}")
-        else:
-            # Wstaw nowe
-            cursor.execute('''
-                INSERT INTO face_features 
-                (pesel, eye_color, hair_color, eye_distance, nose_width, mouth_width,
-                 eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone, features_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (pesel, eye_color, hair_color, eye_distance, nose_width, mouth_width,
-                  eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone,
-                  features_json))
-            print(f"   ✅ Features INSERTED for {pesel}")
+        # ⭐ UPSERT (pesel UNIQUE) - jak save_face_encoding, bez wyścigu SELECT + INSERT
+        cursor.execute('''
+            INSERT INTO face_features
+            (pesel, eye_color, hair_color, eye_distance, nose_width, mouth_width,
+             eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone,
+             features_json, feature_vector, feature_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (pesel) DO UPDATE SET
+                eye_color = excluded.eye_color, hair_color = excluded.hair_color,
+                eye_distance = excluded.eye_distance, nose_width = excluded.nose_width,
+                mouth_width = excluded.mouth_width, eyebrow_shape = excluded.eyebrow_shape,
+                skin_features = excluded.skin_features, facial_asymmetry = excluded.facial_asymmetry,
+                age_estimate = excluded.age_estimate, skin_tone = excluded.skin_tone,
+                features_json = excluded.features_json, feature_vector = excluded.feature_vector,
+                feature_version = excluded.feature_version
+        ''', (pesel, eye_color, hair_color, eye_distance, nose_width, mouth_width,
+              eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone,
+              features_json, feature_vector, feature_version))
+        print(f"   ✅ Features SAVED for {pesel}")
 
         db.commit()
         db.close()
@@ -364,6 +787,263 @@ def get_all_face_features() -> dict:
         print(f"❌ Error getting all features: {str(e)}")
         return {}
 
+def load_feature_matrix():
+    """
+    ⭐ Wczytaj cechy wszystkich osób jako tablicę FEATURE_VECTOR_DTYPE (jedna na wiersz)
+    Zwraca: (pesels, vectors)
+
+    Wiersze z feature_vector sklejane i dekodowane JEDNYM np.frombuffer,
+    stare wiersze (tylko features_json) kodowane przy ładowaniu.
+    """
+    try:
+        db = get_db()
+        rows = db.execute('''
+            SELECT pesel, feature_vector, features_json FROM face_features
+            WHERE feature_vector IS NOT NULL OR features_json IS NOT NULL
+        ''').fetchall()
+        db.close()
+
+        pesels = []
+        chunks = []
+        legacy = 0
+
+        for pesel, vector, features_json in rows:
+            if isinstance(vector, bytes) and len(vector) == FEATURE_VECTOR_DTYPE.itemsize:
+                chunks.append(vector)
+            else:
+                features = json.loads(features_json) if features_json else None
+                if not features or not isinstance(features, dict):
+                    continue
+                chunks.append(encode_feature_vector(features))
+                legacy += 1
+            pesels.append(pesel)
+
+        vectors = np.frombuffer(b''.join(chunks), dtype=FEATURE_VECTOR_DTYPE)
+
+        print(f"   📊 Loaded {len(pesels)} feature vectors from face_features table"
+              + (f" ({legacy} encoded from features_json)" if legacy else ""))
+        return pesels, vectors
+
+    except Exception as e:
+        print(f"❌ Error loading feature matrix: {str(e)}")
+        return [], np.empty(0, dtype=FEATURE_VECTOR_DTYPE)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📝 ZADANIA W TLE - STATUS WSPÓLNY DLA WSZYSTKICH PROCESÓW (serve.py)
+# ═══════════════════════════════════════════════════════════════════════════
+
+def save_job(job: dict) -> bool:
+    """Zapisz (albo nadpisz) status zadania"""
+    try:
+        db = get_db()
+        with db:
+            db.execute('''
+                INSERT INTO jobs (id, state, job_json, finished_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    state = excluded.state,
+                    job_json = excluded.job_json,
+                    finished_at = excluded.finished_at
+            ''', (job['id'], job['state'], json.dumps(job), job.get('finished_at')))
+        db.close()
+        return True
+
+    except Exception as e:
+        print(f"❌ Error saving job {job.get('id')}: {str(e)}")
+        return False
+
+def get_job(job_id: str) -> dict:
+    """Status zadania z bazy (None gdy nieznane)"""
+    try:
+        db = get_db()
+        row = db.execute('SELECT job_json FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        db.close()
+        return json.loads(row['job_json']) if row else None
+
+    except Exception as e:
+        print(f"❌ Error getting job {job_id}: {str(e)}")
+        return None
+
+def fail_unfinished_jobs(error: str, pid: int = None) -> int:
+    """
+    Zadania queued / running -> failed (proces, który je liczył, już nie żyje)
+    pid: tylko zadania tego procesu (None = wszystkie niezakończone)
+    Zwraca: liczba oznaczonych zadań
+    """
+    try:
+        db = get_db()
+        rows = db.execute("SELECT job_json FROM jobs WHERE state IN ('queued', 'running')").fetchall()
+
+        now = time.time()
+        failed = []
+        for row in rows:
+            job = json.loads(row['job_json'])
+            if pid is not None and job.get('pid') != pid:
+                continue
+            job.update(state='failed', error=error, finished_at=now)
+            failed.append(job)
+
+        with db:
+            # Warunek na state - zadanie zakończone w międzyczasie zostaje bez zmian
+            db.executemany('''
+                UPDATE jobs SET state = ?, job_json = ?, finished_at = ?
+                WHERE id = ? AND state IN ('queued', 'running')
+            ''', [(job['state'], json.dumps(job), now, job['id']) for job in failed])
+        db.close()
+        return len(failed)
+
+    except Exception as e:
+        print(f"❌ Error failing unfinished jobs: {str(e)}")
+        return 0
+
+def delete_jobs_finished_before(cutoff: float) -> int:
+    """Usuń zakończone zadania starsze niż cutoff (time.time())"""
+    try:
+        db = get_db()
+        with db:
+            deleted = db.execute(
+                'DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (cutoff,)
+            ).rowcount
+        db.close()
+        return deleted
+
+    except Exception as e:
+        print(f"❌ Error deleting old jobs: {str(e)}")
+        return 0
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🔁 REINDEX - STRUMIENIOWANIE OSÓB I ZAPIS PACZKAMI
+# ═══════════════════════════════════════════════════════════════════════════
+
+def count_people_with_photos(after_pesel: str = '') -> int:
+    """Liczba osób ze zdjęciem (PESEL > after_pesel) - do raportu postępu"""
+    db = get_db()
+    count = db.execute(
+        "SELECT COUNT(*) FROM faces WHERE photo_path IS NOT NULL AND photo_path != '' AND pesel > ?",
+        (after_pesel,)
+    ).fetchone()[0]
+    db.close()
+    return count
+
+def iter_people_with_photos(after_pesel: str = '', page_size: int = 500):
+    """
+    ⭐ Strumieniuj (pesel, photo_path) z tabeli 'faces' w kolejności PESEL
+    Paginacja po kluczu (pesel > ostatni) - bez trzymania całej tabeli w pamięci
+    i bez długiej transakcji czytającej blokującej Node.js
+    """
+    last_pesel = after_pesel
+    while True:
+        db = get_db()
+        rows = db.execute('''
+            SELECT pesel, photo_path FROM faces
+            WHERE photo_path IS NOT NULL AND photo_path != '' AND pesel > ?
+            ORDER BY pesel
+            LIMIT ?
+        ''', (last_pesel, page_size)).fetchall()
+        db.close()
+
+        if not rows:
+            return
+
+        for row in rows:
+            yield row['pesel'], row['photo_path']
+        last_pesel = rows[-1]['pesel']
+
+def get_people_photos(pesels: list) -> list:
+    """[(pesel, photo_path)] podanych osób ze zdjęciem, w kolejności PESEL (ponowienia reindexu)"""
+    if not pesels:
+        return []
+
+    db = get_db()
+    placeholders = ','.join('?' * len(pesels))
+    rows = db.execute(f'''
+        SELECT pesel, photo_path FROM faces
+        WHERE photo_path IS NOT NULL AND photo_path != '' AND pesel IN ({placeholders})
+        ORDER BY pesel
+    ''', list(pesels)).fetchall()
+    db.close()
+    return [(row['pesel'], row['photo_path']) for row in rows]
+
+def get_encoding_versions(pesels: list) -> dict:
+    """{(pesel, model_name): model_version} dla podanych osób"""
+    if not pesels:
+        return {}
+
+    db = get_db()
+    placeholders = ','.join('?' * len(pesels))
+    rows = db.execute(
+        f'SELECT pesel, model_name, model_version FROM face_encodings WHERE pesel IN ({placeholders})',
+        list(pesels)
+    ).fetchall()
+    db.close()
+    return {(row['pesel'], row['model_name']): row['model_version'] for row in rows}
+
+def get_feature_versions(pesels: list) -> dict:
+    """{pesel: feature_version} dla podanych osób (brak wiersza cech = brak klucza)"""
+    if not pesels:
+        return {}
+
+    db = get_db()
+    placeholders = ','.join('?' * len(pesels))
+    rows = db.execute(
+        f'SELECT pesel, feature_version FROM face_features WHERE pesel IN ({placeholders})',
+        list(pesels)
+    ).fetchall()
+    db.close()
+    return {row['pesel']: row['feature_version'] for row in rows}
+
+def save_reindex_batch(encoding_rows: list, feature_rows: list) -> bool:
+    """
+    ⭐ Zapisz paczkę encodingów + cech w JEDNEJ transakcji
+
+    Args:
+        encoding_rows: [(pesel, model_name, model_version, encoding), ...]
+        feature_rows: [(pesel, features_dict, feature_version), ...]
+    """
+    try:
+        db = get_db()
+        with db:
+            db.executemany('''
+                INSERT INTO face_encodings (pesel, encoding, model_name, model_version, dimensions)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (pesel, model_name) DO UPDATE SET
+                    encoding = excluded.encoding,
+                    model_version = excluded.model_version,
+                    dimensions = excluded.dimensions
+            ''', [
+                (pesel, encode_encoding(encoding), model_name, model_version, len(encoding))
+                for pesel, model_name, model_version, encoding in encoding_rows
+            ])
+
+            db.executemany('''
+                INSERT INTO face_features
+                (pesel, eye_color, hair_color, eye_distance, nose_width, mouth_width,
+                 eyebrow_shape, skin_features, facial_asymmetry, age_estimate, skin_tone,
+                 features_json, feature_vector, feature_version)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (pesel) DO UPDATE SET
+                    eye_color = excluded.eye_color, hair_color = excluded.hair_color,
+                    eye_distance = excluded.eye_distance, nose_width = excluded.nose_width,
+                    mouth_width = excluded.mouth_width, eyebrow_shape = excluded.eyebrow_shape,
+                    skin_features = excluded.skin_features, facial_asymmetry = excluded.facial_asymmetry,
+                    age_estimate = excluded.age_estimate, skin_tone = excluded.skin_tone,
+                    features_json = excluded.features_json, feature_vector = excluded.feature_vector,
+                    feature_version = excluded.feature_version
+            ''', [
+                (pesel, *_feature_columns(features), json.dumps(features), encode_feature_vector(features),
+                 feature_version)
+                for pesel, features, feature_version in feature_rows
+            ])
+        db.close()
+
+        invalidate_encodings_version()
+        return True
+
+    except Exception as e:
+        print(f"❌ Error saving reindex batch: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 # ═══════════════════════════════════════════════════════════════════════════
 # 📚 UTILITY FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════
@@ -400,10 +1080,13 @@ def get_statistics() -> dict:
         cursor.execute('SELECT COUNT(*) as count FROM faces')
         total_persons = cursor.fetchone()['count']
 
-        # Liczba encodingów
-        cursor.execute('SELECT COUNT(*) as count FROM face_encodings')
+        # Liczba osób z encodingiem (+ rozbicie na modele)
+        cursor.execute('SELECT COUNT(DISTINCT pesel) as count FROM face_encodings')
         total_encodings = cursor.fetchone()['count']
 
+        cursor.execute('SELECT model_name, COUNT(*) as count FROM face_encodings GROUP BY model_name')
+        encodings_by_model = {row['model_name']: row['count'] for row in cursor.fetchall()}
+
         # Liczba cech
         cursor.execute('SELECT COUNT(*) as count FROM face_features')
         total_features = cursor.fetchone()['count']
@@ -413,6 +1096,7 @@ def get_statistics() -> dict:
         return {
             'total_persons': total_persons,
             'total_encodings': total_encodings,
+            'encodings_by_model': encodings_by_model,
             'total_features': total_features,
             'coverage': {
                 'encodings': f"{(total_encodings/total_persons*100):.1f}%" if total_persons > 0 else "0%",
@@ -374,19 +374,29 @@ app.get('/api/activity-logs/stats', async (req, res) => {
   }
 });
 
+const imageFileFilter = (req, file, cb) => {
+  const allowedTypes = /jpeg|jpg|png|bmp/;
+  const extname = allowedTypes.test(path.extname(file.originalname).toLowerCase());
+  const mimetype = allowedTypes.test(file.mimetype);
+  
+  if (mimetype && extname) {
+    return cb(null, true);
+  }
+  cb(new Error('Tylko pliki obrazów są dozwolone!'));
+};
+
 const upload = multer({ 
   storage: storage,
   limits: { fileSize: 5 * 1024 * 1024 },
-  fileFilter: (req, file, cb) => {
-    const allowedTypes = /jpeg|jpg|png|bmp/;
-    const extname = allowedTypes.test(path.extname(file.originalname).toLowerCase());
-    const mimetype = allowedTypes.test(file.mimetype);
-    
-    if (mimetype && extname) {
-      return cb(null, true);
-    }
-    cb(new Error('Tylko pliki obrazów są dozwolone!'));
-  }
+  fileFilter: imageFileFilter
+});
+
+// 📸 Rozpoznawanie - zdjęcie tylko w pamięci, bajty idą prosto do Pythona
+// (bez zapisu do uploads/, ponownego odczytu i usuwania pliku)
+const memoryUpload = multer({
+  storage: multer.memoryStorage(),
+  limits: { fileSize: 5 * 1024 * 1024 },
+  fileFilter: imageFileFilter
 });
 
 // 🧮 Funkcja generująca wektor twarzy
@@ -501,7 +511,7 @@ app.post('/api/register', upload.single('photo'), async (req, res) => {
 });
 
 // 📍 ENDPOINT 3: Rozpoznawanie twarzy
-app.post('/api/recognize', upload.single('photo'), async (req, res) => {
+app.post('/api/recognize', memoryUpload.single('photo'), async (req, res) => {
   try {
     if (!req.file) {
       return res.status(400).json({
@@ -510,22 +520,17 @@ app.post('/api/recognize', upload.single('photo'), async (req, res) => {
       });
     }
 
-    const photoPath = `/uploads/${req.file.filename}`;
-    
-    // Wyślij do Python serwera
+    // Wyślij do Python serwera - surowe bajty zdjęcia
     try {
       const pythonResponse = await fetch('http://localhost:5001/api/recognize-face', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ photo_path: photoPath }),
+        headers: { 'Content-Type': req.file.mimetype },
+        body: req.file.buffer,
         timeout: 1200000  // 120 sekund (zamiast 30)
       });
 
       const result = await pythonResponse.json();
       
-      // Usuń plik tymczasowy
-      fs.unlinkSync(req.file.path);
-      
       // Zapisz do historii jeśli rozpoznano
       if (result.Rozpoznano) {
         await runAsync(
@@ -548,7 +553,6 @@ app.post('/api/recognize', upload.single('photo'), async (req, res) => {
       const faces = await allAsync('SELECT * FROM faces');
 
       if (faces.length === 0) {
-        fs.unlinkSync(req.file.path);
         return res.json({
           Rozpoznano: false,
           Wiadomosc: 'Brak zarejestrowanych twarzy!'
@@ -569,8 +573,6 @@ app.post('/api/recognize', upload.single('photo'), async (req, res) => {
         }
       });
 
-      fs.unlinkSync(req.file.path);
-
       if (bestMatch && highestSimilarity > THRESHOLD) {
         console.log(`🔍 Rozpoznano twarz: ${bestMatch.first_name} ${bestMatch.last_name}`);
         res.json({
@@ -596,9 +598,6 @@ app.post('/api/recognize', upload.single('photo'), async (req, res) => {
     }
   } catch (error) {
     console.error('❌ Błąd rozpoznawania:', error);
-    if (req.file && fs.existsSync(req.file.path)) {
-      fs.unlinkSync(req.file.path);
-    }
     res.status(500).json({
       Rozpoznano: false,
       Wiadomosc: error.message